@@ -0,0 +1,263 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# benchmarks of the tree pipeline on synthetic data (see 'synthetic_data.py')
+#
+# every stage runs in its own process on a dataset of the given scale:
+# its inputs are prepared first (not measured), then wall time, cpu time,
+# peak rss and the growth of the peak rss during the stage are recorded.
+# cpu time and peak rss include the worker processes of a stage (i.e. 'merge_reps_meta'),
+# peak rss is only available with the unix only 'resource' module.
+# with '--tracemalloc' the peak of python allocations is recorded as well (slows stages down).
+# a stage that fails, i.e. runs out of memory or over '--timeout', is recorded with its error,
+# the benchmark continues with the next one.
+#
+# results are written as json, '--compare' prints the change to an earlier result file.
+#
+# usage:
+#   python -m benchmarks.run_benchmarks [--scales 1 10 100] [--stages ...] [--output results.json]
+#
+#################################
+
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from benchmarks.synthetic_data import generate_dataset
+from utils.instrumentation import children_cpu_seconds, peak_rss_mb
+
+
+STAGES = ["merge_reps_meta", "parse_haplo_motifs", "xml_tree_parsing",
+          "tree_to_json", "create_newick_tree", "create_bare_tree"]
+
+DEFAULT_SCALES = [1, 10, 100]
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+
+# peak rss of the stage process or of its largest worker process, None without the 'resource' module
+def _peak_rss_mb():
+    peaks = [peak for peak in (peak_rss_mb(), peak_rss_mb(children=True)) if peak is not None]
+    return max(peaks) if peaks else None
+
+
+# prepares the inputs of a stage and returns the function to measure
+# runs with the dataset directory as working directory, so all default paths point to it
+def _prepare_stage(stage):
+    # imported here, so every stage process only loads what it needs
+    from utils.path_defaults import XML_FILE, MOTIF_SIGNATURES
+
+    if stage == "merge_reps_meta":
+        from merge_reps_meta import main
+        return main
+    if stage == "parse_haplo_motifs":
+        from utils.hgmotif_creation import parse_haplo_motifs
+        return lambda: parse_haplo_motifs(MOTIF_SIGNATURES)
+
+    from utils.xml_tree_parser import xml_tree_parsing, tree_to_json, create_newick_tree, create_bare_tree
+    if stage == "xml_tree_parsing":
+        return lambda: xml_tree_parsing(XML_FILE)
+
+    from utils.file_readers import csv_as_dict, read_txt
+    from utils.path_defaults import COLORCODE_FILE, SUPERHAPLO_FILE, PHYLO_SUPERHAPLO_FILE
+
+    tree, root = xml_tree_parsing(XML_FILE)
+    superhaplo = read_txt(SUPERHAPLO_FILE)
+
+    if stage == "tree_to_json":
+        color_dict = csv_as_dict(COLORCODE_FILE, delimiter=",")
+        phylo_superhaplo = read_txt(PHYLO_SUPERHAPLO_FILE)
+        # without profiles, as in the pipeline
+        return lambda: tree_to_json(tree, root, color_dict, superhaplo, phylo_superhaplo)
+    if stage == "create_newick_tree":
+        return lambda: create_newick_tree(tree, root)
+    if stage == "create_bare_tree":
+        return lambda: create_bare_tree(tree, root, superhaplo, remove_add=True)
+
+    raise ValueError(f"Unknown stage '{stage}'. Expected one of {STAGES}.")
+
+
+def _run_stage(stage, data_dir, use_tracemalloc, conn):
+    os.chdir(data_dir)
+    # stages print progress and warn about every missing accession, neither is of interest here
+    warnings.simplefilter("ignore")
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run = _prepare_stage(stage)
+            rss_before = _peak_rss_mb()
+            if use_tracemalloc:
+                tracemalloc.start()
+
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            children_start = children_cpu_seconds()
+            run()
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            worker_cpu = children_cpu_seconds() - children_start
+            rss_after = _peak_rss_mb()
+
+            result = {
+                "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu + worker_cpu, 4),
+                "worker_cpu_seconds": round(worker_cpu, 4),
+                "peak_rss_mb": None if rss_after is None else round(rss_after, 1),
+                "rss_growth_mb": None if rss_after is None else round(rss_after - rss_before, 1),
+            }
+            if use_tracemalloc:
+                result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+                tracemalloc.stop()
+    except BaseException as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+
+    conn.send(result)
+    conn.close()
+
+
+def benchmark_stage(stage, data_dir, use_tracemalloc=False, timeout=None):
+    """
+    Runs a single stage in a fresh process, so its peak memory is not mixed up with other stages.
+    Returns the dict of measurements, or of the error the stage failed with.
+    """
+    context = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_stage, args=(stage, data_dir, use_tracemalloc, sender))
+    process.start()
+    sender.close()
+
+    result = None
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            pass
+    process.join(0 if result is None else None)
+
+    if process.is_alive():
+        process.kill()
+        process.join()
+        return {"error": f"timeout after {timeout} s"}
+    if result is None:
+        # killed without a result, i.e. by the out of memory killer
+        return {"error": f"process exited with code {process.exitcode}"}
+    return result
+
+
+def benchmark_scale(scale, stages, data_dir, seed=0, use_tracemalloc=False, timeout=None):
+    print(f"\nScale {scale:g}x: generating data in {data_dir}")
+    start = time.perf_counter()
+    sizes = generate_dataset(data_dir, scale=scale, seed=seed)
+    generation = time.perf_counter() - start
+    print(f"  {sizes['nodes']} nodes, {sizes['accessions']} accessions, generated in {generation:.1f} s")
+
+    results = {}
+    for stage in stages:
+        results[stage] = benchmark_stage(stage, data_dir, use_tracemalloc, timeout)
+        print(f"  {stage}: {_format_result(results[stage])}")
+
+    return {"scale": scale, "seed": seed, "sizes": sizes,
+            "generation_seconds": round(generation, 2), "stages": results}
+
+
+def _format_result(result):
+    if "error" in result:
+        return f"FAILED ({result['error']})"
+    text = f"{result['wall_seconds']:.3f} s wall, {result['cpu_seconds']:.3f} s cpu"
+    if result.get("worker_cpu_seconds"):
+        text += f" ({result['worker_cpu_seconds']:.3f} s in workers)"
+    if result["peak_rss_mb"] is not None:
+        text += f", peak rss {result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB)"
+    if "tracemalloc_peak_mb" in result:
+        text += f", traced peak {result['tracemalloc_peak_mb']:.0f} MB"
+    return text
+
+
+def compare_results(previous, current):
+    """
+    Prints wall time and peak rss of 'current' relative to 'previous' for every scale and stage in both.
+    """
+    previous_runs = {run["scale"]: run for run in previous["runs"]}
+    print(f"\nChange since {previous.get('created', 'previous run')}:")
+    for run in current["runs"]:
+        previous_run = previous_runs.get(run["scale"])
+        if previous_run is None:
+            continue
+        for stage, result in run["stages"].items():
+            last = previous_run["stages"].get(stage)
+            if not last or "error" in last or "error" in result:
+                continue
+            wall = result["wall_seconds"] / last["wall_seconds"] if last["wall_seconds"] else float("nan")
+            text = f"  {run['scale']:g}x {stage}: wall x{wall:.2f}"
+            if result["peak_rss_mb"] is not None and last["peak_rss_mb"] is not None:
+                text += f", peak rss {result['peak_rss_mb'] - last['peak_rss_mb']:+.0f} MB"
+            print(text)
+
+
+def main(scales=DEFAULT_SCALES, stages=STAGES, output=None, data_dir=None, seed=0,
+         use_tracemalloc=False, timeout=None, compare=None):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # stage processes change into the dataset directory, the repo has to stay importable
+    sys.path.insert(0, repo_dir)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+
+    for scale in scales:
+        if data_dir:
+            scale_dir = os.path.join(os.path.abspath(data_dir), f"scale_{scale:g}")
+            report["runs"].append(benchmark_scale(scale, stages, scale_dir, seed, use_tracemalloc, timeout))
+        else:
+            with tempfile.TemporaryDirectory(prefix=f"mitoleaf_bench_{scale:g}_") as scale_dir:
+                report["runs"].append(benchmark_scale(scale, stages, scale_dir, seed, use_tracemalloc, timeout))
+
+    if output is None:
+        os.makedirs(os.path.join(repo_dir, RESULTS_DIR), exist_ok=True)
+        output = os.path.join(repo_dir, RESULTS_DIR,
+                              f"benchmark_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {output}")
+
+    if compare:
+        with open(compare, "r") as f:
+            compare_results(json.load(f), report)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tree pipeline on synthetic data.")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES,
+                        help="dataset sizes relative to the current data (default: 1 10 100)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to benchmark")
+    parser.add_argument("--output", help=f"result json file (default: a new file in {RESULTS_DIR})")
+    parser.add_argument("--data-dir", help="keep generated datasets in this directory instead of a temp dir")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="also record the peak of python allocations")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds after which a stage is aborted")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    main(args.scales, args.stages, args.output, args.data_dir, args.seed,
+         args.tracemalloc, args.timeout, args.compare)
@@ -0,0 +1,279 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# generator of synthetic pipeline inputs at any scale
+#
+# writes the same files as found in 'inputfiles', laid out the same way below 'out_dir':
+# - phylotree like xml tree with 'HG' branch mutations (mutations, insertions, heteroplasmies, reversions)
+# - .emp file with the matching full hg signatures and the random reference they are relative to as rCRS fasta file
+# - colorcode, superhaplo and phylo superhaplo files
+# - representatives of all haplogroups and reps / metadata files of every source in 'SOURCES'
+#
+# sizes default to today's data (see 'BASE_SIZES'), multiplied by 'scale'.
+# the output only depends on the arguments, so runs at the same scale are comparable.
+#
+# usage:
+#   python -m benchmarks.synthetic_data <out_dir> [--scale 10] [--seed 0]
+#
+#################################
+
+import argparse
+import csv
+import os
+import random
+from xml.sax.saxutils import quoteattr
+
+from utils.path_defaults import (XML_FILE,
+                                 MOTIF_SIGNATURES,
+                                 REFERENCE_FILE,
+                                 COLORCODE_FILE,
+                                 SUPERHAPLO_FILE,
+                                 PHYLO_SUPERHAPLO_FILE,
+                                 ALL_REPS,
+                                 EMPOP_REPS,
+                                 EMPOP_META,
+                                 K_META,
+                                 NCBI_REPS,
+                                 NCBI_META,
+                                 OUTPUT_DIR)
+from utils.signature_engine import (NUM_BUCKETS,
+                                    REFERENCE_LENGTH,
+                                    apply_delta,
+                                    signature_string)
+
+
+# sizes of the current data, scaled by 'scale'
+BASE_SIZES = {
+    "nodes": 6409,
+    "ncbi_accessions": 64546,
+    "empop_accessions": 85,
+    "k_genomes_accessions": 1267,
+    "superhaplos": 100,
+}
+
+BASES = "ACGT"
+HETEROPLASMY = "RYMKSW"
+TECHNOLOGIES = ["Illumina HiSeq", "Illumina MiSeq", "Ion Torrent", "Sanger", "Nanopore"]
+COUNTRIES = ["Austria", "Cameroon", "Japan", "Peru", "Nigeria", "Finland", "India", "Brazil"]
+
+
+# child names like phylotree, alternating digits and letters per level: L0 -> L0a -> L0a1 -> L0a1a
+def _child_name(parent_name, index, depth):
+    if depth % 2 == 0:
+        suffix = ""
+        index += 1
+        while index:
+            index, rest = divmod(index - 1, 26)
+            suffix = chr(ord("a") + rest) + suffix
+        return parent_name + suffix
+    return parent_name + str(index + 1)
+
+
+def _branch_mutations(rng, signature, reference):
+    """
+    1 to 4 random branch mutations in the notation of the xml 'HG' attribute:
+    mostly substitutions, some insertions, heteroplasmies and reversions of inherited mutations.
+    """
+    mutations = []
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.random()
+        position = rng.randint(1, REFERENCE_LENGTH)
+
+        if kind < 0.08:
+            inherited = [mutation for bucket in signature for (pos, ins), mutation in bucket if not ins]
+            if inherited:
+                position = int(rng.choice(inherited).rstrip(BASES + HETEROPLASMY + "-"))
+                mutations.append(f"{position}{reference[position]}")
+                continue
+        if kind < 0.12:
+            mutations.append(f"{position}.{rng.randint(1, 2)}{rng.choice(BASES)}")
+        elif kind < 0.15:
+            mutations.append(f"{position}{rng.choice(HETEROPLASMY)}")
+        elif kind < 0.18:
+            mutations.append(f"{position}-")
+        else:
+            mutations.append(f"{position}{rng.choice([b for b in BASES if b != reference[position]])}")
+    return mutations
+
+
+def generate_tree(rng, num_nodes, max_depth=25, branching=2.2, leaf_fraction=0.55):
+    """
+    Random tree of 'num_nodes' nodes with at most 'max_depth' levels.
+    A 'leaf_fraction' of the nodes get no children, the number of children of the others
+    is geometric with mean 'branching' (defaults are those of the current tree).
+
+    Returns a list of (name, parent index, depth), parents before children.
+    """
+    nodes = [("mt-MRCA", -1, 0)]
+    next_parent = 0
+    num_children = {0: 0}
+
+    while len(nodes) < num_nodes:
+        if next_parent >= len(nodes):
+            # every node got its children, continue attaching to random nodes
+            parent = rng.randrange(len(nodes))
+        else:
+            parent = next_parent
+            next_parent += 1
+
+        name, _, depth = nodes[parent]
+        if depth >= max_depth or (parent and rng.random() < leaf_fraction):
+            continue
+
+        children = 1
+        while rng.random() < 1 - 1 / branching:
+            children += 1
+
+        for _ in range(min(children, num_nodes - len(nodes))):
+            index = num_children[parent]
+            num_children[parent] += 1
+            child = len(nodes)
+            nodes.append((_child_name(name if parent else "L", index, depth + 1), parent, depth + 1))
+            num_children[child] = 0
+
+    return nodes
+
+
+def _write_xml(xml_file, nodes, deltas):
+    children = [[] for _ in nodes]
+    for index, (_, parent, _) in enumerate(nodes):
+        if parent >= 0:
+            children[parent].append(index)
+
+    with open(xml_file, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!--\nsynthetic tree\n-->\n')
+        # iterative, trees may be deeper than the recursion limit
+        stack = [(0, True)]
+        while stack:
+            index, entering = stack.pop()
+            indent = "  " * nodes[index][2]
+            if not entering:
+                f.write(f"{indent}</Node>\n")
+                continue
+            f.write(f'{indent}<Node Id={quoteattr(nodes[index][0])} HG={quoteattr(" ".join(deltas[index]))}>\n')
+            stack.append((index, False))
+            stack.extend((child, True) for child in reversed(children[index]))
+
+
+def _write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _metadata_row(rng, accession):
+    return [accession, rng.choice(TECHNOLOGIES), rng.choice(COUNTRIES)]
+
+
+def generate_dataset(out_dir, scale=1.0, seed=0, max_depth=25, branching=2.2, sizes=None):
+    """
+    Writes a full set of synthetic pipeline inputs to 'out_dir'.
+
+    :param out_dir: root directory, files are written to the paths of 'path_defaults' below it
+    :param scale: factor applied to all of 'BASE_SIZES'
+    :param seed: seed of the random generator
+    :param max_depth: maximum depth of the tree
+    :param branching: mean number of children per inner node
+    :param sizes: overrides of single entries of 'BASE_SIZES' (not scaled)
+    :return: dict of the generated sizes
+    """
+    rng = random.Random(seed)
+    sizes = dict({key: max(1, round(value * scale)) for key, value in BASE_SIZES.items()}, **(sizes or {}))
+
+    def path(relative):
+        full_path = os.path.join(out_dir, relative)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+
+    os.makedirs(os.path.join(out_dir, OUTPUT_DIR), exist_ok=True)
+
+    # reference bases, position 1-based
+    reference = [""] + [rng.choice(BASES) for _ in range(REFERENCE_LENGTH)]
+    reference_dict = {position: base for position, base in enumerate(reference) if base}
+    with open(path(REFERENCE_FILE), "w") as f:
+        f.write(">synthetic reference\n")
+        sequence = "".join(reference)
+        f.write("\n".join(sequence[i:i + 70] for i in range(0, len(sequence), 70)) + "\n")
+
+    ### tree and signatures
+    nodes = generate_tree(rng, sizes["nodes"], max_depth, branching)
+    deltas = []
+    signatures = []
+    for index, (_, parent, _) in enumerate(nodes):
+        parent_signature = signatures[parent] if parent >= 0 else tuple(() for _ in range(NUM_BUCKETS))
+        delta = _branch_mutations(rng, parent_signature, reference)
+        deltas.append(delta)
+        signatures.append(apply_delta(parent_signature, " ".join(delta), reference_dict))
+
+    _write_xml(path(XML_FILE), nodes, deltas)
+
+    with open(path(MOTIF_SIGNATURES), "w") as f:
+        f.write("#! ALL\n")
+        for (name, _, _), signature in zip(nodes, signatures):
+            f.write(f"{name}\t{name}\t1\t {signature_string(signature)}\n")
+
+    ### tree attributes
+    names = [name for name, _, _ in nodes]
+    # superhaplos are the nodes closest to the root
+    superhaplos = names[1:sizes["superhaplos"] + 1]
+    with open(path(SUPERHAPLO_FILE), "w") as f:
+        f.write("\n".join(superhaplos))
+    with open(path(PHYLO_SUPERHAPLO_FILE), "w") as f:
+        f.write("\n".join(superhaplos[::4]))
+    _write_csv(path(COLORCODE_FILE), ["Id", "color_hex"],
+               [[name, f"#{rng.randrange(1 << 24):06x}"] for name in ["mt-MRCA"] + superhaplos])
+
+    ### representatives and metadata
+    ncbi = [f"SY{i:07d}.1" for i in range(sizes["ncbi_accessions"])]
+    empop_samples = [f"SYN_{i:08d}" for i in range(sizes["empop_accessions"])]
+    k_genomes = [f"NA{i:06d}" for i in range(sizes["k_genomes_accessions"])]
+
+    # every accession belongs to a random haplogroup, a few are missing in the metadata
+    profiles = {name: [] for name in names}
+    for accession in ncbi + empop_samples + k_genomes:
+        profiles[rng.choice(names)].append(accession)
+
+    _write_csv(path(ALL_REPS), ["motif", "num_profiles", "profiles"],
+               [[name, len(accessions), " ".join(accessions)] for name, accessions in profiles.items()])
+
+    with open(path(NCBI_REPS), "w") as f:
+        f.write("\n".join(ncbi))
+    _write_csv(path(NCBI_META), ["accession", "seq_tech", "geo_origin"],
+               [_metadata_row(rng, accession) for accession in ncbi if rng.random() < 0.97])
+
+    empop_set = set(empop_samples)
+    _write_csv(path(EMPOP_REPS), ["motif", "num_profiles", "profiles"],
+               [[name, len(samples), " ".join(samples)] for name, samples in
+                ((name, [a for a in accessions if a in empop_set]) for name, accessions in profiles.items()) if samples])
+    _write_csv(path(EMPOP_META), ["sample_id", "accession", "seq_tech", "asm_method", "geo_origin"],
+               [[sample, f"EMP{i:07d}", rng.choice(TECHNOLOGIES), "NA", rng.choice(COUNTRIES)]
+                for i, sample in enumerate(empop_samples)])
+
+    _write_csv(path(K_META), ["accession", "seq_tech", "geo_origin"],
+               [_metadata_row(rng, accession) for accession in k_genomes])
+
+    sizes["max_depth"] = max(depth for _, _, depth in nodes)
+    sizes["accessions"] = len(ncbi) + len(empop_samples) + len(k_genomes)
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic mitoLEAF pipeline inputs.")
+    parser.add_argument("out_dir", help="root directory of the generated inputs")
+    parser.add_argument("--scale", type=float, default=1.0, help="size relative to the current data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-depth", type=int, default=25, help="maximum depth of the tree")
+    parser.add_argument("--branching", type=float, default=2.2, help="mean number of children per inner node")
+    args = parser.parse_args()
+
+    generated = generate_dataset(args.out_dir, args.scale, args.seed, args.max_depth, args.branching)
+    print(f"Wrote synthetic inputs to {args.out_dir}: {generated}")
@@ -14,6 +14,7 @@ This file handles the haplogroups.html page.
 All functionalities  present there are handled here.
 
 Data used is fetched from tree.json and hgmotifs.json for full-HG-Sinature during has mutation search mode.
+mutation_index.json is only fetched once has mutation search mode is turned on.
  */
 
 document.addEventListener('DOMContentLoaded', function () {
@@ -32,6 +33,10 @@ document.addEventListener('DOMContentLoaded', function () {
     // array to hold filtered search results
     let filteredNodesData = [];
     let hgMotifsData = {};
+    // inverted index of mutations to haplogroups, see 'utils/mutation_index.py'
+    // only fetched once has mutation mode is turned on, see 'loadMutationIndex'
+    let mutationIndex = null;
+    let mutationIndexRequest = null;
     let currentCount = 0;
     // number of rows to show initially
     const resultsPerPage = 100;
@@ -112,6 +117,12 @@ document.addEventListener('DOMContentLoaded', function () {
             filteredNodesData = filteredNodesData.map(item => item.node);
         }
 
+        // the mutation index is still loading, search again once it is there
+        if (searchTermHG && mutationMode && !mutationIndex) {
+            loadMutationIndex().then(combinedFilterNodes, () => {});
+            return;
+        }
+
         // filter by HG
         if (searchTermHG) {
             const HGsearchTerms = getHGSearchTerms();
@@ -119,13 +130,9 @@ document.addEventListener('DOMContentLoaded', function () {
             // searching based on what is selected on the mode toggle
             if (mutationMode) {
                 // has mutation active, i.e. mutation present in full hg
-                filteredNodesData = filteredNodesData.filter(node => {
-                    const fullHGSignature = hgMotifsData[node.data.name];
-                    if (fullHGSignature) {
-                        return HGsearchTerms.every(term => rexSearch(term, fullHGSignature));
-                    }
-                    return false;
-                });
+                // looked up in the mutation index instead of searching every full hg signature
+                const matchingHaplogroups = searchMutationIndex(HGsearchTerms);
+                filteredNodesData = filteredNodesData.filter(node => matchingHaplogroups.has(node.data.name));
             } else {
                 // exact signature mode, mutation has to occur on current node
                 filteredNodesData = filteredNodesData.filter(node => {
@@ -165,6 +172,60 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
 
+    // returns the set of haplogroup names carrying mutations matching all search terms
+    // each term is matched against the mutations of the index only,
+    // then the haplogroup id lists of all terms are intersected
+    function searchMutationIndex(HGsearchTerms) {
+        let result = null;
+
+        for (const term of HGsearchTerms) {
+            const termIds = new Set();
+            mutationIndex.mutations.forEach((mutation, i) => {
+                if (rexSearch(term, mutation)) {
+                    mutationIndex.postings[i].forEach(id => termIds.add(id));
+                }
+            });
+
+            result = result === null ? termIds : new Set([...result].filter(id => termIds.has(id)));
+            if (result.size === 0) {
+                break;
+            }
+        }
+
+        return new Set([...(result || [])].map(id => mutationIndex.haplogroups[id]));
+    }
+
+
+    // fetches the mutation index on first use, so it does not hold up the first render
+    // returns the same request for every call until it is loaded
+    function loadMutationIndex() {
+        if (!mutationIndexRequest) {
+            mutationIndexRequest = d3.json('data/mutation_index.json').then(function(indexData) {
+                mutationIndex = decodeMutationIndex(indexData);
+            }).catch(function(error) {
+                // allow a new attempt with the next search
+                mutationIndexRequest = null;
+                console.error('Error loading the mutation index:', error);
+                return Promise.reject(error);
+            });
+        }
+        return mutationIndexRequest;
+    }
+
+
+    // decodes the gap encoded posting lists of the mutation index
+    function decodeMutationIndex(indexData) {
+        return {
+            haplogroups: indexData.haplogroups,
+            mutations: indexData.mutations,
+            postings: indexData.postings.map(gaps => {
+                let id = 0;
+                return gaps.map(gap => id += gap);
+            })
+        };
+    }
+
+
     // changes table header of hg column dependent on toggle
     function updateTableHeader() {
         if (searchModeToggle.checked) {
@@ -241,7 +302,11 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // event listener of mutation mode search toggle to change table header
+    // the mutation index is requested right away, before any search needs it
     searchModeToggle.addEventListener('change', function () {
+        if (searchModeToggle.checked) {
+            loadMutationIndex().catch(() => {});
+        }
         updateTableHeader();
         combinedFilterNodes();
     });
@@ -221,8 +221,10 @@ document.addEventListener('DOMContentLoaded', function () {
             });
         }
 
+        let searched;
         if (searchInHidden) {
-            searchAllNodes(root);
+            // hidden nodes may be in chunks of the tree not loaded yet
+            searched = loadSubtree(root).then(() => searchAllNodes(root));
         } else {
             // Search only visible nodes (DOM elements)
             d3.selectAll('g.node').each(function (node) {
@@ -231,50 +233,53 @@ document.addEventListener('DOMContentLoaded', function () {
                     updateBestMatch(node);
                 }
             });
+            searched = Promise.resolve();
         }
 
-        resultsNumber = matchedDataNodes.length;
+        searched.then(function () {
+            resultsNumber = matchedDataNodes.length;
 
-        // mark best match node to be focused
-        if (bestMatchNode) {
-            bestMatchNode.focused = true;
-        }
+            // mark best match node to be focused
+            if (bestMatchNode) {
+                bestMatchNode.focused = true;
+            }
 
-        update(root, 0, function() {
-            // map data nodes to DOM elements
-            matchedDataNodes.forEach(function (d) {
-                const nodeElement = d3.select('#collapsible-tree').selectAll('g.node').filter(function(datum) {
-                    return datum === d;
-                }).node();
-                if (nodeElement) {
-                    matchedNodes.push(nodeElement);
-                }
-            });
+            update(root, 0, function() {
+                // map data nodes to DOM elements
+                matchedDataNodes.forEach(function (d) {
+                    const nodeElement = d3.select('#collapsible-tree').selectAll('g.node').filter(function(datum) {
+                        return datum === d;
+                    }).node();
+                    if (nodeElement) {
+                        matchedNodes.push(nodeElement);
+                    }
+                });
 
-            // DOM element for the best match node
-            if (bestMatchNode) {
-                const bestMatchNodeElement = d3.select('#collapsible-tree').selectAll('g.node').filter(function(datum) {
-                    return datum === bestMatchNode;
-                }).node();
-
-                if (bestMatchNodeElement) {
-                    bestMatchNode = bestMatchNodeElement;
-                } else {
-                    bestMatchNode = null;
+                // DOM element for the best match node
+                if (bestMatchNode) {
+                    const bestMatchNodeElement = d3.select('#collapsible-tree').selectAll('g.node').filter(function(datum) {
+                        return datum === bestMatchNode;
+                    }).node();
+
+                    if (bestMatchNodeElement) {
+                        bestMatchNode = bestMatchNodeElement;
+                    } else {
+                        bestMatchNode = null;
+                    }
                 }
-            }
 
-            // sort matched nodes by their x position to make navigating more sensible
-            matchedNodes.sort((a, b) => {
-                const nodeA = d3.select(a).datum();
-                const nodeB = d3.select(b).datum();
-                return nodeA.x - nodeB.x;
-            });
+                // sort matched nodes by their x position to make navigating more sensible
+                matchedNodes.sort((a, b) => {
+                    const nodeA = d3.select(a).datum();
+                    const nodeB = d3.select(b).datum();
+                    return nodeA.x - nodeB.x;
+                });
 
-            // instead of returning, use the callback to ensure no async problems when scrolling to the focused node
-            if (callback) {
-                callback(bestMatchNode, resultsNumber);
-            }
+                // instead of returning, use the callback to ensure no async problems when scrolling to the focused node
+                if (callback) {
+                    callback(bestMatchNode, resultsNumber);
+                }
+            });
         });
     }
 
@@ -15,6 +15,9 @@ That includes displaying the node attributes,
 building the lineage tree,
 retrieving the full hg signature as well as the profiles for this hg.
 
+All of this is read from the small per haplogroup shard in 'data/nodes',
+the manifest maps haplogroup names to their shard file.
+
 As it is dynamic, html element creation is handled here and not in the html file.
 */
 
@@ -31,25 +34,23 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // gather necessary data
-    Promise.all([
-        d3.json('data/hgmotifs.json'),
-        d3.json('data/tree.json'),
-        d3.csv('data/profiles.csv')
-    ]).then(([hgMotifsData,
-                            treeData,
-                            profilesData]) => {
-
-        // build tree
-        const root = d3.hierarchy(treeData);
-        const node = root.descendants().find(d => d.data.name === nodeId);
-
-        if (!node) {
+    d3.json('data/nodes/manifest.json').then(manifest => {
+        const shardFile = manifest[nodeId];
+        return shardFile ? d3.json(`data/nodes/${shardFile}`) : null;
+    }).then(shard => {
+
+        if (!shard) {
             document.getElementById('node-details').textContent = 'Node not found in the data.';
             return;
         }
 
+        // wrap shard entries like d3 hierarchy nodes, as used by the row and lineage funs
+        const node = {data: {name: shard.name, HG: shard.HG, colorcode: shard.colorcode}};
+        const ancestors = shard.ancestors.map(ancestor => ({data: ancestor})).concat([node]);
+        const children = shard.children.map(child => ({data: child}));
+
         // get full hg sig
-        let fullHGSignature = hgMotifsData[nodeId] || 'N/A';
+        let fullHGSignature = shard.signature || 'N/A';
 
         // main block with profile and descendants sections in place
         document.getElementById('node-details').innerHTML = `
@@ -111,12 +112,11 @@ document.addEventListener('DOMContentLoaded', function () {
         `;
 
         // lineage tree
-        displayAncestors(getAncestors(node));
+        displayAncestors(ancestors);
         // accession profiles table
-        console.log(profilesData.length);
-        displayTable(node, profilesData, 'profiles-section', 'profile-list', 'show-more-profiles', 'profiles', 3, generateProfileRow);
+        displayTable(shard.profiles, 'profiles-section', 'profile-list', 'show-more-profiles', 3, generateProfileRow);
         // children table
-        displayTable(node, node.children || [], 'descendants-section', 'children-list', 'show-more-descendants', 'descendants', 3, generateHGRow);
+        displayTable(children, 'descendants-section', 'children-list', 'show-more-descendants', 3, generateHGRow);
 
         // subtree button handler to redirect to linear tree page
         if (viewSubtreeButton) {
@@ -138,50 +138,20 @@ document.addEventListener('DOMContentLoaded', function () {
         console.error('Error loading or processing the JSON data:', error);
     });
 
-    // given a node returns a list of all its parents until root
-    function getAncestors(node) {
-        const ancestors = [];
-        let ancestor = node;
-
-        while (ancestor) {
-            ancestors.unshift(ancestor);
-            ancestor = ancestor.parent;
-        }
-        return ancestors;
-    }
-
     // generic table with a limit and a "Show All" button
-    // the input "type" determines which table to display
-    // supply the current node as well as the data to display in the table
+    // supply the data to display in the table
+    // (profile rows are already matched to the node in its shard, including any trailing '+')
     // supply the given list and button refs and row generating function
     // generates the table by calling the row gen function up to the supplied limit
     // builds the html element within the "sectionId"
-    function displayTable(node, data, sectionId, listId, buttonId, type, limit, generateRowFn) {
+    function displayTable(data, sectionId, listId, buttonId, limit, generateRowFn) {
         const section = document.getElementById(sectionId);
         const list = document.getElementById(listId);
         const showMoreButton = document.getElementById(buttonId);
 
         list.innerHTML = '';
 
-        // filter input data based on type
-        let filteredData = [];
-        if (type === 'profiles' && node.data.profiles) {
-            filteredData = data.filter(profile => {
-                const matches = node.data.profiles.filter(nodeProfileAcc => {
-                    // compare without trailing '+' but store value with + in data
-                    // so that the table row shows the +
-                    if (nodeProfileAcc.replace(/\+$/, '') === profile.accession) {
-                        profile.accession = nodeProfileAcc;
-                        return true;
-                    }
-                    return false;
-                });
-
-                return matches.length > 0; // true if there's a match
-            });
-        } else if (type === 'descendants') {
-            filteredData = data;
-        }
+        const filteredData = data || [];
 
         if (filteredData.length > 0) {
             section.classList.remove('d-none');
@@ -45,6 +45,13 @@ const overallHeight = 21;
 const margin = {top: 40, right: 90, bottom: 30, left: 90};
 const container = d3.select("#collapsible-tree");
 
+// the tree is split into chunks by the pipeline (see 'utils/tree_chunks.py')
+// chunk 0 holds the top of the tree, deeper chunks are only fetched when their nodes are expanded
+// nodes whose children are in a chunk not yet loaded are stubs, with the number of that chunk in 'data.chunk'
+const chunkDir = "data/tree_chunks/";
+let chunkRequests = {};
+let chunkIndexRequest = null;
+
 // man fun to initialize the tree
 function createCollapsibleTree(dataUrl, passedNodeId = null, passedNodeAsRoot = null, callback = null) {
     d3.select("#collapsible-tree").select("svg").remove();
@@ -56,7 +63,7 @@ function createCollapsibleTree(dataUrl, passedNodeId = null, passedNodeAsRoot =
         .append("g")
         .attr("transform", `translate(${margin.left},${margin.top})`);
 
-    d3.json(dataUrl).then(function (treeData) {
+    loadTreeData(dataUrl, passedNodeId).then(function (treeData) {
 
         let rootNode;
         if (passedNodeId && passedNodeAsRoot) {
@@ -96,6 +103,101 @@ function createCollapsibleTree(dataUrl, passedNodeId = null, passedNodeAsRoot =
 
 }
 
+// fetches a chunk, each only once
+function loadChunk(number) {
+    if (!(number in chunkRequests)) {
+        chunkRequests[number] = d3.json(`${chunkDir}${number}.json`);
+    }
+    return chunkRequests[number];
+}
+
+// index of the chunk of every haplogroup and the parent chunk of every chunk, only needed for deep links
+function loadChunkIndex() {
+    if (!chunkIndexRequest) {
+        chunkIndexRequest = d3.json(`${chunkDir}index.json`);
+    }
+    return chunkIndexRequest;
+}
+
+// replaces the data of a stub by its subtree root in its chunk
+function fillStub(data) {
+    return loadChunk(data.chunk).then(function (chunk) {
+        const subtree = chunk.find(node => node.name === data.name);
+        data.children = subtree.children;
+        delete data.chunk;
+        return data;
+    });
+}
+
+// fills all stubs of the loaded tree data pointing to a chunk
+function fillChunk(treeData, number) {
+    const stubs = [];
+    (function findStubs(data) {
+        if (data.chunk === number) {
+            stubs.push(data);
+        }
+        (data.children || []).forEach(findStubs);
+    })(treeData);
+    return Promise.all(stubs.map(fillStub));
+}
+
+// loads the tree data, starting with the top chunk
+// given a node id, all chunks from the top down to the one with the children of that node are loaded
+// falls back to the full tree at 'dataUrl' if there are no chunks
+function loadTreeData(dataUrl, nodeId = null) {
+    return loadChunk(0).then(function (chunk) {
+        const treeData = chunk[0];
+        if (!nodeId) {
+            return treeData;
+        }
+        return loadChunkIndex().then(function (index) {
+            const path = [];
+            for (let number = index.haplogroups[nodeId]; number > 0; number = index.parents[number]) {
+                path.unshift(number);
+            }
+            // one after the other, the stubs of a chunk are in its parent chunk
+            return path.reduce((loaded, number) => loaded.then(() => fillChunk(treeData, number)), Promise.resolve())
+                .then(() => treeData);
+        });
+    }).catch(function (error) {
+        console.warn('Tree chunks not available, loading the full tree:', error);
+        return d3.json(dataUrl);
+    });
+}
+
+function isStub(node) {
+    return node.data.chunk !== undefined;
+}
+
+// loads the children of a stub from its chunk and adds them collapsed
+// resolves immediately for all other nodes
+function loadChildren(node) {
+    if (!isStub(node)) {
+        return Promise.resolve(node);
+    }
+    return fillStub(node.data).then(function (data) {
+        // already added by a concurrent call
+        if (node.children || node._children) {
+            return node;
+        }
+        const subtree = d3.hierarchy(data, d => d.children);
+        const children = subtree.children || [];
+        subtree.each(d => d.depth += node.depth);
+        children.forEach(child => child.parent = node);
+        children.forEach(collapse);
+        node._children = children.length ? children : null;
+        return node;
+    });
+}
+
+// loads all stubs below a node, i.e. before expanding or searching all of it
+function loadSubtree(node) {
+    return loadChildren(node).then(function () {
+        const children = (node.children || []).concat(node._children || []);
+        return Promise.all(children.map(loadSubtree));
+    });
+}
+
 function findNodeById(node, id) {
     if (node.data.name === id) {
         return node;
@@ -307,7 +409,7 @@ function update(source, duration = defDuration, callback = null) {
     nodeEnter.append('circle')
         .attr('class', 'node')
         .style("fill", function (d) {
-            return d._children ? "lightsteelblue" : "#fff";
+            return d._children || isStub(d) ? "lightsteelblue" : "#fff";
         })
         .attr("stroke", "black")
         .attr("r", 4.5);
@@ -349,7 +451,7 @@ function update(source, duration = defDuration, callback = null) {
         });
     nodeUpdate.select('circle.node')
         .style("fill", function (d) {
-            return d._children ? "lightsteelblue" : "#fff";
+            return d._children || isStub(d) ? "lightsteelblue" : "#fff";
         });
     addPlusMinusSymbol(nodeUpdate.select('g.node-symbol'), 4.5, '#505050', 1);
 
@@ -455,9 +557,14 @@ function click(event, d) {
     } else if (d.children) {
         collapseNode(d);
     } else if (expandOption === "Y") {
-        expandFully(d); // Expand all descendants
+        expandFully(d); // Expand all descendants, redraws once their chunks are loaded
+        return;
     } else if (expandOption === "I") {
+        loadChildren(d).then(function () {
             expandNode(d);
+            update(d);
+        });
+        return;
     }
     update(d);
 }
@@ -482,7 +589,7 @@ function addPlusMinusSymbol(selection, radius, strokeColor, strokeWidth) {
         // Remove any existing symbols before adding new ones
         group.selectAll('line').remove();
 
-        if (d._children) {
+        if (d._children || isStub(d)) {
             // Draw a plus symbol (collapsed)
             group.append('line')
                 .attr('x1', -radius)
@@ -539,15 +646,17 @@ function collapseNode(node) {
 }
 
 // click event to fully expand the tree
-// just recursively marks all children of the root th be expanded
+// loads all chunks below the node, then recursively marks all children of the root th be expanded
 // then redraws tree
 function expandFully(node=root) {
-    expandNode(node)
+    return loadSubtree(node).then(function () {
+        expandNode(node)
 
-    if (node.children) {
-        node.children.forEach(expandAllDescendantsOfNode);
-    }
-    update(node);
+        if (node.children) {
+            node.children.forEach(expandAllDescendantsOfNode);
+        }
+        update(node);
+    });
 }
 
 
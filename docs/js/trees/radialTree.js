@@ -26,18 +26,28 @@ function createRadialTree(dataUrl) {
     const radius = Math.min(width, height) / 2 - 20;
 
     d3.json(dataUrl).then(function(data) {
-        const tree = d3.tree()
-            .size([2 * Math.PI, radius])
-            // separates nodes from each other
-            .separation((a, b) => {
-                    // calc separation based on depth
-                    const depthFactor = 1 / (a.depth + 1);
-                    return (a.parent === b.parent ? 1 : 2) * depthFactor;
-                });
-        const root = tree(d3.hierarchy(data)
-            // following line would be ordering of the nodes
-            // .sort((a, b) => d3.ascending(a.data.name, b.data.name))
-        );
+        let root;
+        if (data.layout) {
+            // node positions and link paths are precomputed by the pipeline (utils/radial_layout.py)
+            root = d3.hierarchy(data);
+            root.each(d => {
+                d.x = d.data.x;
+                d.y = d.data.y;
+            });
+        } else {
+            const tree = d3.tree()
+                .size([2 * Math.PI, radius])
+                // separates nodes from each other
+                .separation((a, b) => {
+                        // calc separation based on depth
+                        const depthFactor = 1 / (a.depth + 1);
+                        return (a.parent === b.parent ? 1 : 2) * depthFactor;
+                    });
+            root = tree(d3.hierarchy(data)
+                // following line would be ordering of the nodes
+                // .sort((a, b) => d3.ascending(a.data.name, b.data.name))
+            );
+        }
 
         const maxDepth = getMaxDepth(root);
 
@@ -76,7 +86,7 @@ function createRadialTree(dataUrl) {
             .selectAll("path")
             .data(root.links())
             .join("path")
-            .attr("d", d => rightAnglePath(d.source, d.target))
+            .attr("d", d => d.target.data.link || rightAnglePath(d.source, d.target))
             .style("stroke", "#ccc")
             // would color the links
             //.style("stroke", d => d.source.data.colorcode || "#ccc")
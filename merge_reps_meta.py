@@ -11,26 +11,27 @@
 # This script merges the representatives as well as the metadata from the different sources
 # (ncbi, empop, 1k_genomes)
 #
+# sources are listed in 'SOURCES' in 'utils/path_defaults.py'
+#
 ################################
 
 
+import multiprocessing
 import os
+import threading
 import warnings
-import csv
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
+from utils.input_catalog import INPUT_CATALOG, read_csv_rows, read_csv_table, read_lines
+from utils.instrumentation import NullProfiler
+from utils.table_store import write_table
 from utils.path_defaults import (ALL_REPS,
-                                 EMPOP_META,
-                                 EMPOP_REPS,
-                                 K_META,
-                                 NCBI_META,
                                  OUTPUT_DIR,
-                                 FORMATTED_EMPOP,
-                                 FORMATTED_1K,
-                                 FORMATTED_NCBI,
                                  MOTIF_REPRESENTATIVES,
-                                 METADATA_REPRESENTATIVES, NCBI_REPS)
+                                 METADATA_REPRESENTATIVES,
+                                 SOURCES)
 
 
 # TODO if the empop reps is no longer misformatted, this fun is no longer needed
@@ -44,13 +45,17 @@ def remove_commas_in_last_col(input_path, output_path):
        etc.
     We skip the header row and merge everything after num_profiles
     into a single space-separated 'profiles' column.
+    The file is only written if 'output_path' differs from 'input_path' or any row has to be merged,
+    its rows are registered in the 'INPUT_CATALOG', so checking them later does not read the file again.
     """
-    with open(input_path, 'r', newline='', encoding='utf-8') as f:
-        all_rows = list(csv.reader(f))
+    all_rows = INPUT_CATALOG.read(input_path, read_csv_rows)
 
     header = all_rows[0]
     data_rows = all_rows[1:]
 
+    if os.path.abspath(input_path) == os.path.abspath(output_path) and all(len(row) == 3 for row in data_rows):
+        return
+
     cleaned_data = []
     for row in data_rows:
         motif = row[0]  # e.g. "L0a2a1"
@@ -62,118 +67,119 @@ def remove_commas_in_last_col(input_path, output_path):
 
     df_clean = pd.DataFrame(cleaned_data, columns=['motif', 'num_profiles', 'profiles'])
     df_clean.to_csv(output_path, index=False)
+    INPUT_CATALOG.seed(output_path, read_csv_rows,
+                       (tuple(df_clean.columns),) + tuple(tuple(row) for row in cleaned_data))
+
+
+def explode_profiles(reps_df, column="profiles"):
+    """
+    Turns a [motif, profiles] DataFrame, where 'profiles' is a space-separated string
+    of IDs, into a long-form DataFrame with one row per (motif, accession) pair.
+    Motifs without any profiles do not appear in the result.
+    """
+    long_df = (
+        reps_df[["motif"]]
+        .assign(accession=reps_df[column].fillna("").str.split())
+        .explode("accession")
+        .dropna(subset=["accession"])
+    )
+    return long_df.reset_index(drop=True)
 
 
-def filter_profiles(profiles_str, valid_accessions):
+def collapse_profiles(long_df, motifs=None):
     """
-    Filter a space-delimited string of accession IDs, returning only those in 'valid_accessions'.
-    Returns an empty string if the input is missing or no valid IDs remain.
+    Inverse of 'explode_profiles'. Joins the accessions of each motif into a single
+    space-separated 'profiles' string, keeping their order.
+
+    If 'motifs' is given, the result has exactly these motifs in this order,
+    with an empty string for motifs without any accessions.
+    Otherwise the motifs found in 'long_df' are returned, sorted.
     """
-    if pd.isna(profiles_str) or not profiles_str.strip():
-        return ""
-    candidates = profiles_str.strip().split()
-    filtered = [acc for acc in candidates if acc in valid_accessions]
-    return " ".join(filtered)
+    profiles = long_df.groupby("motif", sort=motifs is None)["accession"].agg(" ".join)
 
+    if motifs is not None:
+        profiles = profiles.reindex(pd.Index(motifs, name="motif"), fill_value="")
 
+    return profiles.reset_index(name="profiles")
 
-def process_and_save_reps(meta_file, reps_df, output_file, id_col="accession"):
+
+def map_and_replace_ids(ids, id_map):
+    """
+    Replaces every ID in the Series 'ids' with its mapped value in the Series 'id_map'
+    (e.g. sample_id -> accession). IDs not found in 'id_map' are kept unchanged.
     """
-    Processes and filters 'reps_df' based on a metadata file, then saves the result.
+    return ids.map(id_map).fillna(ids)
+
+
+def filter_profiles(long_df, valid_accessions):
+    """
+    Keeps only the rows of a long-form reps DataFrame whose accession is in 'valid_accessions'.
+    Duplicate (motif, accession) pairs are dropped.
+    """
+    filtered = long_df[long_df["accession"].isin(valid_accessions)]
+    return filtered.drop_duplicates(["motif", "accession"])
+
+
+def process_and_save_reps(meta_file, reps_long, output_file, motifs, id_col="accession"):
+    """
+    Processes and filters 'reps_long' based on a metadata file, then saves the result.
 
     Parameters
     ----------
     meta_file : str
-        Path to the CSV metadata file.
-    reps_df : pd.DataFrame
-        DataFrame containing 'motif' and 'profiles' columns.
+        Path to the CSV metadata file, read through the 'INPUT_CATALOG'.
+    reps_long : pd.DataFrame
+        Long-form DataFrame with 'motif' and 'accession' columns, see 'explode_profiles'.
     output_file : str
-        Path where the filtered DataFrame should be written as a CSV.
+        Path where the filtered reps should be written as a [motif, profiles] table (see 'table_store').
+    motifs : list-like
+        All motifs to write to 'output_file', including those without profiles.
     id_col : str, optional
-        Column in the metadata that corresponds to the IDs found in 'profiles'.
+        Column in the metadata that corresponds to the IDs found in 'reps_long'.
         Default is 'accession'. If 'sample_id', then we map them to 'accession' first.
 
     Returns
     -------
     (pd.DataFrame, pd.DataFrame)
-        A tuple of (filtered_reps_df, meta_df).
+        A tuple of (filtered long-form reps, meta_df).
     """
-    meta_df = pd.read_csv(meta_file)
+    meta_df = INPUT_CATALOG.read(meta_file, read_csv_table, persist=True)
 
-    # create mapping from 'id_col' to 'accession'
-    # for example, if id_col='sample_id', we map sample_id -> accession
-    # if id_col='accession', then it essentially maps accession -> accession.
-    id_map = dict(zip(meta_df[id_col], meta_df["accession"]))
-
-    # accessions found in the metadata
-    valid_accessions = set(meta_df["accession"])
-    reps_subset = reps_df[["motif", "profiles"]].copy()
+    reps_subset = reps_long[["motif", "accession"]]
 
-    # replace each ID in 'profiles' with the corresponding 'accession'
+    # replace each ID with the corresponding 'accession'
+    # for example, if id_col='sample_id', we map sample_id -> accession
+    # for duplicated IDs the last mapping in the metadata wins
     if id_col != "accession":
-        reps_subset["profiles"] = reps_subset["profiles"].apply(
-            lambda x: map_and_replace_ids(x, id_map)
-        )
+        id_map = meta_df.drop_duplicates(id_col, keep="last").set_index(id_col)["accession"]
+        reps_subset = reps_subset.assign(accession=map_and_replace_ids(reps_subset["accession"], id_map))
 
-    # filter out any IDs in 'profiles' that are not in 'valid_accessions'
-    reps_subset["profiles"] = reps_subset["profiles"].apply(
-        lambda x: filter_profiles(x, valid_accessions)
-    )
+    # filter out any IDs that are not accessions found in the metadata
+    reps_subset = filter_profiles(reps_subset, meta_df["accession"].unique())
 
-    reps_subset.to_csv(output_file, index=False)
+    write_table(collapse_profiles(reps_subset, motifs), output_file)
 
     return reps_subset, meta_df
 
 
-def map_and_replace_ids(profiles_str, id_map):
-    """
-    For a space-delimited string of IDs, look up each ID in 'id_map' and replace it
-    with the mapped value (e.g. sample_id -> accession). If the ID is not found
-    in 'id_map', keep or discard it based on your needs.
+def merge_representatives(reps_list, output_file, motifs):
     """
-    if pd.isna(profiles_str) or not profiles_str.strip():
-        return ""
-    ids = profiles_str.strip().split()
-
-    # replace each ID using the dictionary; keep if not found or remove it
-    mapped = [
-        id_map[i] if i in id_map else i
-        for i in ids
-    ]
-    return " ".join(mapped)
-
-
-def merge_representatives(df1, df2, df3, out_csv):
+    Takes a list of long-form reps DataFrames with columns [motif, accession], one per source.
+    Unions the accessions for each motif (removing duplicates),
+    and writes a final table with columns [motif, profiles] for all 'motifs',
+    sorted by motif, with the accessions of each motif sorted.
     """
-    Reads three CSVs with columns [motif, profiles].
-    Merges them on 'motif', unions the profiles for each motif (removing duplicates),
-    and writes a final CSV with columns [motif, profiles].
-    """
-    df1 = df1.rename(columns={"profiles": "profiles1"})
-    df2 = df2.rename(columns={"profiles": "profiles2"})
-    df3 = df3.rename(columns={"profiles": "profiles3"})
-
-    # merge all on 'motif'
     merged = (
-        df1.merge(df2, on="motif", how="outer")
-           .merge(df3, on="motif", how="outer")
+        pd.concat(reps_list, ignore_index=True)
+          .drop_duplicates(["motif", "accession"])
+          .sort_values("accession", kind="stable")
     )
 
-    # combine profiles into one space-separated string, no duplicates
-    def combine_profiles(row):
-        all_profiles = set()
-        for col in ["profiles1", "profiles2", "profiles3"]:
-            val = row.get(col, np.nan)
-            if pd.notna(val):
-                all_profiles.update(val.split())
-        return " ".join(sorted(all_profiles))
-
-    merged["profiles"] = merged.apply(combine_profiles, axis=1)
-
-    final_df = merged[["motif", "profiles"]]
+    final_df = collapse_profiles(merged, sorted(set(motifs)))
 
-    final_df.to_csv(out_csv, index=False)
-    print(f"Merged CSV written to: {out_csv}")
+    final_df = write_table(final_df, output_file)
+    print(f"Merged representatives written to: {output_file}")
+    return final_df
 
 
 def check_same_profiles(reps, meta, column_reps = "profiles", column_meta = "accession"):
@@ -186,29 +192,28 @@ def check_same_profiles(reps, meta, column_reps = "profiles", column_meta = "acc
       2) A CSV file with columns [motif, num_profiles, profiles],
          where 'profiles' is a space-separated string of accessions.
     - meta: Path to a CSV file which must contain a column named 'accession'.
+
+    Both files are read through the 'INPUT_CATALOG'.
     """
     reps_ext = os.path.splitext(reps)[1].lower()
     reps_accessions = set()
 
     if reps_ext == ".txt":
-        with open(reps, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    reps_accessions.add(line)
+        reps_accessions.update(INPUT_CATALOG.read(reps, read_lines))
 
     elif reps_ext == ".csv":
-        df_reps = pd.read_csv(reps)
-        if column_reps not in df_reps.columns:
+        header, *rows = INPUT_CATALOG.read(reps, read_csv_rows)
+        if column_reps not in header:
             raise ValueError(f"'{column_reps}' column not found in {reps} CSV file.")
-        for row in df_reps[column_reps].dropna():
-            acc_list = row.split()
-            reps_accessions.update(acc_list)
+        col = header.index(column_reps)
+        for row in rows:
+            if col < len(row):
+                reps_accessions.update(row[col].split())
     else:
         raise ValueError(f"Unrecognized file extension '{reps_ext}' for reps file {reps}. Expected .txt or .csv")
 
     # metadata
-    meta_df = pd.read_csv(meta)
+    meta_df = INPUT_CATALOG.read(meta, read_csv_table, persist=True)
     if column_meta not in meta_df.columns:
         raise ValueError(f"'{column_meta}' column not found in meta CSV file: {meta}")
 
@@ -225,61 +230,113 @@ def check_same_profiles(reps, meta, column_reps = "profiles", column_meta = "acc
                       stacklevel=2)
 
 
-def main():
+def process_source(source, reps_long_all, motifs):
+    """
+    Runs all per source steps for one entry of the 'SOURCES' registry:
+    checks its reps and metadata for the same profiles, then filters and saves its reps.
+    Runs in a worker process, so it only depends on its arguments.
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    # TODO this will not be needed, when empops reps no longer has commas in the last col
-    remove_commas_in_last_col(EMPOP_REPS, EMPOP_REPS)
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame, dict)
+        A tuple of (filtered long-form reps, meta_df) of the source
+        and the 'INPUT_CATALOG' stats of reading its files.
+    """
+    print(f"Processing {source['label']}.")
+    stats_before = dict(INPUT_CATALOG.stats)
+
+    # ensure reps and metadata of the source have the same profiles
+    if source["reps"] is not None:
+        # TODO this will not be needed, when empops reps no longer has commas in the last col
+        if source["clean_reps"]:
+            remove_commas_in_last_col(source["reps"], source["reps"])
+        check_same_profiles(source["reps"], source["meta"], column_meta=source["id_col"])
+
+    # filter all profiles present in the metadata file of the source
+    # function allows for different than accession column using 'id_col'
+    reps_subset, meta_df = process_and_save_reps(source["meta"], reps_long_all, source["formatted"],
+                                                 motifs, id_col=source["id_col"])
 
-    # ensure empop and genebank reps and metadata have the same profiles
-    # NOTE: No reps file available for 1k genomes, so no need to check
-    # NOTE: If a source is added, it should also be added here
-    # or even better:
-    # if adding sources is a regular thing, make a better pipeline to just import from a list of sources
-    check_same_profiles(EMPOP_REPS, EMPOP_META, column_meta="sample_id")
-    check_same_profiles(NCBI_REPS, NCBI_META)
+    # workers have their own catalog, only the reads of this source are reported back
+    read_stats = {name: value - stats_before[name] for name, value in INPUT_CATALOG.stats.items()}
+    return reps_subset, meta_df, read_stats
+
+
+def main(sources=SOURCES, max_workers=None, profiler=None):
+    """
+    Merges representatives and metadata of all 'sources' (see 'SOURCES' in 'path_defaults').
+    Sources are processed in parallel worker processes, use max_workers=1 to process them serially.
+    Workers are spawned instead of forked if other threads are running (i.e. concurrent stages of
+    'tree_dat_process'), as a fork only copies the calling thread and may copy locks held by the others.
+    Each step is measured as a stage of 'profiler' (see 'utils/instrumentation.py'), if given.
+    Input files are read through the 'INPUT_CATALOG', its hits are counted in the stages.
+
+    Returns
+    -------
+    (pd.DataFrame, pd.DataFrame)
+        The combined representatives and metadata, as written to their tables.
+    """
+    profiler = profiler or NullProfiler()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     # read all representations
     # this is the output of the tree building process
-    reps_df_all = pd.read_csv(ALL_REPS)
+    # and split them into (motif, accession) pairs once for all sources
+    with profiler.stage("read_representatives") as record:
+        reps_df_all = INPUT_CATALOG.read(ALL_REPS, read_csv_table, persist=True)
+        reps_long_all = explode_profiles(reps_df_all)
+        motifs = reps_df_all["motif"]
+        record.count(motifs=len(motifs), profiles=len(reps_long_all))
 
     ############################################################
 
-    # filter all profiles present in the metadata files for each source
-    # function allows for different than accession column using 'id_col'
-    # TODO rewrite the next line, when empop format changes
-    print("Processing EMPOP.")
-    reps_empop, meta_df_empop = process_and_save_reps(EMPOP_META, reps_df_all, FORMATTED_EMPOP, id_col="sample_id")
-    print("Processing 1k Genomes.")
-    reps_1k, meta_df_1k = process_and_save_reps(K_META, reps_df_all, FORMATTED_1K)
-    print("Processing NCBI.")
-    reps_ncbi, meta_df_ncbi = process_and_save_reps(NCBI_META, reps_df_all, FORMATTED_NCBI)
+    # check and filter each source
+    # results are kept in the order of 'sources'
+    with profiler.stage("process_sources") as record:
+        if max_workers == 1 or len(sources) <= 1:
+            results = [process_source(source, reps_long_all, motifs) for source in sources]
+        else:
+            context = multiprocessing.get_context("spawn") if threading.active_count() > 1 else None
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                futures = [executor.submit(process_source, source, reps_long_all, motifs) for source in sources]
+                results = [future.result() for future in futures]
+        read_stats = {name: sum(stats[name] for _, _, stats in results) for name in INPUT_CATALOG.stats}
+        record.count(sources=len(sources), profiles=sum(len(reps) for reps, _, _ in results),
+                     **{f"input_{name}": value for name, value in read_stats.items()})
+        print(f"Read source files: {read_stats['parses']} parsed, {read_stats['hits']} cache hits, "
+              f"{read_stats['disk_hits']} loaded from {INPUT_CATALOG.cache_dir}.")
 
     #############################################################
 
     # combine reps
 
-    merge_representatives(reps_ncbi, reps_empop, reps_1k,
-        out_csv=MOTIF_REPRESENTATIVES
-    )
+    with profiler.stage("merge_representatives") as record:
+        representatives = merge_representatives([reps for reps, _, _ in results],
+            output_file=MOTIF_REPRESENTATIVES, motifs=motifs
+        )
+        record.count(motifs=len(motifs))
 
     #############################################################
 
     # combine metadata
 
-    meta_df_empop.drop("sample_id", axis=1, inplace=True)
-
-    meta_df_empop["source"] = "EMPOP"
-    meta_df_1k["source"] = "1K_GENOMES"
-    meta_df_ncbi["source"] = "NCBI"
+    with profiler.stage("combine_metadata") as record:
+        meta_dfs = []
+        for source, (_, meta_df, _) in zip(sources, results):
+            if source["id_col"] != "accession":
+                meta_df = meta_df.drop(source["id_col"], axis=1)
+            meta_dfs.append(meta_df.assign(source=source["label"]))
 
-    combined_meta = pd.concat([meta_df_ncbi, meta_df_empop, meta_df_1k], axis=0, ignore_index=True)
-    combined_meta.to_csv(METADATA_REPRESENTATIVES, index=False)
+        combined_meta = pd.concat(meta_dfs, axis=0, ignore_index=True)
+        # repeated values like source, country or sequencing technology are stored as categoricals
+        combined_meta = write_table(combined_meta, METADATA_REPRESENTATIVES)
+        record.count(rows=len(combined_meta))
 
 
     #############################################################
 
     print("Merging complete!\n")
+    return representatives, combined_meta
 
 
 if __name__ == "__main__":
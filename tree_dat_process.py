@@ -16,18 +16,52 @@
 # as well as other tree formats such as newick
 # and all downloadable tables
 #
+# The pipeline is split into stages. Each stage records the content hashes of its
+# inputs and outputs in a build cache and is skipped on a rerun if none of them changed.
+# Use '--force' to rebuild everything regardless.
+#
+# Stages depend on the stages writing their input files. Objects like the parsed tree or the combined tables
+# are passed between them in memory. '--workers' runs independent stages in threads, which only overlaps
+# their file reads and writes: the stages are cpu bound python and hold the GIL, so it is no speedup.
+# Targets build single stages or output files and whatever they depend on, i.e.
+#   python tree_dat_process.py radialTree.json
+# '--dry-run' prints the plan without running it.
+#
 ################################
 
-import json
+import argparse
 import os
 import warnings
 
-import pandas as pd
-from shutil import copyfile
-
+from utils.accession_index import AccessionIndex
+from utils.build_cache import (code_version,
+                               load_build_cache,
+                               save_build_cache,
+                               stage_is_current,
+                               record_stage)
 from utils.file_readers import csv_as_dict, read_txt
-from utils.hgmotif_creation import parse_haplo_motifs, check_same_haplos
-from utils.xml_tree_parser import xml_tree_parsing, tree_to_json, create_bare_tree, create_newick_tree
+from utils.hgmotif_creation import parse_haplo_motifs
+from utils.instrumentation import RunProfiler
+from utils.mutation_index import MutationIndex
+from utils.node_shards import NodeShardEmitter, write_node_shards, MANIFEST_NAME
+from utils.output_writer import OutputWriter, PROFILES, clear_json_files
+from utils.pipeline import shared, stage_dependencies, select_stages, stage_levels, run_stages
+from utils.radial_layout import RadialLayoutEmitter
+from utils.table_store import read_table, text_records
+from utils.signature_engine import (SignatureEmitter,
+                                    diff_haplogroups,
+                                    diff_signatures,
+                                    format_mismatch_report,
+                                    is_consistent,
+                                    load_signatures,
+                                    read_reference_fasta,
+                                    reference_alleles,
+                                    save_signatures)
+from utils.tree_index import TreeIndex
+from utils.tree_emitters import walk_tree, JsonEmitter, NewickEmitter
+from utils.tree_chunks import split_tree
+from utils.tree_views import id_view, depth_view, profile_view, prune_views, walk_views
+from utils.xml_tree_parser import xml_tree_parsing
 from merge_reps_meta import main as merge_reps_meta
 
 from utils.path_defaults import (METADATA_REPRESENTATIVES,
@@ -35,99 +69,493 @@ from utils.path_defaults import (METADATA_REPRESENTATIVES,
                                  DATA_DEST,
                                  XML_FILE,
                                  MOTIF_SIGNATURES,
+                                 REFERENCE_FILE,
+                                 DERIVED_SIGNATURES,
                                  COLORCODE_FILE,
                                  SUPERHAPLO_FILE,
-                                 PHYLO_SUPERHAPLO_FILE)
+                                 PHYLO_SUPERHAPLO_FILE,
+                                 ALL_REPS,
+                                 SOURCES,
+                                 BUILD_CACHE,
+                                 SIZE_REPORT,
+                                 RUN_REPORT,
+                                 NODE_SHARD_DIR,
+                                 TREE_VIEW_DIR,
+                                 TREE_CHUNK_DIR)
 
 
 # TODO check all relevant files exist
 
+TREE_ATTRIBUTE_FILES = [COLORCODE_FILE, SUPERHAPLO_FILE, PHYLO_SUPERHAPLO_FILE]
+
+# resolutions of the pruned tree views, see 'build_tree_views'
+TREE_VIEW_DEPTHS = [5, 10]
+TREE_VIEW_MIN_PROFILES = [10, 50]
+
+SOURCE_INPUT_FILES = [path for source in SOURCES for path in (source["reps"], source["meta"]) if path]
+SOURCE_OUTPUT_FILES = [source["formatted"] for source in SOURCES]
+
+
+### shared inputs
+# parsed lazily and only once, so skipped stages never read them
+# shared by all stages, also when they run concurrently (see 'utils/pipeline.py')
+
+
+# parse tree from xml input file
+@shared
+def load_tree():
+    return xml_tree_parsing(XML_FILE)
+
+
+# read tree attributes files
+@shared
+def load_tree_attributes():
+    color_dict = csv_as_dict(COLORCODE_FILE, delimiter=",")
+    superhaplo = read_txt(SUPERHAPLO_FILE)
+    phylo_superhaplo = read_txt(PHYLO_SUPERHAPLO_FILE)
+
+    print("Read Input Files.")
+    return color_dict, superhaplo, phylo_superhaplo
+
+
+# combined representatives and metadata of all sources
+# handed over in memory by the 'merge_reps_meta' stage, read from its tables if it was skipped
+@shared
+def load_representatives():
+    return read_table(MOTIF_REPRESENTATIVES)
+
+
+@shared
+def load_metadata():
+    return read_table(METADATA_REPRESENTATIVES)
+
+
+# reads profiles of haplogroups file
+# accessions of every haplogroup, used for the accession index and the node shards
+@shared
+def load_profiles_dict():
+    representatives = load_representatives()
+    profiles = representatives['profiles'].fillna('').apply(lambda x: x.split())
+    return dict(zip(representatives['motif'], profiles))
+
+
+# parse haplos of the .emp file
+@shared
+def load_emp_hgmotifs():
+    return parse_haplo_motifs(MOTIF_SIGNATURES)
+
+
+# full hg signatures used for all outputs
+# with a reference sequence the ones derived from the tree are used and the .emp file is not needed,
+# otherwise the .emp file (verified against the tree in the 'signatures' stage)
+@shared
+def load_hgmotifs():
+    if os.path.isfile(REFERENCE_FILE):
+        signatures, _ = load_signatures(DERIVED_SIGNATURES)
+        return signatures
+    return load_emp_hgmotifs()
+
+
+# single walk over the full tree creating all of its outputs
+# returns json tree, newick string and node shards
+@shared
+def walk_full_tree():
+    tree, root = load_tree()
+    color_dict, superhaplo, phylo_superhaplo = load_tree_attributes()
+
+    return walk_tree(tree, root, [
+        # profiles are left out, they are in 'accession_index.json' and the node shards
+        JsonEmitter(color_dict, superhaplo, phylo_superhaplo),
+        NewickEmitter(),
+        NodeShardEmitter(color_dict),
+    ])
+
+
+### stages
+
 
 ### combine representatives and metadata from different sources
-merge_reps_meta()
+def build_merged_reps_meta(writer, profiler):
+    representatives, metadata = merge_reps_meta(profiler=profiler)
+    load_representatives.seed(representatives)
+    load_metadata.seed(metadata)
 
 
 ### profile attributes table
 # reads metadata
 # writes result as 'profiles.csv'
-metadata = pd.read_csv(METADATA_REPRESENTATIVES, dtype=str)
-metadata.to_csv(os.path.join(DATA_DEST, "profiles.csv"), index=False)
+def build_profiles(writer, profiler):
+    metadata = load_metadata()
+    writer.write_text(metadata.to_csv(index=False), os.path.join(DATA_DEST, "profiles.csv"))
 
-print("Created Profiles File.")
-###
+    print("Created Profiles File.")
+    return {"rows": len(metadata)}
 
 
 ### profiles data
-# reads profiles of haplogroups file
 # writes resulting motif, num_profiles, profiles table as 'mito_representatives.csv'
-mito_representatives_df = pd.read_csv(MOTIF_REPRESENTATIVES)
-# TODO possibly do stuff, rename cols?
-mito_representatives_df.to_csv(os.path.join(DATA_DEST, "mito_representatives.csv"), index=False)
-mito_representatives_df['profiles'] = mito_representatives_df['profiles'].fillna('')
+def build_representatives(writer, profiler):
+    mito_representatives_df = load_representatives()
+    # TODO possibly do stuff, rename cols?
+    writer.write_text(mito_representatives_df.to_csv(index=False), os.path.join(DATA_DEST, "mito_representatives.csv"))
+    return {"rows": len(mito_representatives_df)}
 
-# used to embedd accession# into json tree
-profiles_dict = mito_representatives_df.set_index('motif')['profiles'].apply(lambda x: x.split()).to_dict()
-####
 
+# create linear tree with helper function to json file with all attributes
+# and write as 'tree.json'
+# creates a newick data file of the full mt-mcra tree
+# and write it as 'fullTree.nwk'
+def build_linear_tree(writer, profiler):
+    json_tree, newick_tree, _ = walk_full_tree()
+
+    writer.write_json(json_tree, os.path.join(DATA_DEST, "tree.json"))
+    writer.write_text(newick_tree, os.path.join(DATA_DEST, "fullTree.nwk"))
+
+    print("Processed Linear Tree.")
+    return {"nodes": len(load_tree()[0])}
+
+
+### lazily loaded chunks of the linear tree
+# the json tree split into chunks of bounded size for the collapsible tree to fetch on expand,
+# written as 'tree_chunks/<number>.json' and the haplogroup -> chunk index 'tree_chunks/index.json'
+def build_tree_chunks(writer, profiler):
+    json_tree, _, _ = walk_full_tree()
+    chunks, index = split_tree(json_tree)
+
+    os.makedirs(TREE_CHUNK_DIR, exist_ok=True)
+    # chunks of a previous build, there may have been more
+    clear_json_files(TREE_CHUNK_DIR)
+    for number, chunk in enumerate(chunks):
+        writer.write_json(chunk, os.path.join(TREE_CHUNK_DIR, f"{number}.json"), group="tree_chunks/*.json")
+    writer.write_json(index, os.path.join(TREE_CHUNK_DIR, "index.json"))
+
+    print(f"Split tree into {len(chunks)} chunks.")
+    return {"chunks": len(chunks)}
+
+
+### accession <-> haplogroup lookup index
+# accessions grouped by haplogroup, written as 'accession_index.json'
+def build_accession_index(writer, profiler):
+    accession_index = AccessionIndex.from_profiles(load_profiles_dict())
+    writer.write_json(accession_index.to_json(), os.path.join(DATA_DEST, "accession_index.json"))
+
+    print("Created accession index.")
+    return {"accessions": len(accession_index), "haplogroups": len(accession_index.haplogroups)}
+
+
+### ancestor / descendant interval index
+# preorder, exit numbers and depths of all nodes, written as 'tree_index.json'
+def build_tree_index(writer, profiler):
+    tree, root = load_tree()
+    tree_index = TreeIndex.from_tree(tree, root)
+    writer.write_json(tree_index.to_json(), os.path.join(DATA_DEST, "tree_index.json"))
+
+    print("Created tree index.")
+    return {"nodes": len(tree_index)}
+
+
+### full hg signatures from the tree
+# applies the 'HG' mutations of every node to the signature of its parent
+# and compares the result with the .emp file, if there is one
+# needs the rCRS fasta file for the reference bases, without it only the haplogroups of the tree
+# and the .emp file are compared and the .emp file is used
+# writes signatures and mismatch report to 'derived_signatures.json'
+def build_signatures(writer, profiler):
+    has_emp = os.path.isfile(MOTIF_SIGNATURES)
+
+    if not os.path.isfile(REFERENCE_FILE):
+        if not has_emp:
+            raise FileNotFoundError(f"Neither {REFERENCE_FILE} nor {MOTIF_SIGNATURES} found, "
+                                    f"can not derive full hg signatures.")
+        print(f"No rCRS (NC_012920.1) fasta file at {REFERENCE_FILE}, full hg signatures are not derived, "
+              f"only the haplogroups of {MOTIF_SIGNATURES} are checked.")
+        tree, root = load_tree()
+        haplogroups = (tree.get_id(node) for node in tree.preorder(root))
+        report = diff_haplogroups([haplogroup for haplogroup in haplogroups if haplogroup is not None],
+                                  load_emp_hgmotifs())
+        if not is_consistent(report):
+            warnings.warn(f"Haplogroups of Tree input file {XML_FILE} "
+                          f"and Motifs file {MOTIF_SIGNATURES} are not identical:\n{format_mismatch_report(report)}")
+        save_signatures({}, report, None, DERIVED_SIGNATURES)
+        return {"haplogroups": 0, "mismatches": 0}
+
+    tree, root = load_tree()
+    reference = reference_alleles(read_reference_fasta(REFERENCE_FILE))
+    signatures, = walk_tree(tree, root, [SignatureEmitter(reference)])
+
+    report = diff_signatures(signatures, load_emp_hgmotifs()) if has_emp else None
+    if report and not is_consistent(report):
+        warnings.warn(f"Full hg signatures of Tree input file {XML_FILE} "
+                      f"and Motifs file {MOTIF_SIGNATURES} differ:\n{format_mismatch_report(report)}")
+
+    save_signatures(signatures, report, REFERENCE_FILE, DERIVED_SIGNATURES)
+
+    print(f"Derived {len(signatures)} full hg signatures from the tree.")
+    return {"haplogroups": len(signatures), "mismatches": len(report["mismatches"]) if report else 0}
 
-### create trees
 
-# parse tree from xml input file
-tree, root = xml_tree_parsing(XML_FILE)
-# parse haplos
-hgmotif_dict = parse_haplo_motifs(MOTIF_SIGNATURES)
+## hgmotifs
+def build_hgmotifs(writer, profiler):
+    hgmotif_dict = load_hgmotifs()
 
-# read tree attributes files
-color_dict = csv_as_dict(COLORCODE_FILE, delimiter=",")
-superhaplo = read_txt(SUPERHAPLO_FILE)
-phylo_superhaplo = read_txt(PHYLO_SUPERHAPLO_FILE)
+    # write full hg data table as 'hgmotifs.json'
+    writer.write_json(hgmotif_dict, os.path.join(DATA_DEST, "hgmotifs.json"))
 
-print("Read Input Files.")
+    print("Created hgmotifs file.")
+    return {"haplogroups": len(hgmotif_dict)}
 
 
-# create linear tree with helper function to json file with all attributes
-# and write as 'tree.json'
-json_tree = tree_to_json(tree, root, color_dict, superhaplo, phylo_superhaplo, profiles=profiles_dict)
-with open(os.path.join(DATA_DEST, "tree.json"), 'w') as json_file:
-    json.dump(json_tree, json_file, indent=4)
+### mutation search index
+# inverted index of every mutation in the full hg signatures to the haplogroups carrying it
+# written as 'mutation_index.json', used by the "has mutation" search
+def build_mutation_index(writer, profiler):
+    mutation_index = MutationIndex.from_hgmotifs(load_hgmotifs())
+    writer.write_json(mutation_index.to_json(), os.path.join(DATA_DEST, "mutation_index.json"))
 
-# creates a newick data file of the full mt-mcra tree
-# and write it as 'fullTree.nwk'
-newick_tree = create_newick_tree(tree, root)
-with open(os.path.join(DATA_DEST, "fullTree.nwk"), 'w') as nwk_file:
-    nwk_file.write(newick_tree)
+    print(f"Created mutation index of {len(mutation_index.keys)} mutations.")
+    return {"mutations": len(mutation_index.keys), "haplogroups": len(mutation_index.haplogroups)}
 
-print("Processed Linear Tree.")
 
+### node info shards
+# one small json file per haplogroup with everything the node info page shows
+# and a manifest mapping haplogroup names to their files
+def build_node_shards(writer, profiler):
+    _, _, shards = walk_full_tree()
+    metadata = text_records(load_metadata())
 
-## hgmotifs
-# check for same haplos as in tree
-if not check_same_haplos(json_tree, hgmotif_dict):
-    warnings.warn(f"Haplogroups of processed Tree input file {XML_FILE} "
-                  f"and processed Motifs file {MOTIF_SIGNATURES} are not identical!")
-# write full hg data table as 'hgmotifs.json'
-with open(os.path.join(DATA_DEST, "hgmotifs.json"), 'w') as json_file:
-    json.dump(hgmotif_dict, json_file, indent=4)
+    write_node_shards(shards, NODE_SHARD_DIR, load_hgmotifs(), load_profiles_dict(), metadata, writer)
 
-print("Created hgmotifs file.")
+    print(f"Created {len(shards)} node shards.")
+    return {"shards": len(shards)}
 
 
 ### radial stunted tree
 # bare tree without single parent nodes that aren't superhaplo
 # writes tree as json and nwk files
-bare_tree = create_bare_tree(tree, root, superhaplo, remove_add=True)
-bare_tree_json = tree_to_json(bare_tree, bare_tree.getroot(), color_dict, superhaplo, phylo_superhaplo)
-with open(os.path.join(DATA_DEST, "radialTree.json"), 'w') as json_file:
-    json.dump(bare_tree_json, json_file, indent=4)
-# newick radial tree
-newick_radial_tree = create_newick_tree(bare_tree, bare_tree.getroot())
-with open(os.path.join(DATA_DEST, "pruned_radialTree.nwk"), 'w') as nwk_file:
-    nwk_file.write(newick_radial_tree)
-
-print("Processed Radial Tree.")
-###
+def build_radial_tree(writer, profiler):
+    tree, root = load_tree()
+    color_dict, superhaplo, phylo_superhaplo = load_tree_attributes()
+
+    # superhaplos, their ancestors and the root, without single child nodes that are no superhaplos
+    # json and newick radial tree and its layout in a single walk over the pruned tree
+    pruning = prune_views(tree, root, [id_view("radial", superhaplo)])
+    [(bare_tree_json, newick_radial_tree, layout)] = walk_views(tree, root, pruning, [[
+        JsonEmitter(color_dict, superhaplo, phylo_superhaplo),
+        NewickEmitter(),
+        RadialLayoutEmitter(),
+    ]])
+    # node positions and link paths, so the webapp only draws the tree
+    layout.annotate(bare_tree_json)
+    writer.write_json(bare_tree_json, os.path.join(DATA_DEST, "radialTree.json"))
+    writer.write_text(newick_radial_tree, os.path.join(DATA_DEST, "pruned_radialTree.nwk"))
+
+    print("Processed Radial Tree.")
+    return {"nodes": len(layout)}
+
+
+### pruned views of the tree
+# coarser versions of the tree for the webapp to switch to, all found in one pass over the tree:
+# superhaplos, phylo superhaplos, nodes up to a depth and nodes with a minimum number of profiles
+# writes json and newick of every view to 'views/' and their list, coarsest first, as 'views/index.json'
+def build_tree_views(writer, profiler):
+    tree, root = load_tree()
+    color_dict, superhaplo, phylo_superhaplo = load_tree_attributes()
+    profiles = load_profiles_dict()
+
+    views = ([id_view("phylo_superhaplo", phylo_superhaplo), id_view("superhaplo", superhaplo)]
+             + [depth_view(f"depth_{depth}", depth) for depth in TREE_VIEW_DEPTHS]
+             + [profile_view(f"profiles_{count}", profiles, count) for count in TREE_VIEW_MIN_PROFILES])
+
+    pruning = prune_views(tree, root, views)
+    results = walk_views(tree, root, pruning, [
+        [JsonEmitter(color_dict, superhaplo, phylo_superhaplo), NewickEmitter()] for _ in views
+    ])
+
+    os.makedirs(TREE_VIEW_DIR, exist_ok=True)
+    index = []
+    for i, (view, (json_tree, newick)) in enumerate(zip(views, results)):
+        writer.write_json(json_tree, os.path.join(TREE_VIEW_DIR, f"{view.name}.json"), group="views/*.json")
+        writer.write_text(newick, os.path.join(TREE_VIEW_DIR, f"{view.name}.nwk"), group="views/*.nwk")
+        index.append({"name": view.name, "nodes": pruning.view_size(i),
+                      "json": f"{view.name}.json", "newick": f"{view.name}.nwk"})
+
+    index.sort(key=lambda entry: entry["nodes"])
+    writer.write_json(index, os.path.join(TREE_VIEW_DIR, "index.json"))
+
+    print(f"Created {len(views)} tree views.")
+    return {entry["name"]: entry["nodes"] for entry in index}
 
 
 # copy inputfiles unchanged that should be downloadable to the appropriate dir
-copyfile(XML_FILE, os.path.join(DATA_DEST, os.path.basename(XML_FILE)))
-print("Copied xml file to docs directory.")
+def copy_downloads(writer, profiler):
+    writer.copy_file(XML_FILE, os.path.join(DATA_DEST, os.path.basename(XML_FILE)))
+    print("Copied xml file to docs directory.")
+
+
+# stage name, build function, input files, output files
+# a stage depends on the stages writing its input files and runs after them (see 'utils/pipeline.py'),
+# these have to be listed before it
+# build functions get the OutputWriter to use for all files written to DATA_DEST
+# and the RunProfiler measuring the stage, they may return a dict of counts (rows, nodes, ...) for the run report
+STAGES = [
+    ("merge_reps_meta", build_merged_reps_meta,
+     [ALL_REPS] + SOURCE_INPUT_FILES,
+     SOURCE_OUTPUT_FILES + [MOTIF_REPRESENTATIVES, METADATA_REPRESENTATIVES]),
+    ("profiles", build_profiles,
+     [METADATA_REPRESENTATIVES],
+     [os.path.join(DATA_DEST, "profiles.csv")]),
+    ("representatives", build_representatives,
+     [MOTIF_REPRESENTATIVES],
+     [os.path.join(DATA_DEST, "mito_representatives.csv")]),
+    ("linear_tree", build_linear_tree,
+     [XML_FILE] + TREE_ATTRIBUTE_FILES,
+     [os.path.join(DATA_DEST, "tree.json"), os.path.join(DATA_DEST, "fullTree.nwk")]),
+    ("tree_chunks", build_tree_chunks,
+     [XML_FILE] + TREE_ATTRIBUTE_FILES,
+     [os.path.join(TREE_CHUNK_DIR, "index.json")]),
+    ("accession_index", build_accession_index,
+     [MOTIF_REPRESENTATIVES],
+     [os.path.join(DATA_DEST, "accession_index.json")]),
+    ("tree_index", build_tree_index,
+     [XML_FILE],
+     [os.path.join(DATA_DEST, "tree_index.json")]),
+    ("signatures", build_signatures,
+     [XML_FILE, MOTIF_SIGNATURES, REFERENCE_FILE],
+     [DERIVED_SIGNATURES]),
+    ("hgmotifs", build_hgmotifs,
+     [MOTIF_SIGNATURES, DERIVED_SIGNATURES],
+     [os.path.join(DATA_DEST, "hgmotifs.json")]),
+    ("mutation_index", build_mutation_index,
+     [MOTIF_SIGNATURES, DERIVED_SIGNATURES],
+     [os.path.join(DATA_DEST, "mutation_index.json")]),
+    ("node_shards", build_node_shards,
+     [XML_FILE, MOTIF_SIGNATURES, DERIVED_SIGNATURES, MOTIF_REPRESENTATIVES, METADATA_REPRESENTATIVES,
+      COLORCODE_FILE],
+     [os.path.join(NODE_SHARD_DIR, MANIFEST_NAME)]),
+    ("radial_tree", build_radial_tree,
+     [XML_FILE] + TREE_ATTRIBUTE_FILES,
+     [os.path.join(DATA_DEST, "radialTree.json"), os.path.join(DATA_DEST, "pruned_radialTree.nwk")]),
+    ("tree_views", build_tree_views,
+     [XML_FILE, MOTIF_REPRESENTATIVES] + TREE_ATTRIBUTE_FILES,
+     [os.path.join(TREE_VIEW_DIR, "index.json")]),
+    ("copy_downloads", copy_downloads,
+     [XML_FILE],
+     [os.path.join(DATA_DEST, os.path.basename(XML_FILE))]),
+]
+
+
+def main(force=False, profile="dev", trace_memory=False, cprofile_dir=None, targets=None, workers=1,
+         dry_run=False):
+    writer = OutputWriter(profile, report_file=SIZE_REPORT)
+    cache = load_build_cache(BUILD_CACHE)
+    # a different output profile writes different files, so it invalidates the cache like a code change
+    code_hash = f"{code_version(os.path.dirname(os.path.abspath(__file__)))}-{profile}"
+
+    stages = {name: (build, inputs, outputs) for name, build, inputs, outputs in STAGES}
+    dependencies = stage_dependencies(STAGES)
+    names = select_stages(STAGES, targets)
+
+    def stage_outputs(name):
+        outputs = stages[name][2]
+        # include compressed siblings of published files
+        if name == "merge_reps_meta":
+            return outputs
+        return [path for output in outputs for path in writer.output_files(output)]
+
+    def is_current(name):
+        return not force and stage_is_current(cache, name, stages[name][1], stage_outputs(name), code_hash)
+
+    if dry_run:
+        print_plan(names, dependencies, is_current)
+        return
+
+    if workers > 1 and (trace_memory or cprofile_dir):
+        print("Memory tracing and cProfile measure the whole process, running stages one after another.")
+        workers = 1
+    if workers > 1:
+        print(f"Running up to {workers} stages in threads, this only overlaps their file i/o.")
+
+    profiler = RunProfiler(RUN_REPORT, trace_memory=trace_memory, cprofile_dir=cprofile_dir)
+    rebuilt, skipped = [], []
+
+    # runs in a worker thread, returns the files written by the stage, None if it was skipped
+    def run(name):
+        if is_current(name):
+            print(f"Skipped {name}, inputs unchanged.")
+            profiler.skipped(name)
+            return None
+
+        with profiler.stage(name) as record, writer.track() as written:
+            record.count(**(stages[name][0](writer, profiler) or {}))
+        return written
+
+    # runs in this thread, so the build cache is only changed here
+    def finished(name, written):
+        if written is None:
+            skipped.append(name)
+            return
+        # record after every stage, so a failing later stage keeps earlier progress
+        # with all files the stage wrote, i.e. every node shard, not only its declared outputs
+        outputs = list(dict.fromkeys(stage_outputs(name) + written))
+        record_stage(cache, name, stages[name][1], outputs, code_hash)
+        save_build_cache(cache, BUILD_CACHE)
+        rebuilt.append(name)
+
+    run_stages(names, dependencies, run, finished, workers=workers)
+
+    print(f"\nRebuilt stages: {', '.join(rebuilt) if rebuilt else 'none'}")
+    print(f"Skipped stages: {', '.join(skipped) if skipped else 'none'}")
+
+    writer.report()
+    profiler.report()
+
+
+# prints the stages that would run, grouped by the level of their dependencies
+# stages of one level are independent of each other, with several workers their file i/o overlaps
+def print_plan(names, dependencies, is_current):
+    levels = stage_levels(names, dependencies)
+    # stages after a rebuilt one may get changed inputs
+    rebuilds = set()
+    print("Plan:")
+    for level in sorted(set(levels.values())):
+        print(f"  level {level}:")
+        for name in (name for name in names if levels[name] == level):
+            after = [dependency for dependency in dependencies[name] if dependency in levels]
+            if not is_current(name):
+                status = "rebuild"
+                rebuilds.add(name)
+            elif any(dependency in rebuilds for dependency in after):
+                status = "rebuild if its inputs change"
+                rebuilds.add(name)
+            else:
+                status = "up to date"
+            print(f"    {name:<20} {status}" + (f"{'':<{30 - len(status)}} after {', '.join(after)}" if after else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create all data files used by the mitoLEAF webapp.")
+    parser.add_argument("targets", nargs="*", metavar="TARGET",
+                        help="stages or output files (i.e. 'radial_tree' or 'radialTree.json') to build, "
+                             "together with the stages they depend on (default: all)")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild all selected stages, ignoring the build cache")
+    parser.add_argument("--profile", choices=PROFILES, default="dev",
+                        help="'dev' writes readable json, "
+                             "'publish' writes minified json and precompressed .gz/.br files (default: dev)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of stages run at the same time in threads. only overlaps file i/o, "
+                             "no speedup as the stages are cpu bound and hold the GIL (default: 1)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the stages that would run and their dependencies, without running them")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record the tracemalloc peak and top allocations of every stage (slower)")
+    parser.add_argument("--cprofile", metavar="DIR",
+                        help="write a cProfile dump of every stage to DIR")
+    args = parser.parse_args()
+    try:
+        select_stages(STAGES, args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+
+    main(force=args.force, profile=args.profile, trace_memory=args.trace_memory, cprofile_dir=args.cprofile,
+         targets=args.targets, workers=args.workers, dry_run=args.dry_run)
@@ -0,0 +1,121 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# lookup index of accessions (profiles) and the haplogroups they represent
+#
+# the accessions are stored grouped by haplogroup, haplogroups sorted by name
+# and accessions sorted within each haplogroup:
+#   haplogroup -> accession range   the range of haplogroup i is [offset[i], offset[i + 1])
+#   accession -> haplogroup         binary search in the sorted accessions, then in the offsets
+# the sort order of all accessions is built on load, so it is not part of the file.
+#
+# written as 'accession_index.json' with the haplogroups, their number of accessions
+# and all accessions as a single space separated string in range order.
+#
+#################################
+
+import json
+
+import numpy as np
+
+
+class AccessionIndex:
+    """
+    Index of accessions and their haplogroups, see module comment.
+    Haplogroups without accessions are not part of the index.
+    """
+
+    def __init__(self, haplogroups, counts, accessions):
+        self.haplogroups = list(haplogroups)
+        self.offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        self.accessions = np.asarray(accessions, dtype=str)
+        if len(self.accessions) != self.offsets[-1]:
+            raise ValueError(f"Expected {self.offsets[-1]} accessions, got {len(self.accessions)}.")
+
+        self._position = {haplogroup: i for i, haplogroup in enumerate(self.haplogroups)}
+        # stable, so an accession listed under several haplogroups is found under the first one
+        self._order = np.argsort(self.accessions, kind="stable")
+        self._sorted = self.accessions[self._order]
+
+    @classmethod
+    def from_profiles(cls, profiles):
+        """
+        Builds the index from a dictionary of haplogroup to list of accessions (see 'load_profiles_dict').
+        """
+        haplogroups = sorted(haplogroup for haplogroup, accessions in profiles.items() if accessions)
+        accessions = [sorted(profiles[haplogroup]) for haplogroup in haplogroups]
+        return cls(haplogroups, [len(group) for group in accessions],
+                   [accession for group in accessions for accession in group])
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, accession):
+        return self._find(np.asarray([accession], dtype=str))[0] >= 0
+
+    # positions in range order of an array of accessions, -1 for unknown ones
+    def _find(self, accessions):
+        if not len(self._sorted):
+            return np.full(len(accessions), -1, dtype=np.int64)
+        found = np.searchsorted(self._sorted, accessions)
+        clipped = np.minimum(found, len(self._sorted) - 1)
+        hit = self._sorted[clipped] == accessions
+        return np.where(hit, self._order[clipped], -1)
+
+    def haplogroup(self, accession):
+        haplogroup = self.batch_haplogroups([accession])[0]
+        if haplogroup is None:
+            raise KeyError(f"Accession '{accession}' is not in the index.")
+        return haplogroup
+
+    def batch_haplogroups(self, accessions):
+        """
+        Haplogroups of a list of accessions, None for accessions that are not in the index.
+        """
+        positions = self._find(np.asarray(accessions, dtype=str))
+        groups = np.searchsorted(self.offsets, positions, side="right") - 1
+        return [self.haplogroups[group] if position >= 0 else None
+                for position, group in zip(positions.tolist(), groups.tolist())]
+
+    def accession_range(self, haplogroup):
+        """
+        (start, end) of the accessions of a haplogroup in range order, (0, 0) if it has none.
+        """
+        position = self._position.get(haplogroup)
+        if position is None:
+            return 0, 0
+        return int(self.offsets[position]), int(self.offsets[position + 1])
+
+    def accessions_of(self, haplogroup):
+        """
+        Sorted accessions of a haplogroup.
+        """
+        start, end = self.accession_range(haplogroup)
+        return self.accessions[start:end].tolist()
+
+    def batch_accessions(self, haplogroups):
+        return [self.accessions_of(haplogroup) for haplogroup in haplogroups]
+
+    def to_json(self):
+        return {
+            "haplogroups": self.haplogroups,
+            "counts": np.diff(self.offsets).tolist(),
+            "accessions": " ".join(self.accessions.tolist()),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["haplogroups"], data["counts"], data["accessions"].split())
+
+
+def load_accession_index(index_file):
+    with open(index_file, "r") as f:
+        return AccessionIndex.from_json(json.load(f))
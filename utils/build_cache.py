@@ -0,0 +1,126 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+################################
+#
+# build cache used by 'tree_dat_process' to skip stages whose inputs did not change
+#
+# for every stage the content hashes of its input and output files are recorded,
+# together with a hash of the pipeline code. outputs are the declared output files of the stage
+# and every other file it wrote (i.e. all node shards), so deleting or editing any of them forces a rebuild.
+# a stage is only rebuilt if any of these differ from the last recorded build.
+#
+################################
+
+import glob
+import hashlib
+import json
+import os
+
+
+# bump if the layout of the cache file changes
+CACHE_FORMAT = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Returns the sha256 hex digest of the content of 'path', or None if the file does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_version(root_dir="."):
+    """
+    Hashes all pipeline source files (python files in 'root_dir' and 'root_dir/utils').
+    Any change to the code invalidates every stage.
+    """
+    sources = sorted(glob.glob(os.path.join(root_dir, "*.py")) +
+                     glob.glob(os.path.join(root_dir, "utils", "*.py")))
+
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(os.path.relpath(source, root_dir).encode())
+        digest.update((file_hash(source) or "").encode())
+    return digest.hexdigest()
+
+
+def load_build_cache(cache_file):
+    """
+    Reads the cache file written by 'save_build_cache'.
+    Returns an empty cache if the file is missing, unreadable or of a different format.
+    """
+    empty = {"format": CACHE_FORMAT, "stages": {}}
+
+    if not os.path.isfile(cache_file):
+        return empty
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return empty
+
+    if cache.get("format") != CACHE_FORMAT:
+        return empty
+    return cache
+
+
+def save_build_cache(cache, cache_file):
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    # write to a temp file first so a crash never leaves a half written cache
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f, indent=4, sort_keys=True)
+    os.replace(tmp_file, cache_file)
+
+
+def stage_is_current(cache, stage, inputs, outputs, code_hash):
+    """
+    Checks whether 'stage' can be skipped.
+
+    True if the recorded code hash matches, all 'inputs' and all recorded outputs
+    (at least the declared 'outputs') still have the content hashes recorded after
+    the last successful build of the stage. Missing outputs always force a rebuild.
+    """
+    entry = cache["stages"].get(stage)
+    if entry is None or entry.get("code") != code_hash:
+        return False
+
+    if sorted(entry["inputs"]) != sorted(inputs) or not set(outputs) <= set(entry["outputs"]):
+        return False
+
+    for path in inputs:
+        if file_hash(path) != entry["inputs"][path]:
+            return False
+
+    for path, recorded in entry["outputs"].items():
+        current = file_hash(path)
+        if current is None or current != recorded:
+            return False
+
+    return True
+
+
+def record_stage(cache, stage, inputs, outputs, code_hash):
+    """
+    Stores the current hashes of 'inputs' and 'outputs' for 'stage'.
+    Should be called after the stage has written all its outputs,
+    'outputs' being its declared outputs and all other files it wrote.
+    """
+    cache["stages"][stage] = {
+        "code": code_hash,
+        "inputs": {path: file_hash(path) for path in inputs},
+        "outputs": {path: file_hash(path) for path in outputs},
+    }
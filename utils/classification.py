@@ -0,0 +1,242 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# batch haplogroup classification of sample profiles
+#
+# every full hg signature (see 'parse_haplo_motifs') is encoded as a bitset over the mutations of
+# all signatures, as interned ids of the shared mutation vocabulary (see 'utils/mutations.py').
+# samples are encoded the same way, so the number of shared mutations of a batch of samples with
+# all haplogroups is computed with bitwise and + popcount on numpy arrays instead of python set logic per pair.
+#
+# haplogroups are ranked by the Kulczynski measure (as used by HaploGrep):
+#   0.5 * (found / expected + found / sample mutations)
+# ties go to the haplogroup with the longer signature, i.e. the more specific one.
+#
+# usage:
+#   python -m utils.classification <samples file> [-o output.csv] [--top N]
+#
+# the samples file is either a csv with an id and a profile column (space separated mutations)
+# or a tab delimited file in the .emp format (id in the first, profile in the fourth column)
+#
+#################################
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.hgmotif_creation import parse_haplo_motifs
+from utils.mutations import VOCABULARY
+from utils.path_defaults import MOTIF_SIGNATURES
+
+
+# number of samples scored at once, bounds the memory of the score matrices
+BATCH_SIZE = 256
+
+# popcount of every byte value, fallback for numpy versions without 'bitwise_count'
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    counts = _BYTE_POPCOUNT[words.view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+class Profile:
+    """
+    Mutations of a profile string: sorted array of vocabulary ids and a set of the tokens
+    that can not be parsed as mutations, these are kept as they are.
+    """
+    __slots__ = ("ids", "unparsed")
+
+    def __init__(self, profile):
+        ids, unparsed = set(), set()
+        for token in str(profile).split():
+            try:
+                ids.add(VOCABULARY.intern(token))
+            except ValueError:
+                unparsed.add(token)
+        self.ids = np.array(sorted(ids), dtype=np.int32)
+        self.unparsed = frozenset(unparsed)
+
+    def __len__(self):
+        return len(self.ids) + len(self.unparsed)
+
+    def intersection(self, other):
+        return np.intersect1d(self.ids, other.ids, assume_unique=True), self.unparsed & other.unparsed
+
+    def difference(self, other):
+        return np.setdiff1d(self.ids, other.ids, assume_unique=True), self.unparsed - other.unparsed
+
+
+# mutations as string, unparsable ones first, the others as canonical keys sorted by position, insertion and allele
+def mutations_string(mutations):
+    ids, unparsed = mutations
+    return " ".join(sorted(unparsed) + VOCABULARY.keys(ids.tolist()))
+
+
+class HaplogroupClassifier:
+    """
+    Scores sample profiles against all haplogroup signatures at once.
+
+    haplogroups  - list of haplogroup names
+    mutation_ids - sorted vocabulary ids of all signature mutations, bit i of a bitset is mutation_ids[i]
+    unparsed     - signature tokens that are no mutations, bits after those of 'mutation_ids'
+    signatures   - uint64 array of shape (haplogroups, words), the bitset of every signature
+    """
+
+    def __init__(self, hgmotif_dict):
+        self.haplogroups = list(hgmotif_dict)
+        self.signature_profiles = [Profile(hgmotif_dict[hg]) for hg in self.haplogroups]
+
+        self.mutation_ids = np.unique(np.concatenate([profile.ids for profile in self.signature_profiles]
+                                                     + [np.zeros(0, dtype=np.int32)]))
+        self.unparsed = sorted(set().union(*(profile.unparsed for profile in self.signature_profiles)))
+        self._unparsed_index = {token: len(self.mutation_ids) + i for i, token in enumerate(self.unparsed)}
+
+        self.signatures = self.encode(self.signature_profiles)
+        self.expected = _popcount(self.signatures).sum(axis=1, dtype=np.int32)
+        # word major copy, so the words of all signatures are contiguous in 'found_counts'
+        self._signature_words = np.ascontiguousarray(self.signatures.T)
+
+    @classmethod
+    def from_emp(cls, emp_file=MOTIF_SIGNATURES):
+        return cls(parse_haplo_motifs(emp_file))
+
+    @property
+    def num_words(self):
+        return (len(self.mutation_ids) + len(self.unparsed) + 63) // 64
+
+    def encode(self, profiles):
+        """
+        Bitsets of the given Profiles, shape (profiles, words).
+        Mutations not in any signature are not encoded.
+        """
+        bits = np.zeros((len(profiles), self.num_words * 64), dtype=bool)
+        for row, profile in enumerate(profiles):
+            columns = np.searchsorted(self.mutation_ids, profile.ids)
+            known = columns < len(self.mutation_ids)
+            known[known] = self.mutation_ids[columns[known]] == profile.ids[known]
+            bits[row, columns[known]] = True
+            bits[row, [self._unparsed_index[t] for t in profile.unparsed if t in self._unparsed_index]] = True
+        # little bit order, so bit i of the packed words is column i
+        return np.packbits(bits, axis=1, bitorder="little").view(np.uint64)
+
+    def found_counts(self, sample_bits):
+        """
+        Number of shared mutations of every sample with every haplogroup, shape (samples, haplogroups).
+        Accumulated word by word, so memory stays at one (samples, haplogroups) matrix.
+        """
+        found = np.zeros((len(sample_bits), len(self.haplogroups)), dtype=np.int32)
+        for word in range(self.num_words):
+            sample_words = sample_bits[:, word]
+            # words without any sample mutation can not add to the counts
+            if not sample_words.any():
+                continue
+            found += _popcount(sample_words[:, None] & self._signature_words[word][None, :])
+        return found
+
+    def classify(self, profiles, top=1):
+        """
+        Classifies sample profiles.
+
+        Parameters
+        ----------
+        profiles : dict
+            Sample id to profile string (space separated mutations).
+        top : int
+            Number of best matching haplogroups to report per sample, at least 1.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per sample and rank with the score and the expected, found,
+            missing and extra mutations of the haplogroup.
+        """
+        if top < 1:
+            raise ValueError(f"top has to be at least 1, got {top}.")
+        sample_ids = list(profiles)
+        rows = []
+
+        for start in range(0, len(sample_ids), BATCH_SIZE):
+            batch_ids = sample_ids[start:start + BATCH_SIZE]
+            batch_profiles = [Profile(profiles[sample_id]) for sample_id in batch_ids]
+
+            found = self.found_counts(self.encode(batch_profiles))
+            sample_sizes = np.array([len(profile) for profile in batch_profiles], dtype=np.float64)[:, None]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = 0.5 * (np.nan_to_num(found / self.expected[None, :]) +
+                                np.nan_to_num(found / sample_sizes))
+
+            # best scores first, ties broken by longer signatures
+            # scores are fractions of small integers, so the tie breaker never outweighs a score difference
+            ranking = scores + self.expected[None, :] * 1e-9
+            top_n = min(top, ranking.shape[1])
+            candidates = np.argpartition(-ranking, top_n - 1, axis=1)[:, :top_n]
+            order = np.take_along_axis(candidates,
+                                       np.argsort(-np.take_along_axis(ranking, candidates, axis=1), axis=1), axis=1)
+
+            for i, sample_id in enumerate(batch_ids):
+                for rank, hg_index in enumerate(order[i], start=1):
+                    rows.append(self._result_row(sample_id, rank, hg_index, scores[i, hg_index], batch_profiles[i]))
+
+        return pd.DataFrame(rows, columns=["sample_id", "rank", "haplogroup", "score",
+                                           "expected", "found", "missing", "extra"])
+
+    def _result_row(self, sample_id, rank, hg_index, score, sample):
+        # mutation lists are only built for the reported haplogroups
+        expected = self.signature_profiles[hg_index]
+
+        return [sample_id, rank, self.haplogroups[hg_index], round(float(score), 4),
+                mutations_string((expected.ids, expected.unparsed)), mutations_string(expected.intersection(sample)),
+                mutations_string(expected.difference(sample)), mutations_string(sample.difference(expected))]
+
+
+# argparse type of counts of at least one
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got {value}")
+    return number
+
+
+# reads sample profiles as dict of sample id to profile string
+def read_sample_profiles(samples_file, id_col="sample_id", profile_col="profile"):
+    if os.path.splitext(samples_file)[1].lower() == ".csv":
+        samples_df = pd.read_csv(samples_file, dtype=str, keep_default_na=False)
+        for column in (id_col, profile_col):
+            if column not in samples_df.columns:
+                raise ValueError(f"'{column}' column not found in {samples_file}.")
+        return dict(zip(samples_df[id_col], samples_df[profile_col]))
+
+    return parse_haplo_motifs(samples_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign haplogroups to sample profiles.")
+    parser.add_argument("samples", help="csv file with id and profile columns, or a tab delimited .emp like file")
+    parser.add_argument("-o", "--output", default="classification.csv", help="output csv file")
+    parser.add_argument("--top", type=positive_int, default=1, help="number of best haplogroups per sample")
+    parser.add_argument("--signatures", default=MOTIF_SIGNATURES, help="full hg signatures (.emp file)")
+    parser.add_argument("--id-col", default="sample_id", help="id column of a csv samples file")
+    parser.add_argument("--profile-col", default="profile", help="profile column of a csv samples file")
+    args = parser.parse_args()
+
+    classifier = HaplogroupClassifier.from_emp(args.signatures)
+    sample_profiles = read_sample_profiles(args.samples, args.id_col, args.profile_col)
+
+    results = classifier.classify(sample_profiles, top=args.top)
+    results.to_csv(args.output, index=False)
+    print(f"Classified {len(sample_profiles)} samples, results written to {args.output}.")
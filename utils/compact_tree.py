@@ -0,0 +1,198 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# compact array backed tree used instead of an ElementTree DOM
+#
+# nodes are plain integer indices. the structure is kept in flat
+# parent / first child / next sibling arrays and the 'Id' and 'HG'
+# attributes are indices into a shared string table.
+# all traversals are iterative, so tree depth is not bound by the recursion limit.
+#
+#################################
+
+import xml.etree.ElementTree as ET
+from array import array
+
+
+# marks a missing node or string reference in the index arrays
+NONE = -1
+
+
+class CompactTree:
+
+    def __init__(self):
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        # only needed to append children in order
+        self.last_child = array('i')
+
+        self.id_ref = array('i')
+        self.hg_ref = array('i')
+
+        # shared string table for ids and hg strings
+        self.strings = []
+        self._string_index = {}
+
+        self._id_index = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    # compatibility with ElementTree, root is always the first node added
+    def getroot(self):
+        return 0 if len(self) else NONE
+
+    def intern(self, value):
+        if value is None:
+            return NONE
+        ref = self._string_index.get(value)
+        if ref is None:
+            ref = len(self.strings)
+            self.strings.append(value)
+            self._string_index[value] = ref
+        return ref
+
+    # appends a node as last child of 'parent' (NONE for the root)
+    # returns the index of the new node
+    def add_node(self, parent, node_id, hg=""):
+        node = len(self.parent)
+
+        self.parent.append(parent)
+        self.first_child.append(NONE)
+        self.next_sibling.append(NONE)
+        self.last_child.append(NONE)
+        self.id_ref.append(self.intern(node_id))
+        self.hg_ref.append(self.intern(hg))
+
+        if parent != NONE:
+            if self.first_child[parent] == NONE:
+                self.first_child[parent] = node
+            else:
+                self.next_sibling[self.last_child[parent]] = node
+            self.last_child[parent] = node
+
+        self._id_index = None
+        return node
+
+    def get_id(self, node):
+        ref = self.id_ref[node]
+        return None if ref == NONE else self.strings[ref]
+
+    def get_hg(self, node):
+        ref = self.hg_ref[node]
+        return "" if ref == NONE else self.strings[ref]
+
+    def children(self, node):
+        child = self.first_child[node]
+        while child != NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    def num_children(self, node):
+        return sum(1 for _ in self.children(node))
+
+    def is_leaf(self, node):
+        return self.first_child[node] == NONE
+
+    # index of the node with 'node_id' or None
+    def find(self, node_id):
+        if self._id_index is None:
+            self._id_index = {self.get_id(node): node for node in range(len(self))}
+        return self._id_index.get(node_id)
+
+    # parents before children, siblings in document order
+    def preorder(self, start=None):
+        if start is None:
+            start = self.getroot()
+        if start == NONE:
+            return
+
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            yield node
+            # push last sibling first so the first child is visited next
+            children = list(self.children(node))
+            stack.extend(reversed(children))
+
+    # depth first walk yielding (node, True) when a node is entered
+    # and (node, False) once all of its children are done
+    def walk(self, start=None):
+        if start is None:
+            start = self.getroot()
+        if start == NONE:
+            return
+
+        # (node, next child to expand)
+        yield start, True
+        stack = [(start, self.first_child[start])]
+        while stack:
+            node, child = stack[-1]
+            if child == NONE:
+                stack.pop()
+                yield node, False
+            else:
+                stack[-1] = (node, self.next_sibling[child])
+                yield child, True
+                stack.append((child, self.first_child[child]))
+
+    # children before parents, siblings in document order
+    def postorder(self, start=None):
+        if start is None:
+            start = self.getroot()
+        if start == NONE:
+            return
+
+        # (node, next child to expand)
+        stack = [(start, self.first_child[start])]
+        while stack:
+            node, child = stack[-1]
+            if child == NONE:
+                stack.pop()
+                yield node
+            else:
+                stack[-1] = (node, self.next_sibling[child])
+                stack.append((child, self.first_child[child]))
+
+
+# builds a CompactTree from an xml file in a single streaming pass
+# each <Node> becomes a node. elements are cleared and removed from their parent as soon as they are closed,
+# so memory only holds the elements of the current path, not one (empty) element per node
+def load_compact_tree(xml_file, tag="Node"):
+    tree = CompactTree()
+    stack = []
+    # open elements of any tag, outermost first
+    elements = []
+
+    for event, element in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+            if element.tag != tag:
+                continue
+            parent = stack[-1] if stack else NONE
+            if parent == NONE and len(tree):
+                raise ValueError(f"More than one root node found in {xml_file}.")
+            stack.append(tree.add_node(parent, element.get("Id"), element.get("HG", "")))
+            continue
+
+        elements.pop()
+        if element.tag == tag:
+            stack.pop()
+        element.clear()
+        if elements:
+            # earlier children are removed already, so this is the only child left
+            elements[-1].remove(element)
+
+    if not len(tree):
+        raise ValueError(f"No <{tag}> elements found in {xml_file}.")
+
+    return tree
@@ -8,18 +8,371 @@
 
 
 # helper file to create tree building input file where all sequences are in a single file.
+#
+# fasta files are read by a bounded thread pool, while the main thread writes
+# their records in sorted file order as soon as it is their turn.
+# so only the records of the files in flight are held in memory, never all sequences.
+# plain and gzip/bgzip compressed files with any number of records are accepted.
+#
+# a manifest next to the output records size, mtime and content hash of every fasta file
+# and the byte offset of each of its records in the output.
+# a rerun only reads new and changed fasta files:
+# - only new files whose names sort after all previous ones: their records are appended to the output in place
+# - otherwise the output is rewritten, records of unchanged files
+#   are copied as bytes from the previous output instead of being parsed again
+# either way the records are in sorted file order, the same as after a full rebuild.
 
+import argparse
+import gzip
+import hashlib
+import json
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+FASTA_SUFFIXES = (".fasta", ".fa", ".fna", ".fas")
+
+FST_HEADER = b"#! ALL\n"
+
+# bump if the layout of the manifest changes
+MANIFEST_FORMAT = 1
+
+# files larger than this are not read ahead by the pool,
+# but streamed record by record when it is their turn
+PREFETCH_LIMIT = 64 * 1024 * 1024
+
+# files read ahead per worker thread
+PREFETCH_PER_WORKER = 4
+
+# chunk size when copying records of unchanged files
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def is_fasta_file(filename):
+    if filename.endswith(".gz"):
+        filename = filename[:-3]
+    return filename.endswith(FASTA_SUFFIXES)
+
+
+def list_fasta_files(fasta_dir):
+    """
+    Sorted paths of all (optionally gzipped) fasta files in 'fasta_dir'.
+    The sorting makes the record order of the output independent of the file system.
+    """
+    return [os.path.join(fasta_dir, filename) for filename in sorted(os.listdir(fasta_dir))
+            if is_fasta_file(filename) and os.path.isfile(os.path.join(fasta_dir, filename))]
+
+
+def open_fasta(filepath):
+    # bgzip files are multi member gzip files, which gzip reads transparently
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rt")
+    return open(filepath, "r")
 
 
-def create_fst_file(fasta_dir, output_file="sequences.fst"):
+def read_fasta_records(filepath):
+    """
+    Yields (id_version, sequence) for every record of a fasta file.
+
+    The id is the first token of the header line, e.g. 'KF040496.1' of '>KF040496.1 some notes'.
+    Records without an id are skipped with a message.
+    """
+    with open_fasta(filepath) as f:
+        yield from parse_fasta_lines(filepath, f)
+
+
+def parse_fasta_lines(filepath, lines):
+    id_version = None
+    seq_lines = []
+    has_header = False
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith(">"):
+            if has_header:
+                yield from _finish_record(filepath, id_version, seq_lines)
+            # get "id.version" from header
+            # assuming its the first token
+            header_parts = line[1:].split()
+            id_version = header_parts[0] if header_parts else None
+            seq_lines = []
+            has_header = True
+        elif line:
+            seq_lines.append(line)
+
+    yield from _finish_record(filepath, id_version if has_header else None, seq_lines)
+
+
+def _finish_record(filepath, id_version, seq_lines):
+    if not id_version:
+        print(f"Parsing fasta header unsuccessful for {filepath} ; skipping.")
+        return
+    yield id_version, "".join(seq_lines)
+
+
+# sha256 of the content of a file, as 'utils/build_cache.file_hash'
+# kept here, so this file still runs on its own as 'python utils/create_comb_fst_file.py <dir>'
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# content hash and records of a file, read in a worker thread
+# None for large files, which are streamed by the writer instead
+def _prefetch(filepath):
+    if os.path.getsize(filepath) > PREFETCH_LIMIT:
+        return None
+
+    with open(filepath, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if filepath.endswith(".gz"):
+        data = gzip.decompress(data)
+    return digest, list(parse_fasta_lines(filepath, data.decode().splitlines()))
+
+
+def iter_fasta_files(fasta_files, max_workers=None):
+    """
+    Yields (filepath, content hash, records) for every file in the order of 'fasta_files'.
+    Files are read ahead by a bounded thread pool, large files are streamed.
+    """
+    if not fasta_files:
+        return
+
+    # same default as the ThreadPoolExecutor
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # bounded read ahead, futures are consumed in submission order
+        window = max_workers * PREFETCH_PER_WORKER
+        pending = deque()
+        files = iter(fasta_files)
+
+        for filepath in files:
+            pending.append((filepath, executor.submit(_prefetch, filepath)))
+            if len(pending) >= window:
+                break
+
+        while pending:
+            filepath, future = pending.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(_prefetch, next_file)))
+
+            result = future.result()
+            if result is None:
+                yield filepath, file_hash(filepath), read_fasta_records(filepath)
+            else:
+                yield filepath, *result
+
+
+class _Progress:
+
+    def __init__(self, num_files, interval=2.0):
+        self.num_files = num_files
+        self.interval = interval
+        self.files = 0
+        self.records = 0
+        self.bases = 0
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    def add(self, records, bases):
+        self.records += records
+        self.bases += bases
+
+    def file_done(self):
+        self.files += 1
+        now = time.perf_counter()
+        if now - self._last >= self.interval or self.files == self.num_files:
+            self._last = now
+            self.print()
+
+    def print(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print(f"  {self.files}/{self.num_files} files, {self.records} sequences, "
+              f"{self.records / elapsed:.0f} seq/s, {self.bases / elapsed / 1e6:.1f} Mbp/s")
+
+
+### manifest
+
+
+def manifest_path(output_file):
+    return output_file + ".manifest.json"
+
+
+def _file_stat(filepath):
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(output_file):
+    """
+    Reads the manifest of 'output_file'.
+    Returns None if it is missing, of a different format or does not match the output,
+    i.e. the output was changed or removed since, in which case a full rebuild is needed.
+    """
+    path = manifest_path(output_file)
+    if not os.path.isfile(path) or not os.path.isfile(output_file):
+        return None
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("format") != MANIFEST_FORMAT:
+        return None
+    if list(_file_stat(output_file)) != [manifest["output"]["size"], manifest["output"]["mtime"]]:
+        return None
+    return manifest
+
+
+def save_manifest(output_file, files):
+    """
+    files - dict of fasta file name to its entry, in output order:
+            {"path", "size", "mtime", "hash", "records": [[id_version, offset, length], ...]}
+    """
+    size, mtime = _file_stat(output_file)
+    manifest = {"format": MANIFEST_FORMAT, "output": {"size": size, "mtime": mtime}, "files": files}
+
+    tmp_file = manifest_path(output_file) + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_file, manifest_path(output_file))
+
+
+### writing
+
+
+def _file_entry(filepath, digest, records):
+    size, mtime = _file_stat(filepath)
+    return {"path": filepath, "size": size, "mtime": mtime, "hash": digest, "records": records}
+
+
+# writes records as `id_version ? 1 sequence` lines
+# returns the [id_version, offset, length] of every record
+def _write_records(out_f, records, progress):
+    written = []
+    for id_version, seq_str in records:
+        line = f"{id_version} ? 1 {seq_str}\n".encode()
+        written.append([id_version, out_f.tell(), len(line)])
+        out_f.write(line)
+        progress.add(1, len(seq_str))
+    progress.file_done()
+    return written
+
+
+# copies the records of an unchanged file from the previous output
+# records of a file are contiguous, so this is a single byte range
+def _copy_records(in_f, out_f, records):
+    if not records:
+        return []
+
+    start = records[0][1]
+    end = records[-1][1] + records[-1][2]
+    shift = out_f.tell() - start
+
+    in_f.seek(start)
+    remaining = end - start
+    while remaining:
+        chunk = in_f.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ValueError("Previous output is shorter than recorded in its manifest.")
+        out_f.write(chunk)
+        remaining -= len(chunk)
+
+    return [[id_version, offset + shift, length] for id_version, offset, length in records]
+
+
+def _full_build(fasta_files, output_file, max_workers):
+    progress = _Progress(len(fasta_files))
+    files = {}
+
+    with open(output_file, "wb") as out_f:
+        out_f.write(FST_HEADER)
+        for filepath, digest, records in iter_fasta_files(fasta_files, max_workers):
+            files[os.path.basename(filepath)] = _file_entry(filepath, digest, _write_records(out_f, records, progress))
+
+    return files, progress.records
+
+
+def _incremental_build(fasta_files, output_file, manifest, max_workers):
+    previous = manifest["files"]
+    current = {os.path.basename(filepath): filepath for filepath in fasta_files}
+
+    unchanged, changed = [], []
+    for name, entry in previous.items():
+        if name not in current:
+            continue
+        filepath = current[name]
+        size, mtime = _file_stat(filepath)
+        if [size, mtime] == [entry["size"], entry["mtime"]]:
+            unchanged.append(name)
+        elif size == entry["size"] and file_hash(filepath) == entry["hash"]:
+            # touched but same content
+            entry.update(path=filepath, mtime=mtime)
+            unchanged.append(name)
+        else:
+            changed.append(name)
+
+    removed = [name for name in previous if name not in current]
+    new = [name for name in current if name not in previous]
+
+    print(f"{len(unchanged)} unchanged, {len(changed)} changed, {len(new)} new and {len(removed)} removed files.")
+
+    if not changed and not removed and not new:
+        print(f"\n{output_file} is up to date.")
+        return previous, 0
+
+    # files in output order (sorted, as in a full build), None for files to read
+    plan = [(name, previous[name] if name in unchanged else None) for name in sorted(current)]
+    # new files can only be appended if they keep the sorted order
+    append = not changed and not removed and min(new) > max(previous, default="")
+
+    to_read = [current[name] for name, entry in plan if entry is None]
+    progress = _Progress(len(to_read))
+    file_records = iter_fasta_files(to_read, max_workers)
+    files = {}
+
+    if append:
+        # only new files after all previous ones, append them in place
+        with open(output_file, "r+b") as out_f:
+            out_f.seek(manifest["output"]["size"])
+            out_f.truncate()
+            files.update(previous)
+            for filepath, digest, records in file_records:
+                files[os.path.basename(filepath)] = _file_entry(filepath, digest,
+                                                                _write_records(out_f, records, progress))
+        return files, progress.records
+
+    tmp_file = output_file + ".tmp"
+    with open(output_file, "rb") as in_f, open(tmp_file, "wb") as out_f:
+        out_f.write(FST_HEADER)
+        for name, entry in plan:
+            if entry is not None:
+                files[name] = dict(entry, records=_copy_records(in_f, out_f, entry["records"]))
+            else:
+                filepath, digest, records = next(file_records)
+                files[name] = _file_entry(filepath, digest, _write_records(out_f, records, progress))
+    os.replace(tmp_file, output_file)
+
+    return files, progress.records
+
+
+def create_fst_file(fasta_dir, output_file="sequences.fst", max_workers=None, full=False):
     """
     Collects sequences from all FASTA files in 'fasta_dir'.
 
-    Expects each FASTA to have a single sequence and a header
+    Each FASTA may hold any number of sequences, each with a header
     line (starting with '>') containing the full id.version,
-    e.g.: '>KF040496.1 some notes'.
+    e.g.: '>KF040496.1 some notes'. Files may be gzip or bgzip compressed.
 
     It writes 'sequences.fst' with the following format:
 
@@ -27,55 +380,43 @@ def create_fst_file(fasta_dir, output_file="sequences.fst"):
         KF040496.1 ? 1 ATATCAGG...
         ...
 
-    :param fasta_dir: Directory containing *.fasta files
+    and a manifest 'sequences.fst.manifest.json' used to only process new,
+    changed and removed files on the next run.
+    A full build writes records in order of the sorted file names, and in file order within a file.
+
+    :param fasta_dir: Directory containing *.fasta (or *.fa, *.fna, *.fas, optionally .gz) files
     :param output_file: Name of the output .fst file
+    :param max_workers: Number of threads reading files, defaults to the ThreadPoolExecutor default
+    :param full: Rebuild the output from all files, ignoring the manifest
+    :return: Number of sequences read from fasta files
     """
     print(f"\nConverting directory '{fasta_dir}' to a combined file at '{output_file}'.\nThis may take a while...\n")
 
-    # list of (id_version, sequence)
-    records = []
-
-    for filename in os.listdir(fasta_dir):
-        if not filename.endswith(".fasta"):
-            continue
-
-        filepath = os.path.join(fasta_dir, filename)
-        with open(filepath, "r") as f:
-            id_version = None
-            seq_lines = []
-
-            for line in f:
-                line = line.strip()
-                if line.startswith(">"):
-                    # get "id.version" from header
-                    # assuming its the first token
-                    header_parts = line[1:].split()
-                    id_version = header_parts[0] if header_parts else None
-                else:
-                    seq_lines.append(line)
+    fasta_files = list_fasta_files(fasta_dir)
+    manifest = None if full else load_manifest(output_file)
 
-            if not id_version:
-                print(f"Parsing fasta header unsuccessful for {filepath} ; skipping.")
-                continue
+    if manifest is None:
+        files, num_read = _full_build(fasta_files, output_file, max_workers)
+    else:
+        files, num_read = _incremental_build(fasta_files, output_file, manifest, max_workers)
 
-            sequence = "".join(seq_lines)
-            records.append((id_version, sequence))
+    save_manifest(output_file, files)
 
-    # write to the output file as `id_version ? 1 sequence` line for each file in dir
-    with open(output_file, "w", newline="\n") as out_f:
-        out_f.write("#! ALL\n")
-        for (id_version, seq_str) in records:
-            out_f.write(f"{id_version} ? 1 {seq_str}\n")
-
-    print(f"\nWrote {len(records)} sequences to {output_file}.")
+    total = sum(len(entry["records"]) for entry in files.values())
+    print(f"\nWrote {num_read} sequences to {output_file}, it now holds {total} sequences.")
+    return num_read
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python collect_fasta_sequences.py <fasta_directory> [output_file]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Combine all fasta files of a directory into a single .fst file.")
+    parser.add_argument("fasta_dir", help="directory containing the fasta files")
+    parser.add_argument("output_file", nargs="?", default="sequences.fst", help="output .fst file")
+    parser.add_argument("--workers", type=int, default=None, help="number of threads reading files")
+    parser.add_argument("--full", action="store_true", help="rebuild the output from all files, ignoring the manifest")
+    args = parser.parse_args()
 
-    fasta_dir = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "sequences.fst"
+    if not os.path.isdir(args.fasta_dir):
+        print(f"'{args.fasta_dir}' is not a directory.")
+        sys.exit(1)
 
-    create_fst_file(fasta_dir, output_file)
+    create_fst_file(args.fasta_dir, args.output_file, args.workers, args.full)
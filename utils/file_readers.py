@@ -22,14 +22,15 @@ import csv
 def csv_as_dict(file, delimiter=None):
     if not delimiter:
         delimiter = ';'
-    reader = csv.reader(open(file, encoding='utf-8-sig'), delimiter=delimiter)
     result = {}
-    next(reader)
-    for row in reader:
-        key, value = row
-        if key in result:
-            pass
-        result[key] = value
+    with open(file, encoding='utf-8-sig') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        next(reader)
+        for row in reader:
+            key, value = row
+            if key in result:
+                pass
+            result[key] = value
     return result
 
 
@@ -47,21 +47,3 @@ def parse_haplo_motifs(input_file):
         print(f"Created dict with haplogroup-motif pairs from {input_file}.")
         return haplogroup_dict
 
-
-def check_same_haplos(json_tree, haplogroup_dict):
-
-    haplos = set()
-
-    def traverse(node):
-        if "name" in node:
-            haplos.add(node["name"])
-        if "children" in node:
-            for child in node["children"]:
-                traverse(child)
-
-    traverse(json_tree)
-
-    if set(haplogroup_dict.keys()) != haplos:
-        return False
-
-    return True
\ No newline at end of file
@@ -0,0 +1,176 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# catalog of parsed input files, so every input is parsed once per run
+#
+# 'read(path, parser)' parses a file with 'parser' and keeps the result, keyed on the path, parser
+# and the size and modification time of the file. later reads of the unchanged file return it
+# without touching the file again, a rewritten file is parsed anew.
+# results are handed out as read only views (see 'read_only'), so no caller changes them for the others.
+#
+# with 'persist=True' the parsed result is also pickled to the cache dir and reused by later runs
+# (and worker processes) as long as the file and the pandas version are unchanged. one pickle per path and parser,
+# replaced once the file changes.
+#
+# hits, parses and pickle loads are counted in 'stats', i.e. for the run report.
+#
+#################################
+
+import csv
+import hashlib
+import os
+import pickle
+import threading
+from types import MappingProxyType
+
+import pandas as pd
+
+from utils.path_defaults import INPUT_CACHE_DIR
+
+
+# copy on write is the default from pandas 3, earlier versions only have it if enabled
+COPY_ON_WRITE = int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+
+
+def read_only(value):
+    """
+    Read only view of a parsed object.
+    DataFrames are shallow copies under copy on write, so changes to them never reach the cached frame,
+    and deep copies without it.
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=not COPY_ON_WRITE)
+    if isinstance(value, dict):
+        return MappingProxyType(value)
+    if isinstance(value, list):
+        return tuple(value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+# parsers
+
+def read_csv_table(path):
+    return pd.read_csv(path)
+
+
+def read_csv_rows(path):
+    """
+    All rows of a csv file, header included, as tuples of strings.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return tuple(tuple(row) for row in csv.reader(f))
+
+
+def read_lines(path):
+    """
+    Stripped, non empty lines of a text file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return tuple(line.strip() for line in f if line.strip())
+
+
+class InputCatalog:
+    """
+    Parsed input files, see module comment.
+    """
+
+    def __init__(self, cache_dir=INPUT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.stats = {"reads": 0, "hits": 0, "parses": 0, "disk_hits": 0}
+        # (path, parser) -> (size, mtime, parsed object)
+        self._entries = {}
+        self._lock = threading.Lock()
+        # one lock per (path, parser), so concurrent first reads parse once
+        self._key_locks = {}
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _key(path, parser):
+        return os.path.abspath(path), f"{parser.__module__}.{parser.__qualname__}"
+
+    def _cache_file(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()[:16] + ".pkl")
+
+    def _load(self, key, stat):
+        cache_file = self._cache_file(key)
+        if not os.path.isfile(cache_file):
+            return None
+        try:
+            with open(cache_file, "rb") as f:
+                cached_key, cached_stat, pandas_version, value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, ImportError, AttributeError):
+            return None
+        return value if (cached_key, cached_stat, pandas_version) == (key, stat, pd.__version__) else None
+
+    def _save(self, key, stat, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_file = self._cache_file(key)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump((key, stat, pd.__version__, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    def read(self, path, parser=read_csv_table, persist=False):
+        """
+        'parser(path)' of the file, parsed once per file version, as read only view.
+        """
+        key = self._key(path, parser)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            self.stats["reads"] += 1
+
+        with key_lock:
+            stat = self._stat(path)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stat:
+                self._count("hits")
+                return read_only(entry[1])
+
+            value = self._load(key, stat) if persist else None
+            if value is not None:
+                self._count("disk_hits")
+            else:
+                value = parser(path)
+                self._count("parses")
+                if persist:
+                    self._save(key, stat, value)
+
+            self._entries[key] = (stat, value)
+            return read_only(value)
+
+    def seed(self, path, parser, value, persist=False):
+        """
+        Sets what 'parser' returns for the current version of the file, i.e. right after writing it.
+        """
+        key = self._key(path, parser)
+        stat = self._stat(path)
+        with self._lock:
+            self._entries[key] = (stat, value)
+        if persist:
+            self._save(key, stat, value)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def format_stats(self):
+        return (f"Input catalog: {self.stats['reads']} reads, {self.stats['parses']} parsed, "
+                f"{self.stats['hits']} cache hits, {self.stats['disk_hits']} loaded from {self.cache_dir}.")
+
+
+# catalog shared by the pipeline
+INPUT_CATALOG = InputCatalog()
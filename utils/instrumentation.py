@@ -0,0 +1,266 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+################################
+#
+# timing and memory instrumentation of pipeline stages
+#
+# every stage (and step within a stage) is run inside 'RunProfiler.stage', which records
+# wall time, cpu time of this process and of finished worker processes (i.e. of 'merge_reps_meta'),
+# and counts (rows, nodes, ...) added by the stage itself.
+# memory is only available as high water marks: the peak rss of the whole process up to the end of the stage,
+# how much the stage raised it and the peak rss of the largest finished worker process.
+# these need the unix only 'resource' module and are None elsewhere. optionally:
+# - tracemalloc peak and top allocating lines of every stage ('trace_memory')
+# - a cProfile dump of every top level stage ('cprofile_dir'), to be viewed with i.e. snakeviz
+#
+# 'report' prints a summary and writes all records as json.
+# stages may run concurrently in several threads, nesting is tracked per thread.
+# time and memory of concurrent stages overlap, as they are measured for the whole process.
+# functions that may be run with or without instrumentation take a profiler
+# argument defaulting to 'NullProfiler', which measures nothing.
+#
+################################
+
+import cProfile
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+# high water mark of the rss of this process, or of the largest finished child process
+# None without the 'resource' module
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+# cpu time of all finished child processes
+def children_cpu_seconds():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _round(value, digits):
+    return None if value is None else round(value, digits)
+
+
+def _format_mb(value):
+    return "    n/a" if value is None else f"{value:>7.0f}"
+
+
+class StageRecord:
+    """
+    Measurements of a single stage, see 'RunProfiler.stage'.
+    Stages add their own counts with 'count', i.e. record.count(rows=len(df)).
+    """
+
+    def __init__(self, name, depth, parent=None):
+        self.name = name
+        self.depth = depth
+        self.parent = parent
+        self.status = "ok"
+        self.counts = {}
+        self.measurements = {}
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def to_json(self):
+        return dict({"name": self.name, "depth": self.depth, "status": self.status},
+                    **self.measurements, counts=self.counts)
+
+
+class RunProfiler:
+
+    def __init__(self, report_file=None, trace_memory=False, cprofile_dir=None, top_allocations=10):
+        self.report_file = report_file
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.top_allocations = top_allocations
+
+        self.records = []
+        # open stages and their tracemalloc peaks of the current thread, outer stages first
+        self._local = threading.local()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._children_start = children_cpu_seconds()
+
+        if cprofile_dir:
+            os.makedirs(cprofile_dir, exist_ok=True)
+
+    @property
+    def _open(self):
+        if not hasattr(self._local, "records"):
+            self._local.records = []
+        return self._local.records
+
+    @property
+    def _peaks(self):
+        if not hasattr(self._local, "peaks"):
+            self._local.peaks = []
+        return self._local.peaks
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the enclosed block as stage 'name', yields its StageRecord.
+        Stages may be nested, nested stages are listed after their enclosing stage in the report.
+        """
+        record = StageRecord(name, len(self._open), self._open[-1] if self._open else None)
+        self.records.append(record)
+        self._open.append(record)
+
+        rss_before = peak_rss_mb()
+        snapshot = None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._peaks:
+                # keep the peak of the enclosing stage before resetting it for this one
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            snapshot = tracemalloc.take_snapshot()
+        self._peaks.append(0)
+
+        # only one profiler can be active, nested stages are part of the dump of their top level stage
+        profiler = cProfile.Profile() if self.cprofile_dir and record.depth == 0 else None
+
+        wall_start, cpu_start, children_start = time.perf_counter(), time.process_time(), children_cpu_seconds()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException:
+            record.status = "failed"
+            raise
+        finally:
+            self._open.pop()
+            if profiler:
+                profiler.disable()
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            rss_after = peak_rss_mb()
+
+            record.measurements = {
+                "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu, 4),
+                "children_cpu_seconds": round(children_cpu_seconds() - children_start, 4),
+                "process_peak_rss_mb": _round(rss_after, 1),
+                "process_peak_growth_mb": None if rss_after is None else round(rss_after - rss_before, 1),
+                "children_peak_rss_mb": _round(peak_rss_mb(children=True), 1),
+            }
+
+            peak = self._peaks.pop()
+            if snapshot is not None:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                record.measurements["tracemalloc_peak_mb"] = round(peak / (1 << 20), 2)
+                record.measurements["top_allocations"] = self._top_allocations(snapshot)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+            if profiler:
+                profile_file = os.path.join(self.cprofile_dir, f"{name}.prof")
+                profiler.dump_stats(profile_file)
+                record.measurements["cprofile"] = profile_file
+
+    def skipped(self, name):
+        record = StageRecord(name, len(self._open), self._open[-1] if self._open else None)
+        record.status = "skipped"
+        self.records.append(record)
+        return record
+
+    # records with nested stages right after their enclosing stage,
+    # stages of concurrent threads may have been recorded interleaved
+    def _ordered_records(self):
+        nested = {}
+        for record in self.records:
+            nested.setdefault(id(record.parent) if record.parent else None, []).append(record)
+
+        ordered = []
+        stack = list(reversed(nested.get(None, [])))
+        while stack:
+            record = stack.pop()
+            ordered.append(record)
+            stack.extend(reversed(nested.get(id(record), [])))
+        return ordered
+
+    # lines that allocated the most memory since 'snapshot' and still hold it
+    def _top_allocations(self, snapshot):
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        return [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "size_kb": round(stat.size_diff / 1024, 1),
+                 "count": stat.count_diff}
+                for stat in stats[:self.top_allocations] if stat.size_diff > 0]
+
+    def report(self):
+        """
+        Prints wall time, cpu time (of this process and its workers) and the process peak rss
+        at the end of all stages and writes the full records to 'report_file'.
+        """
+        total = {
+            "wall_seconds": round(time.perf_counter() - self._start, 4),
+            "cpu_seconds": round(time.process_time() - self._cpu_start, 4),
+            "children_cpu_seconds": round(children_cpu_seconds() - self._children_start, 4),
+            "process_peak_rss_mb": _round(peak_rss_mb(), 1),
+            "children_peak_rss_mb": _round(peak_rss_mb(children=True), 1),
+        }
+
+        records = self._ordered_records()
+        print("\nStage timings:")
+        for record in records:
+            name = "  " * record.depth + record.name
+            if record.status == "skipped":
+                print(f"  {name:<40} skipped")
+                continue
+            m = record.measurements
+            counts = ", ".join(f"{key} {value}" for key, value in record.counts.items())
+            print(f"  {name:<40} {m['wall_seconds']:>8.2f} s wall {m['cpu_seconds']:>8.2f} s cpu "
+                  f"{m['children_cpu_seconds']:>8.2f} s worker cpu "
+                  f"{_format_mb(m['process_peak_rss_mb'])} MB process peak rss" + (f"  ({counts})" if counts else ""))
+        print(f"  {'total':<40} {total['wall_seconds']:>8.2f} s wall {total['cpu_seconds']:>8.2f} s cpu "
+              f"{total['children_cpu_seconds']:>8.2f} s worker cpu "
+              f"{_format_mb(total['process_peak_rss_mb'])} MB process peak rss, "
+              f"largest worker {_format_mb(total['children_peak_rss_mb']).strip()} MB")
+
+        if self.report_file:
+            os.makedirs(os.path.dirname(self.report_file) or ".", exist_ok=True)
+            with open(self.report_file, "w") as f:
+                json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                           "total": total,
+                           "stages": [record.to_json() for record in records]}, f, indent=4)
+
+
+class NullProfiler:
+    """
+    Stand in for RunProfiler that measures nothing.
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield StageRecord(name, 0)
+
+    def skipped(self, name):
+        return StageRecord(name, 0)
+
+    def report(self):
+        pass
@@ -0,0 +1,228 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# inverted index of mutations to the haplogroups carrying them in their full hg signature
+# used by the "has mutation" search mode of the haplogroups page
+#
+# mutations are normalized to (position, insertion index, allele), i.e. '315.1c' -> (315, 1, 'C')
+# (see 'utils/mutations.py'), and sorted by these. every mutation maps to the sorted ids of its haplogroups,
+# so a multi mutation query is an intersection of these posting lists.
+# mutations are also grouped into position range buckets, so a query for a position
+# or a range of positions only looks at the mutations within these buckets.
+#
+#################################
+
+import bisect
+import json
+import re
+
+import numpy as np
+
+from utils.mutations import VOCABULARY, normalize_mutation, mutation_key
+
+
+# width of the position range buckets
+BUCKET_SIZE = 100
+
+# query terms, every part is optional (see 'parse_query_term')
+QUERY_PATTERN = re.compile(r"^(\d+)?(\.(\d+)?)?([-a-zA-Z])?$")
+
+
+def parse_query_term(term):
+    """
+    Parses a search term into a (position, insertion, allele) pattern, None for parts that match anything.
+
+    Supported terms are the ones of the haplogroups page:
+    '16519C' - exact mutation
+    '16519' - any allele at a position
+    '315.1' / '315.1C' - insertion at a position, optionally with allele
+    '.1' / '.' - any insertion with this index / any insertion at all
+    'C' - any mutation to this allele, including insertions
+    """
+    match = QUERY_PATTERN.match(term.strip())
+    if not match or not any(match.groups()):
+        raise ValueError(f"Invalid mutation search term '{term}'.")
+
+    position, dot, insertion, allele = match.groups()
+    position = int(position) if position else None
+    allele = allele.upper() if allele else None
+
+    if not dot and position is None:
+        # allele only, any mutation including insertions
+        insertion = None
+    elif not dot:
+        # no insertion
+        insertion = 0
+    elif insertion:
+        insertion = int(insertion)
+    else:
+        # any insertion index, but not 0
+        insertion = -1
+
+    return position, insertion, allele
+
+
+class MutationIndex:
+    """
+    Inverted index of normalized mutations to sorted haplogroup ids.
+
+    haplogroups - list of haplogroup names, the ids are indices into this list
+    keys        - sorted list of normalized mutations (position, insertion, allele)
+    postings    - sorted numpy array of haplogroup ids for each key
+    """
+
+    def __init__(self, haplogroups, keys, postings, bucket_size=BUCKET_SIZE):
+        self.haplogroups = list(haplogroups)
+        self.keys = list(keys)
+        self.postings = postings
+        self.bucket_size = bucket_size
+
+        self._key_index = {key: i for i, key in enumerate(self.keys)}
+        # keys are sorted by position, so every bucket is a contiguous range of key indices
+        self._positions = [key[0] for key in self.keys]
+
+    # builds the index from a dict of haplogroup to full hg signature (see 'parse_haplo_motifs')
+    # haplogroup ids follow the order of the dict
+    @classmethod
+    def from_hgmotifs(cls, hgmotif_dict, bucket_size=BUCKET_SIZE):
+        haplogroups = list(hgmotif_dict)
+        signatures = []
+        for haplogroup in haplogroups:
+            try:
+                signatures.append(VOCABULARY.encode(hgmotif_dict[haplogroup]))
+            except ValueError as error:
+                raise ValueError(f"{error} Signature of {haplogroup}.") from None
+
+        # (mutation id, haplogroup id) pairs grouped by mutation, haplogroup ids stay sorted within a group
+        mutation_ids = np.concatenate(signatures) if signatures else np.empty(0, dtype=np.int32)
+        hg_ids = np.repeat(np.arange(len(haplogroups), dtype=np.int32), [len(ids) for ids in signatures])
+        order = np.argsort(mutation_ids, kind="stable")
+        unique_ids, starts = np.unique(mutation_ids[order], return_index=True)
+        groups = np.split(hg_ids[order], starts[1:]) if len(unique_ids) else []
+
+        postings = {}
+        for mutation_id, ids in zip(unique_ids.tolist(), groups):
+            mutation = VOCABULARY.mutations[mutation_id]
+            if mutation.back_mutation:
+                raise ValueError(f"Back mutation '{mutation.key}' in a full signature.")
+            postings[(mutation.position, mutation.insertion, mutation.allele)] = ids
+
+        keys = sorted(postings)
+        return cls(haplogroups, keys, [postings[key] for key in keys], bucket_size)
+
+    # key indices of all mutations with a position in [start, end]
+    # looked up through the position buckets
+    def _key_range(self, start, end):
+        bucket_start = (start // self.bucket_size) * self.bucket_size
+        bucket_end = (end // self.bucket_size + 1) * self.bucket_size
+        first = bisect.bisect_left(self._positions, bucket_start)
+        last = bisect.bisect_left(self._positions, bucket_end)
+        return range(first, last)
+
+    def buckets(self):
+        """
+        Returns a dict of bucket start position to [first, last) range of key indices.
+        """
+        buckets = {}
+        for i, position in enumerate(self._positions):
+            bucket = (position // self.bucket_size) * self.bucket_size
+            buckets.setdefault(bucket, [i, i])[1] = i + 1
+        return buckets
+
+    # all keys matching a query term
+    def matching_keys(self, term):
+        position, insertion, allele = parse_query_term(term)
+
+        if position is not None and insertion is not None and insertion >= 0 and allele is not None:
+            key = (position, insertion, allele)
+            return [key] if key in self._key_index else []
+
+        candidates = self._key_range(position, position) if position is not None else range(len(self.keys))
+
+        matches = []
+        for i in candidates:
+            key_position, key_insertion, key_allele = self.keys[i]
+            if position is not None and key_position != position:
+                continue
+            if insertion == -1 and key_insertion == 0:
+                continue
+            if insertion is not None and insertion >= 0 and key_insertion != insertion:
+                continue
+            if allele is not None and key_allele != allele:
+                continue
+            matches.append(self.keys[i])
+        return matches
+
+    def _union(self, keys):
+        if not keys:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.postings[self._key_index[key]] for key in keys]))
+
+    # sorted haplogroup ids matching a single query term
+    def term_ids(self, term):
+        return self._union(self.matching_keys(term))
+
+    # sorted haplogroup ids with any mutation with a position in [start, end]
+    def range_ids(self, start, end):
+        keys = [self.keys[i] for i in self._key_range(start, end) if start <= self.keys[i][0] <= end]
+        return self._union(keys)
+
+    def query_ids(self, terms):
+        """
+        Sorted ids of haplogroups carrying all mutations described by 'terms' (see 'parse_query_term').
+        Posting lists are intersected shortest first.
+        """
+        id_lists = sorted((self.term_ids(term) for term in terms), key=len)
+        if not id_lists:
+            return np.arange(len(self.haplogroups), dtype=np.int32)
+
+        result = id_lists[0]
+        for ids in id_lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, ids, assume_unique=True)
+        return result
+
+    def query(self, terms):
+        """
+        Names of haplogroups carrying all mutations described by 'terms', in haplogroup order.
+        'terms' may be a list or a space/comma separated string, i.e. '16519C 315.1 152'.
+        """
+        if isinstance(terms, str):
+            terms = [term for term in re.split(r"[\s,]+", terms) if term]
+        return [self.haplogroups[i] for i in self.query_ids(terms)]
+
+    def batch_query(self, queries):
+        return [self.query(terms) for terms in queries]
+
+    def to_json(self):
+        """
+        Compact json serializable form of the index.
+        Posting lists are gap encoded (first id, then differences to the previous id).
+        """
+        return {
+            "haplogroups": self.haplogroups,
+            "mutations": [mutation_key(*key) for key in self.keys],
+            "postings": [np.diff(ids, prepend=0).tolist() for ids in self.postings],
+            "bucket_size": self.bucket_size,
+            "buckets": self.buckets(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        keys = [normalize_mutation(mutation) for mutation in data["mutations"]]
+        postings = [np.cumsum(np.array(gaps, dtype=np.int32), dtype=np.int32) for gaps in data["postings"]]
+        return cls(data["haplogroups"], keys, postings, data.get("bucket_size", BUCKET_SIZE))
+
+
+def load_mutation_index(index_file):
+    with open(index_file, "r") as f:
+        return MutationIndex.from_json(json.load(f))
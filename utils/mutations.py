@@ -0,0 +1,177 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# parsed and interned mutations
+#
+# a mutation token is parsed into a 'Mutation' record of position, insertion index (0 without),
+# allele in upper case and a back mutation flag. supported notations (see 'parse_mutation'):
+#   '73G', '315.1c', '309-', '16519Y'   - allele at a position or insertion, deletion, heteroplasmy
+#   '@7972', '7972G!', 'G7972'          - back mutations
+#
+# every distinct mutation is interned once into a vocabulary and gets an integer id.
+# signatures are sorted, duplicate free int32 arrays of these ids, so comparing, intersecting
+# or diffing them are numpy set operations instead of splitting and normalizing strings again.
+# 'VOCABULARY' is shared by the whole pipeline, ids are only meaningful within one process.
+#
+#################################
+
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+
+# optional back mutation prefix ('@' or the reverted base), position, insertion, allele, '!' suffix
+TOKEN_PATTERN = re.compile(r"^(@|[-a-zA-Z](?=\d))?(\d+)(?:\.(\d+))?([-a-zA-Z])?(!*)$")
+
+# IUPAC ambiguity codes, alleles of heteroplasmic positions
+HETEROPLASMY_CODES = frozenset("RYKMSWBDHVN")
+
+
+# canonical string of a normalized mutation, i.e. (315, 1, 'C') -> '315.1C'
+def mutation_key(position, insertion, allele):
+    return f"{position}.{insertion}{allele}" if insertion else f"{position}{allele}"
+
+
+class Mutation(namedtuple("Mutation", ["position", "insertion", "allele", "back_mutation"])):
+    """
+    Parsed mutation. allele is upper case, None for back mutations given without one.
+    """
+    __slots__ = ()
+
+    @property
+    def is_insertion(self):
+        return self.insertion > 0
+
+    @property
+    def is_deletion(self):
+        return self.allele == "-"
+
+    @property
+    def is_heteroplasmy(self):
+        return self.allele in HETEROPLASMY_CODES
+
+    @property
+    def key(self):
+        """
+        Canonical string, i.e. '315.1C', back mutations as '7972G!' or '@7972'.
+        """
+        if self.allele is None:
+            return "@" + mutation_key(self.position, self.insertion, "")
+        return mutation_key(self.position, self.insertion, self.allele) + ("!" if self.back_mutation else "")
+
+    def sort_key(self):
+        return self.position, self.insertion, self.allele or "", self.back_mutation
+
+
+def parse_mutation(token):
+    """
+    Parses a mutation token into a Mutation.
+    Raises a ValueError for tokens not in any of the supported notations.
+    """
+    match = TOKEN_PATTERN.match(token.strip())
+    if not match:
+        raise ValueError(f"Can not parse mutation '{token}'.")
+
+    prefix, position, insertion, allele, exclamation = match.groups()
+    back_mutation = bool(prefix or exclamation)
+    if allele is None and not back_mutation:
+        raise ValueError(f"Mutation '{token}' has no allele.")
+
+    return Mutation(int(position), int(insertion or 0), allele.upper() if allele else None, back_mutation)
+
+
+# splits a mutation like '315.1c' into (315, 1, 'C')
+# mutations without insertion have insertion index 0
+# returns None for back mutations and if the mutation can not be parsed
+def normalize_mutation(mutation):
+    try:
+        parsed = parse_mutation(mutation)
+    except ValueError:
+        return None
+    if parsed.back_mutation:
+        return None
+    return parsed.position, parsed.insertion, parsed.allele
+
+
+class MutationVocabulary:
+    """
+    Interned mutations, see module comment. 'mutations[i]' is the Mutation with id i.
+    Thread safe, concurrent pipeline stages share one vocabulary.
+    """
+
+    def __init__(self):
+        self.mutations = []
+        self._ids = {}
+        # raw token -> id, so every spelling of a mutation is only parsed once
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mutations)
+
+    def intern(self, token):
+        """
+        Id of a mutation token, added to the vocabulary if new.
+        """
+        mutation_id = self._tokens.get(token)
+        if mutation_id is not None:
+            return mutation_id
+
+        mutation = parse_mutation(token)
+        with self._lock:
+            mutation_id = self._ids.get(mutation)
+            if mutation_id is None:
+                mutation_id = len(self.mutations)
+                self.mutations.append(mutation)
+                self._ids[mutation] = mutation_id
+            self._tokens[token] = mutation_id
+        return mutation_id
+
+    def encode(self, signature):
+        """
+        Sorted int32 array of the ids of a space separated signature string.
+        """
+        tokens = self._tokens
+        ids = {tokens[token] if token in tokens else self.intern(token) for token in signature.split()}
+        # signatures are short, sorting in python is faster than np.unique
+        return np.array(sorted(ids), dtype=np.int32)
+
+    def encode_all(self, hgmotif_dict):
+        """
+        Encoded signatures of a dict of haplogroup to signature string (see 'parse_haplo_motifs').
+        """
+        return {haplogroup: self.encode(signature) for haplogroup, signature in hgmotif_dict.items()}
+
+    def keys(self, ids):
+        """
+        Canonical strings of mutation ids, sorted by position, insertion and allele.
+        """
+        return [mutation.key for mutation in sorted((self.mutations[i] for i in ids), key=Mutation.sort_key)]
+
+    def decode(self, ids):
+        """
+        Canonical signature string of mutation ids.
+        """
+        return " ".join(self.keys(ids))
+
+
+# vocabulary shared by the pipeline
+VOCABULARY = MutationVocabulary()
+
+
+def encode_signature(signature):
+    return VOCABULARY.encode(signature)
+
+
+def decode_signature(ids):
+    return VOCABULARY.decode(ids)
@@ -0,0 +1,143 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# per haplogroup data shards used by the node info page
+#
+# instead of the full tree.json, hgmotifs.json and profiles.csv the page loads
+# a small manifest and the single shard of the requested haplogroup.
+# each shard holds everything shown on the page:
+# the node itself, its full signature, ancestor chain, direct children,
+# number of descendants and the metadata rows of its profiles.
+#
+#################################
+
+import hashlib
+import os
+
+from utils.output_writer import OutputWriter, clear_json_files
+from utils.tree_emitters import TreeEmitter
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+# file name of the shard of a haplogroup, as haplogroup names are not safe file names
+# derived from the name only, so a shard keeps its file across tree versions (see 'tree_diff.py')
+def shard_file(name):
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+# collects the tree structure part of every shard in a single walk
+# results in a list of shard dicts in preorder
+# color_dict - dictionary of motif to color, inherited by descendants like in the json tree
+class NodeShardEmitter(TreeEmitter):
+
+    def __init__(self, color_dict=None):
+        self.color_dict = color_dict
+        self.shards = []
+        # shards of the nodes on the current path
+        self._stack = []
+
+    def enter(self, tree, node):
+        node_id = tree.get_id(node)
+        parent = self._stack[-1] if self._stack else None
+        inherited_color = parent["colorcode"] if parent else None
+
+        shard = {
+            "name": node_id,
+            "HG": tree.get_hg(node),
+            "colorcode": self.color_dict.get(node_id, inherited_color) if self.color_dict else inherited_color,
+            # root first, without the node itself
+            "ancestors": [{"name": s["name"], "colorcode": s["colorcode"]} for s in self._stack],
+            "children": [],
+            "descendant_count": 0,
+        }
+
+        if parent:
+            parent["children"].append({"name": node_id, "HG": shard["HG"]})
+
+        self.shards.append(shard)
+        self._stack.append(shard)
+
+    def exit(self, tree, node):
+        shard = self._stack.pop()
+        if self._stack:
+            self._stack[-1]["descendant_count"] += shard["descendant_count"] + 1
+
+    def result(self):
+        return self.shards
+
+
+# groups metadata rows by accession, keeping their order
+# metadata - list of row dicts, as read from 'profiles.csv'
+def rows_by_accession(metadata):
+    rows = {}
+    for index, row in enumerate(metadata):
+        rows.setdefault(row["accession"], []).append(index)
+    return rows
+
+
+# metadata rows of the given profiles in metadata order
+# profiles may carry a trailing '+' which is not part of the accession in the metadata,
+# the returned rows keep the accession as listed in the profiles
+def profile_rows(profiles, metadata, accession_rows):
+    matched = []
+    for profile in profiles:
+        for index in accession_rows.get(profile.rstrip("+"), []):
+            matched.append((index, profile))
+
+    rows = []
+    for index, profile in sorted(matched):
+        # empty fields are dropped, the page shows 'N/A' for missing values
+        row = {key: value for key, value in metadata[index].items() if value}
+        row["accession"] = profile
+        rows.append(row)
+    return rows
+
+
+# writes one json shard per haplogroup and a manifest mapping haplogroup names to shard files
+# shards - output of NodeShardEmitter
+# hgmotif_dict - haplogroup to full hg signature, see 'parse_haplo_motifs'
+# profiles - dictionary of motif to list of accession numbers
+# metadata - list of row dicts of the profile metadata
+# writer - OutputWriter used for all files, defaults to readable json
+# returns path of the manifest
+def write_node_shards(shards, dest_dir, hgmotif_dict, profiles, metadata, writer=None):
+    if writer is None:
+        writer = OutputWriter()
+
+    os.makedirs(dest_dir, exist_ok=True)
+    # drop shards of a previous build, haplogroups may have been removed or reordered
+    clear_json_files(dest_dir)
+
+    accession_rows = rows_by_accession(metadata)
+    manifest = {}
+    # shard file -> haplogroup
+    used = {}
+
+    for shard in shards:
+        name = shard["name"]
+        file_name = shard_file(name)
+        if file_name in used:
+            raise ValueError(f"Shard file {file_name} of {name} is already used by {used[file_name]}.")
+        used[file_name] = name
+
+        shard = dict(shard,
+                     signature=hgmotif_dict.get(name, ""),
+                     profiles=profile_rows(profiles.get(name, []), metadata, accession_rows))
+
+        writer.write_json(shard, os.path.join(dest_dir, file_name), group="nodes/*.json")
+        manifest[name] = file_name
+
+    manifest_file = os.path.join(dest_dir, MANIFEST_NAME)
+    writer.write_json(manifest, manifest_file, group=f"nodes/{MANIFEST_NAME}")
+
+    return manifest_file
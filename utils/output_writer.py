@@ -0,0 +1,183 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+################################
+#
+# writer for all data files of the webapp
+#
+# two output profiles are supported:
+# 'dev'     - readable json (indented), no compressed files
+# 'publish' - minified json and '.gz' and '.br' siblings of every file at max compression,
+#             to be served directly by the static host
+#
+# every written file is measured and a size report is printed at the end of a run,
+# including the change since the last build.
+#
+################################
+
+import gzip
+import json
+import os
+import threading
+import warnings
+from contextlib import contextmanager
+
+# brotli is optional, without it only '.gz' files are written
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+PROFILES = ("dev", "publish")
+
+
+def _human_size(num_bytes):
+    for unit in ("B", "kB", "MB"):
+        if abs(num_bytes) < 1000:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1000
+    return f"{num_bytes:.1f} GB"
+
+
+class OutputWriter:
+
+    def __init__(self, profile="dev", report_file=None):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown output profile '{profile}'. Expected one of {PROFILES}.")
+        self.profile = profile
+        self.report_file = report_file
+
+        if profile == "publish" and brotli is None:
+            warnings.warn("brotli is not installed, no '.br' files will be written.", stacklevel=2)
+
+        # artifact name -> dict of measured sizes of this run
+        self.sizes = {}
+        # stages may write concurrently
+        self._lock = threading.Lock()
+        # files written by the stage of the current thread, see 'track'
+        self._local = threading.local()
+
+    @property
+    def compress(self):
+        return self.profile == "publish"
+
+    # suffixes of the compressed siblings written next to every file
+    def compressed_suffixes(self):
+        if not self.compress:
+            return []
+        return [".gz", ".br"] if brotli is not None else [".gz"]
+
+    # all files written for 'path', used as outputs of build stages
+    def output_files(self, path):
+        return [path] + [path + suffix for suffix in self.compressed_suffixes()]
+
+    @contextmanager
+    def track(self):
+        """
+        Collects the paths of all files (including compressed siblings) written in the enclosed block
+        by the current thread, i.e. all files of a stage for the build cache.
+        """
+        self._local.files = files = []
+        try:
+            yield files
+        finally:
+            del self._local.files
+
+    def write_json(self, obj, path, group=None):
+        """
+        Writes 'obj' as json to 'path', indented for 'dev' and minified for 'publish'.
+        Files sharing a 'group' (i.e. node shards) are summed up as one entry in the size report.
+        """
+        raw = json.dumps(obj, indent=4).encode()
+        if self.compress:
+            data = json.dumps(obj, separators=(",", ":")).encode()
+            self._write(data, path, group, raw=len(raw), minified=len(data))
+        else:
+            self._write(raw, path, group, raw=len(raw))
+
+    def write_text(self, text, path, group=None):
+        data = text.encode()
+        self._write(data, path, group, raw=len(data))
+
+    def copy_file(self, src, dst, group=None):
+        with open(src, "rb") as f:
+            data = f.read()
+        self._write(data, dst, group, raw=len(data))
+
+    def _write(self, data, path, group, **sizes):
+        with open(path, "wb") as f:
+            f.write(data)
+
+        if self.compress:
+            # mtime=0 so unchanged content gives identical files
+            gz_data = gzip.compress(data, compresslevel=9, mtime=0)
+            with open(path + ".gz", "wb") as f:
+                f.write(gz_data)
+            sizes["gz"] = len(gz_data)
+
+            if brotli is not None:
+                br_data = brotli.compress(data, quality=11)
+                with open(path + ".br", "wb") as f:
+                    f.write(br_data)
+                sizes["br"] = len(br_data)
+        else:
+            # stale compressed files of an earlier publish build would no longer match
+            for suffix in (".gz", ".br"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        files = getattr(self._local, "files", None)
+        if files is not None:
+            files.extend(self.output_files(path))
+
+        name = group or os.path.basename(path)
+        with self._lock:
+            entry = self.sizes.setdefault(name, {})
+            for key, value in sizes.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def report(self):
+        """
+        Prints the sizes of all files written in this run and their change since the last build,
+        then stores them in 'report_file'. Entries of files not written in this run are kept.
+        """
+        previous = {}
+        if self.report_file and os.path.isfile(self.report_file):
+            with open(self.report_file, "r") as f:
+                previous = json.load(f)
+
+        if self.sizes:
+            print("\nOutput sizes:")
+        for name, sizes in sorted(self.sizes.items()):
+            columns = []
+            for key in ("raw", "minified", "gz", "br"):
+                if key not in sizes:
+                    continue
+                column = f"{key} {_human_size(sizes[key])}"
+                last = previous.get(name, {}).get(key)
+                if last is not None and last != sizes[key]:
+                    column += f" ({'+' if sizes[key] > last else '-'}{_human_size(abs(sizes[key] - last))})"
+                columns.append(column)
+            print(f"  {name}: {', '.join(columns)}")
+
+        if self.report_file:
+            previous.update(self.sizes)
+            os.makedirs(os.path.dirname(self.report_file) or ".", exist_ok=True)
+            with open(self.report_file, "w") as f:
+                json.dump(previous, f, indent=4, sort_keys=True)
+
+
+# removes generated json files of a directory, including their compressed siblings
+def clear_json_files(path):
+    if not os.path.isdir(path):
+        return
+    for filename in os.listdir(path):
+        if filename.endswith((".json", ".json.gz", ".json.br")):
+            os.remove(os.path.join(path, filename))
@@ -9,6 +9,8 @@
 
 import os
 
+from utils.table_store import table_file
+
 # default file paths used during the 'tree_dat_process' script.
 # paths denoted are relative to root.
 
@@ -19,6 +21,8 @@ INPUT_DIR = "inputfiles"
 ##### INPUTS ####
 XML_FILE = os.path.join(INPUT_DIR, "mitoLEAF_phm.xml")
 MOTIF_SIGNATURES = os.path.join(INPUT_DIR, "mitoLEAF_phm.emp")
+# optional rCRS (NC_012920.1) fasta file, needed to derive full hg signatures and check the .emp file
+REFERENCE_FILE = os.path.join(INPUT_DIR, "rCRS.fasta")
 
 COLORCODE_FILE = os.path.join(INPUT_DIR, "superhaplo_colorcodes.csv")
 SUPERHAPLO_FILE = os.path.join(INPUT_DIR, "superhaplogroups.txt")
@@ -43,13 +47,64 @@ NCBI_META = os.path.join(INPUT_DIR, "ncbi_metadata.csv")
 OUTPUT_DIR = os.path.join(INPUT_DIR, "formatted_files")
 
 # outputs
-FORMATTED_EMPOP = os.path.join(OUTPUT_DIR, "empop_representatives_formated.csv")
-FORMATTED_1K = os.path.join(OUTPUT_DIR, "k_genomes_representatives_formated.csv")
-FORMATTED_NCBI = os.path.join(OUTPUT_DIR, "ncbi_genomes_representatives_formated.csv")
+# intermediate tables are stored typed (see 'utils/table_store.py'), not as csv
+FORMATTED_EMPOP = table_file(os.path.join(OUTPUT_DIR, "empop_representatives_formated"))
+FORMATTED_1K = table_file(os.path.join(OUTPUT_DIR, "k_genomes_representatives_formated"))
+FORMATTED_NCBI = table_file(os.path.join(OUTPUT_DIR, "ncbi_genomes_representatives_formated"))
+
 
-MOTIF_REPRESENTATIVES = os.path.join(OUTPUT_DIR, "representatives_combined.csv")
-METADATA_REPRESENTATIVES = os.path.join(OUTPUT_DIR, "metadata_combined.csv")
+#### SOURCES ####
+
+# registry of all sources of representatives merged by 'merge_reps_meta'
+# to add a source, add its files above and an entry here
+#
+# label      - written to the 'source' column of the combined metadata
+# meta       - metadata csv file of the source, must contain an 'accession' column
+# id_col     - column in 'meta' with the ids used in the representatives, mapped to 'accession'
+# reps       - representatives file of the source, only used to check it matches 'meta'.
+#              None if no such file is available
+# clean_reps - reps file has the profiles split over several columns and is fixed in place first
+# formatted  - output path of the filtered representatives of the source
+#
+# order of this list is the row order of the combined metadata
+SOURCES = [
+    {"label": "NCBI", "meta": NCBI_META, "id_col": "accession",
+     "reps": NCBI_REPS, "clean_reps": False, "formatted": FORMATTED_NCBI},
+    # TODO set 'clean_reps' to False, when empops reps no longer has commas in the last col
+    {"label": "EMPOP", "meta": EMPOP_META, "id_col": "sample_id",
+     "reps": EMPOP_REPS, "clean_reps": True, "formatted": FORMATTED_EMPOP},
+    # NOTE: No reps file available for 1k genomes, so no need to check
+    {"label": "1K_GENOMES", "meta": K_META, "id_col": "accession",
+     "reps": None, "clean_reps": False, "formatted": FORMATTED_1K},
+]
+
+
+#### COMBINED ####
+
+MOTIF_REPRESENTATIVES = table_file(os.path.join(OUTPUT_DIR, "representatives_combined"))
+METADATA_REPRESENTATIVES = table_file(os.path.join(OUTPUT_DIR, "metadata_combined"))
+
+# full hg signatures derived from the xml tree and their diff against the .emp file
+DERIVED_SIGNATURES = os.path.join(OUTPUT_DIR, "derived_signatures.json")
+
+# content hashes of the last build, used to skip unchanged stages
+BUILD_CACHE = os.path.join(OUTPUT_DIR, "build_cache.json")
+# sizes of the written data files of the last build
+SIZE_REPORT = os.path.join(OUTPUT_DIR, "size_report.json")
+# timings and memory use of the stages of the last build
+RUN_REPORT = os.path.join(OUTPUT_DIR, "run_report.json")
+# parsed input files, reused by later runs while the files are unchanged (see 'utils/input_catalog.py')
+INPUT_CACHE_DIR = os.path.join(OUTPUT_DIR, "input_cache")
 
 # destination where to write files
 # this should be the data dir within the dir used to build the webpage
 DATA_DEST = "docs/data"
+
+# per haplogroup data used by the node info page
+NODE_SHARD_DIR = os.path.join(DATA_DEST, "nodes")
+
+# pruned views of the tree at several resolutions
+TREE_VIEW_DIR = os.path.join(DATA_DEST, "views")
+
+# chunks of the tree loaded on demand by the collapsible tree
+TREE_CHUNK_DIR = os.path.join(DATA_DEST, "tree_chunks")
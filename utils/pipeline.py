@@ -0,0 +1,151 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+################################
+#
+# dependency graph runner of the 'tree_dat_process' stages
+#
+# stages are (name, build function, input files, output files), see 'STAGES' in 'tree_dat_process'.
+# a stage depends on every stage writing one of its input files, so the graph follows from the files.
+# stages are started as soon as all stages they depend on finished, with more than one worker independent
+# stages run concurrently in a thread pool. the stages are cpu bound python and hold the GIL, so this only
+# overlaps their file i/o and is no speedup. all threads share the objects read or created by earlier stages
+# (parsed tree, tables, ...) through loaders decorated with 'shared', which compute them only once.
+#
+################################
+
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def shared(function):
+    """
+    Decorator for loaders without arguments: the result is computed on the first call only,
+    and shared by all later calls of any thread. Concurrent first calls wait for the same result.
+    'seed' sets the result from outside, i.e. to hand over a table a stage just wrote.
+    """
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(function)
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(function())
+            return result[0]
+
+    def seed(value):
+        with lock:
+            result[:] = [value]
+
+    wrapper.seed = seed
+    wrapper.cache_clear = result.clear
+    return wrapper
+
+
+def stage_dependencies(stages):
+    """
+    Dict of stage name to the names of the stages writing any of its inputs, in stage order.
+    """
+    producers = {}
+    for name, _, _, outputs in stages:
+        for output in outputs:
+            producers[output] = name
+
+    order = {name: index for index, (name, _, _, _) in enumerate(stages)}
+    return {name: sorted({producers[path] for path in inputs if producers.get(path, name) != name}, key=order.get)
+            for name, _, inputs, _ in stages}
+
+
+def resolve_target(stages, target):
+    """
+    Name of the stage for 'target', which is either a stage name or one of its output files,
+    given as path or file name (i.e. 'radialTree.json').
+    """
+    for name, _, _, outputs in stages:
+        if target == name or any(target in (output, os.path.basename(output)) for output in outputs):
+            return name
+    raise ValueError(f"Unknown target '{target}'. Expected an output file or one of the stages "
+                     f"{', '.join(name for name, _, _, _ in stages)}.")
+
+
+def select_stages(stages, targets=None):
+    """
+    Names of the stages needed for 'targets' (the targets and everything they depend on) in stage order.
+    All stages without targets.
+    """
+    if not targets:
+        return [name for name, _, _, _ in stages]
+
+    dependencies = stage_dependencies(stages)
+    selected = set()
+    todo = [resolve_target(stages, target) for target in targets]
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(dependencies[name])
+    return [name for name, _, _, _ in stages if name in selected]
+
+
+def stage_levels(names, dependencies):
+    """
+    Level of every stage in 'names': 0 without dependencies, otherwise one more than its deepest dependency.
+    Stages of the same level never depend on each other and may run at the same time.
+    """
+    levels = {}
+    for name in names:
+        levels[name] = 1 + max((levels[dependency] for dependency in dependencies[name] if dependency in levels),
+                               default=-1)
+    return levels
+
+
+def run_stages(names, dependencies, run, finished=None, workers=1):
+    """
+    Calls 'run(name)' for all stages in 'names' (in stage order), each once all of its dependencies
+    within 'names' finished. Up to 'workers' stages run at the same time, in worker threads.
+    'finished(name, result)' is called in the calling thread with the return value of every run.
+
+    The first exception of a stage is raised once all running stages finished, no further stages are started.
+    """
+    finished = finished or (lambda name, result: None)
+
+    if workers <= 1:
+        # in order, in this thread
+        for name in names:
+            finished(name, run(name))
+        return
+
+    selected = set(names)
+    pending = list(names)
+    done = set()
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name in [name for name in pending
+                         if all(dependency in done for dependency in dependencies[name] if dependency in selected)]:
+                pending.remove(name)
+                running[executor.submit(run, name)] = name
+
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    pending.clear()
+                    continue
+                finished(name, future.result())
+                done.add(name)
+
+    if error is not None:
+        raise error
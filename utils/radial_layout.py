@@ -0,0 +1,263 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# precomputed radial layout of the (bare) radial tree
+#
+# same layout as the d3.tree() call in 'docs/js/trees/radialTree.js', so the page only draws:
+# - tidy tree layout of Buchheim et al. (as implemented by d3-hierarchy) with the separation
+#   of the webapp, (1 for siblings, 2 for cousins) / (depth + 1)
+# - angles scaled to [0, ANGLE], radii to depth / max depth * RADIUS
+# - link paths from parent to child: radial line out of the parent, arc at LINK_OFFSET
+#   of the way to the child, radial line into the child (see 'rightAnglePath' in the js)
+#
+# the node positions ('x' angle, 'y' radius) and the link path into every node ('link')
+# are added to the nodes of the radial json, the parameters used to the root ('layout').
+# the layout only depends on the tree and the parameters.
+#
+#################################
+
+import math
+
+import numpy as np
+
+from utils.tree_emitters import TreeEmitter
+
+
+# defaults of the webapp, a 1000 x 1000 svg
+ANGLE = 2 * math.pi
+RADIUS = 480
+LINK_OFFSET = 2 / 2.75
+# decimals written to the json
+PRECISION = 3
+
+
+def _separation(parent, depth, a, b):
+    return (1 if parent[a] == parent[b] else 2) / (depth[a] + 1)
+
+
+def tidy_tree_layout(parent, children, depth, separation=_separation):
+    """
+    Unscaled horizontal positions of a tidy tree layout (Buchheim et al., linear time).
+    Ported from d3-hierarchy's 'tree' to produce the same positions.
+
+    Nodes are numbered in preorder, root 0, 'children' are lists of node numbers in order.
+    'separation(parent, depth, a, b)' is the minimum distance of neighbouring nodes a and b.
+    Returns a list of positions, the root at 0.
+    """
+    n = len(parent)
+    # index n is a virtual parent of the root
+    children = list(children) + [[0]]
+    parent = [n] + list(parent[1:])
+    index = [0] * (n + 1)
+    for node_children in children:
+        for i, child in enumerate(node_children):
+            index[child] = i
+
+    prelim, mod, change, shift = [0.0] * (n + 1), [0.0] * (n + 1), [0.0] * (n + 1), [0.0] * (n + 1)
+    thread = [None] * (n + 1)
+    ancestor = list(range(n + 1))
+    default_ancestor = [None] * (n + 1)
+
+    def next_left(v):
+        return children[v][0] if children[v] else thread[v]
+
+    def next_right(v):
+        return children[v][-1] if children[v] else thread[v]
+
+    def move_subtree(wm, wp, amount):
+        step = amount / (index[wp] - index[wm])
+        change[wp] -= step
+        shift[wp] += amount
+        change[wm] += step
+        prelim[wp] += amount
+        mod[wp] += amount
+
+    def execute_shifts(v):
+        amount = step = 0.0
+        for w in reversed(children[v]):
+            prelim[w] += amount
+            mod[w] += amount
+            step += change[w]
+            amount += shift[w] + step
+
+    def apportion(v, w, default):
+        if w is None:
+            return default
+        vip = vop = v
+        vim = w
+        vom = children[parent[vip]][0]
+        sip, sop, sim, som = mod[vip], mod[vop], mod[vim], mod[vom]
+        while True:
+            vim, vip = next_right(vim), next_left(vip)
+            if vim is None or vip is None:
+                break
+            vom, vop = next_left(vom), next_right(vop)
+            ancestor[vop] = v
+            amount = prelim[vim] + sim - prelim[vip] - sip + separation(parent, depth, vim, vip)
+            if amount > 0:
+                move_subtree(ancestor[vim] if parent[ancestor[vim]] == parent[v] else default, v, amount)
+                sip += amount
+                sop += amount
+            sim += mod[vim]
+            sip += mod[vip]
+            som += mod[vom]
+            sop += mod[vop]
+        if vim is not None and next_right(vop) is None:
+            thread[vop] = vim
+            mod[vop] += sim - sop
+        if vip is not None and next_left(vom) is None:
+            thread[vom] = vip
+            mod[vom] += sip - som
+            default = v
+        return default
+
+    # first walk in postorder, siblings left to right
+    postorder = []
+    stack = [(0, False)]
+    while stack:
+        v, visited = stack.pop()
+        if visited:
+            postorder.append(v)
+        else:
+            stack.append((v, True))
+            stack.extend((child, False) for child in reversed(children[v]))
+
+    for v in postorder:
+        siblings = children[parent[v]]
+        w = siblings[index[v] - 1] if index[v] else None
+        if children[v]:
+            execute_shifts(v)
+            midpoint = (prelim[children[v][0]] + prelim[children[v][-1]]) / 2
+            if w is not None:
+                prelim[v] = prelim[w] + separation(parent, depth, v, w)
+                mod[v] = prelim[v] - midpoint
+            else:
+                prelim[v] = midpoint
+        elif w is not None:
+            prelim[v] = prelim[w] + separation(parent, depth, v, w)
+        p = parent[v]
+        default_ancestor[p] = apportion(v, w, default_ancestor[p] if default_ancestor[p] is not None else siblings[0])
+
+    # second walk in preorder, parents are numbered before their children
+    mod[n] = -prelim[0]
+    x = [0.0] * n
+    for v in range(n):
+        x[v] = prelim[v] + mod[parent[v]]
+        mod[v] += mod[parent[v]]
+    return x
+
+
+class RadialLayoutEmitter(TreeEmitter):
+    """
+    Collects the shape of the tree during the walk, 'result' returns the RadialLayout of it.
+    """
+
+    def __init__(self, angle=ANGLE, radius=RADIUS, link_offset=LINK_OFFSET):
+        self.angle = angle
+        self.radius = radius
+        self.link_offset = link_offset
+
+        self._parent, self._depth, self._children = [], [], []
+        self._path = []
+
+    def enter(self, tree, node):
+        number = len(self._parent)
+        self._parent.append(self._path[-1] if self._path else -1)
+        self._depth.append(len(self._path))
+        self._children.append([])
+        if self._path:
+            self._children[self._path[-1]].append(number)
+        self._path.append(number)
+
+    def exit(self, tree, node):
+        self._path.pop()
+
+    def result(self):
+        return RadialLayout(self._parent, self._children, self._depth,
+                            self.angle, self.radius, self.link_offset)
+
+
+class RadialLayout:
+    """
+    Radial positions of the nodes of a tree in preorder:
+    'x' angles in [0, angle], 'y' radii in [0, radius], and the link paths into every node.
+    """
+
+    def __init__(self, parent, children, depth, angle=ANGLE, radius=RADIUS, link_offset=LINK_OFFSET):
+        self.angle = angle
+        self.radius = radius
+        self.link_offset = link_offset
+
+        self.parent = np.asarray(parent, dtype=np.int64)
+        self.depth = np.asarray(depth, dtype=np.int64)
+        x = np.asarray(tidy_tree_layout(parent, children, depth), dtype=np.float64)
+
+        # scale to the angle range, outermost nodes half a separation away from the ends (as d3)
+        left, right = int(np.argmin(x)), int(np.argmax(x))
+        pad = 1 if left == right else _separation(parent, depth, left, right) / 2
+        offset = pad - x[left]
+        self.x = (x + offset) * (angle / (x[right] + pad + offset))
+        self.y = self.depth * (radius / (int(self.depth.max()) or 1))
+
+    def __len__(self):
+        return len(self.x)
+
+    def link_paths(self, precision=PRECISION):
+        """
+        Svg paths from every node's parent to the node, None for the root.
+        """
+        child = np.flatnonzero(self.parent >= 0)
+        source = self.parent[child]
+        sx, sy = self.x[source], self.y[source]
+        dx, dy = self.x[child], self.y[child]
+
+        arc_radius = sy + self.link_offset * (dy - sy)
+        start = self._polar(sx, sy)
+        mid = self._polar(sx, arc_radius)
+        arc_end = self._polar(dx, arc_radius)
+        end = self._polar(dx, dy)
+        sweep = np.where(sx > dx, 0, 1)
+
+        # + 0.0 turns -0.0 into 0.0
+        values = np.round(np.column_stack(start + mid + (arc_radius,) + arc_end + end), precision) + 0.0
+        paths = [None] * len(self)
+        for node, (x0, y0, x1, y1, r, x2, y2, x3, y3), flag in zip(child.tolist(), values.tolist(), sweep.tolist()):
+            paths[node] = f"M{x0:g},{y0:g}L{x1:g},{y1:g}A{r:g},{r:g} 0 0,{flag} {x2:g},{y2:g}L{x3:g},{y3:g}"
+        return paths
+
+    # angle 0 points up, as the rotation in the webapp
+    @staticmethod
+    def _polar(angle, radius):
+        return radius * np.cos(angle - math.pi / 2), radius * np.sin(angle - math.pi / 2)
+
+    def annotate(self, json_tree, precision=PRECISION):
+        """
+        Adds 'x', 'y' and 'link' to the nodes of the nested json dict of the same tree (see 'JsonEmitter'),
+        and the layout parameters to its root.
+        """
+        xs = np.round(self.x, precision + 3).tolist()
+        ys = np.round(self.y, precision).tolist()
+        links = self.link_paths(precision)
+
+        json_tree["layout"] = {"angle": self.angle, "radius": self.radius, "link_offset": self.link_offset,
+                               "max_depth": int(self.depth.max())}
+        stack = [json_tree]
+        node = 0
+        while stack:
+            node_dict = stack.pop()
+            node_dict["x"], node_dict["y"] = xs[node], ys[node]
+            if links[node] is not None:
+                node_dict["link"] = links[node]
+            node += 1
+            stack.extend(reversed(node_dict.get("children", [])))
+        if node != len(self):
+            raise ValueError(f"Json tree has {node} nodes, the layout {len(self)}.")
+        return json_tree
@@ -0,0 +1,438 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# compact store of full mitogenomes as differences to a reference (the rCRS)
+#
+# every sequence is stored as a list of edits of the reference in reference coordinates:
+#   SUBSTITUTION - 'length' reference bases replaced by as many bases
+#   INSERTION    - bases inserted before the reference position
+#   DELETION     - 'length' reference bases removed
+#   N_RUN        - 'length' reference bases replaced by 'N' (missing data), no bases stored
+# edits are found by walking reference and sequence in parallel and resynchronizing
+# on a mismatch with the smallest indel after which both agree again. longer indels and rearrangements
+# are bridged to the next stretch of the sequence found in the reference (k-mer anchor), the same
+# way the end of an N run is placed, so its length does not have to match the reference.
+#
+# file layout:
+#   MAGIC
+#   reference record: uint32 length, name and sequence (utf-8)
+#   sequence records: uint32 number of edits, number of bases, sequence length,
+#                     then packed arrays of positions (uint32), lengths (uint32), kinds (uint8)
+#                     and the inserted / substituted bases
+#   index: json of the offset and size of every record, by accession
+#   uint64 offset of the index
+#
+# all integers are little endian. the index allows random access to single accessions
+# and the whole store can be exported back to the '#! ALL' .fst format.
+#
+#################################
+
+import argparse
+import functools
+import json
+import struct
+import sys
+from array import array
+from itertools import groupby
+
+from utils.create_comb_fst_file import FST_HEADER
+from utils.path_defaults import REFERENCE_FILE
+from utils.signature_engine import read_reference_fasta
+
+
+MAGIC = b"MTSTORE1"
+
+SUBSTITUTION, INSERTION, DELETION, N_RUN = range(4)
+EDIT_NAMES = {SUBSTITUTION: "SUB", INSERTION: "INS", DELETION: "DEL", N_RUN: "N"}
+
+# bases that have to agree after an edit to accept it
+RESYNC_LENGTH = 12
+# longest indel tried when resynchronizing, longer ones are found by k-mer anchors
+MAX_INDEL = 64
+# length of the reference k-mers used as anchors
+ANCHOR_LENGTH = 16
+# bases that have to agree from an anchor on to accept it
+ANCHOR_CHECK = 32
+# farthest distance in sequence and reference an anchor is searched at
+ANCHOR_WINDOW = 2048
+# bases compared at once while skipping identical stretches
+SKIP_CHUNK = 64
+
+_RECORD_HEADER = struct.Struct("<III")
+_INDEX_FOOTER = struct.Struct("<Q")
+
+
+def diff_sequence(reference, sequence):
+    """
+    Edits turning 'reference' into 'sequence'.
+
+    Returns a list of (kind, position, length, bases) in reference order,
+    positions are 0-based reference indices.
+    """
+    ref_len, seq_len = len(reference), len(sequence)
+    edits = []
+    i = j = 0
+
+    def add(kind, position, length, bases=""):
+        # merge adjacent substitutions and n runs
+        if edits and kind in (SUBSTITUTION, N_RUN):
+            last_kind, last_position, last_length, last_bases = edits[-1]
+            if last_kind == kind and last_position + last_length == position:
+                edits[-1] = (kind, last_position, last_length + length, last_bases + bases)
+                return
+        edits.append((kind, position, length, bases))
+
+    while i < ref_len and j < seq_len:
+        # skip identical stretches
+        while reference[i:i + SKIP_CHUNK] == sequence[j:j + SKIP_CHUNK] and i + SKIP_CHUNK <= ref_len:
+            i += SKIP_CHUNK
+            j += SKIP_CHUNK
+        if i >= ref_len or j >= seq_len:
+            break
+        if reference[i] == sequence[j]:
+            i += 1
+            j += 1
+            continue
+
+        if sequence[j] == "N":
+            run = j
+            while run < seq_len and sequence[run] == "N":
+                run += 1
+            # the run usually stands for as many reference bases, but it may be shorter or longer
+            expected = min(i + run - j, ref_len)
+            resume = expected if run == seq_len else _find_in_reference(reference, sequence, run, expected, i)
+            if resume is None:
+                resume = expected
+            _replace(add, i, resume - i, sequence[j:run])
+            i, j = resume, run
+            continue
+
+        kind, length = _resync(reference, sequence, i, j)
+        if kind == DELETION:
+            add(DELETION, i, length)
+            i += length
+        elif kind == INSERTION:
+            add(INSERTION, i, length, sequence[j:j + length])
+            j += length
+        elif kind == SUBSTITUTION:
+            add(SUBSTITUTION, i, 1, sequence[j])
+            i += 1
+            j += 1
+        else:
+            anchor = _anchor(reference, sequence, i, j)
+            # nothing to resynchronize on nearby, as a single substitution
+            resume, resume_j = anchor if anchor else (i + 1, j + 1)
+            _replace(add, i, resume - i, sequence[j:resume_j])
+            i, j = resume, resume_j
+
+    if i < ref_len:
+        add(DELETION, i, ref_len - i)
+    if j < seq_len:
+        add(INSERTION, ref_len, seq_len - j, sequence[j:])
+
+    return edits
+
+
+# smallest edit at a mismatch after which reference and sequence agree again
+# (None, 0) if there is none with an indel of up to MAX_INDEL bases
+def _resync(reference, sequence, i, j):
+    if reference[i + 1:i + 1 + RESYNC_LENGTH] == sequence[j + 1:j + 1 + RESYNC_LENGTH]:
+        return SUBSTITUTION, 1
+
+    for length in range(1, MAX_INDEL + 1):
+        if reference[i + length:i + length + RESYNC_LENGTH] == sequence[j:j + RESYNC_LENGTH]:
+            return DELETION, length
+        if sequence[j + length:j + length + RESYNC_LENGTH] == reference[i:i + RESYNC_LENGTH]:
+            return INSERTION, length
+
+    return None, 0
+
+
+# positions of every k-mer of the reference
+@functools.lru_cache(maxsize=4)
+def _reference_kmers(reference):
+    kmers = {}
+    for position in range(len(reference) - ANCHOR_LENGTH + 1):
+        kmers.setdefault(reference[position:position + ANCHOR_LENGTH], []).append(position)
+    return kmers
+
+
+def _agrees(reference, sequence, i, j, length):
+    agree = min(length, len(reference) - i, len(sequence) - j)
+    return agree > 0 and reference[i:i + agree] == sequence[j:j + agree]
+
+
+# reference position from which the sequence from 'j' on agrees with the reference,
+# the closest to 'expected' and not before 'start', None if there is none within ANCHOR_WINDOW
+def _find_in_reference(reference, sequence, j, expected, start):
+    if _agrees(reference, sequence, expected, j, RESYNC_LENGTH):
+        return expected
+    for shift in range(1, MAX_INDEL + 1):
+        for position in (expected + shift, expected - shift):
+            if position >= start and _agrees(reference, sequence, position, j, RESYNC_LENGTH):
+                return position
+
+    candidates = [position for position in _reference_kmers(reference).get(sequence[j:j + ANCHOR_LENGTH], ())
+                  if position >= start and abs(position - expected) <= ANCHOR_WINDOW
+                  and _agrees(reference, sequence, position, j, ANCHOR_CHECK)]
+    return min(candidates, key=lambda position: abs(position - expected)) if candidates else None
+
+
+# next (reference position, sequence position) after a mismatch from which both agree again,
+# for indels longer than MAX_INDEL, None if there is none within ANCHOR_WINDOW
+def _anchor(reference, sequence, i, j):
+    kmers = _reference_kmers(reference)
+    # the fewest sequence bases skipped first, so a deletion is found before anything else
+    for offset in range(min(ANCHOR_WINDOW, len(sequence) - j - ANCHOR_LENGTH + 1)):
+        for position in kmers.get(sequence[j + offset:j + offset + ANCHOR_LENGTH], ()):
+            if i <= position <= i + offset + ANCHOR_WINDOW and _agrees(reference, sequence, position,
+                                                                         j + offset, ANCHOR_CHECK):
+                return position, j + offset
+    return None
+
+
+# edits replacing 'length' reference bases from 'position' on by 'bases':
+# substitutions and n runs for as many bases as both have, the rest as deletion or insertion
+def _replace(add, position, length, bases):
+    common = min(length, len(bases))
+    offset = 0
+    for is_n, run in groupby(bases[:common], key=lambda base: base == "N"):
+        run = "".join(run)
+        if is_n:
+            add(N_RUN, position + offset, len(run))
+        else:
+            add(SUBSTITUTION, position + offset, len(run), run)
+        offset += len(run)
+
+    if length > common:
+        add(DELETION, position + common, length - common)
+    elif len(bases) > common:
+        add(INSERTION, position + common, len(bases) - common, bases[common:])
+
+
+def apply_edits(reference, edits):
+    """
+    Sequence resulting from applying 'edits' (see 'diff_sequence') to 'reference'.
+    """
+    parts = []
+    position = 0
+    for kind, edit_position, length, bases in edits:
+        parts.append(reference[position:edit_position])
+        if kind == SUBSTITUTION:
+            parts.append(bases)
+            position = edit_position + length
+        elif kind == INSERTION:
+            parts.append(bases)
+            position = edit_position
+        elif kind == DELETION:
+            position = edit_position + length
+        else:
+            parts.append("N" * length)
+            position = edit_position + length
+    parts.append(reference[position:])
+    return "".join(parts)
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_record(reference, sequence):
+    edits = diff_sequence(reference, sequence)
+    # never store a lossy record, nor one larger than the sequence itself
+    # (9 bytes per edit, with the deletion and insertion of the whole sequence 2 edits)
+    if apply_edits(reference, edits) != sequence or \
+            9 * len(edits) + sum(len(edit[3]) for edit in edits) > 18 + len(sequence):
+        edits = [(DELETION, 0, len(reference), ""), (INSERTION, len(reference), len(sequence), sequence)]
+
+    positions = array("I", (edit[1] for edit in edits))
+    lengths = array("I", (edit[2] for edit in edits))
+    kinds = bytes(edit[0] for edit in edits)
+    bases = "".join(edit[3] for edit in edits).encode()
+
+    return b"".join((_RECORD_HEADER.pack(len(edits), len(bases), len(sequence)),
+                     _little_endian(positions), _little_endian(lengths), kinds, bases))
+
+
+def decode_record(data):
+    """
+    Returns the edits of a record written by 'encode_record'.
+    """
+    num_edits, num_bases, _ = _RECORD_HEADER.unpack_from(data)
+    start = _RECORD_HEADER.size
+    positions = _from_little_endian("I", data[start:start + 4 * num_edits])
+    start += 4 * num_edits
+    lengths = _from_little_endian("I", data[start:start + 4 * num_edits])
+    start += 4 * num_edits
+    kinds = data[start:start + num_edits]
+    start += num_edits
+    bases = data[start:start + num_bases].decode()
+
+    edits = []
+    offset = 0
+    for kind, position, length in zip(kinds, positions, lengths):
+        num = length if kind in (SUBSTITUTION, INSERTION) else 0
+        edits.append((kind, position, length, bases[offset:offset + num]))
+        offset += num
+    return edits
+
+
+def read_fst_records(fst_file):
+    """
+    Yields (id_version, sequence) of every line of a '#! ALL' .fst file (see 'create_fst_file').
+    """
+    with open(fst_file, "r") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#!"):
+                continue
+            id_version, _, _, sequence = line.split(" ", 3)
+            yield id_version, sequence.strip()
+
+
+def write_sequence_store(records, store_file, reference, reference_name="rCRS"):
+    """
+    Writes a compact store of 'records', an iterable of (id_version, sequence).
+    Records are encoded one at a time, so any number of sequences can be streamed in.
+
+    :return: Number of stored sequences
+    """
+    index = []
+    with open(store_file, "wb") as f:
+        f.write(MAGIC)
+        reference_data = json.dumps({"name": reference_name, "sequence": reference}).encode()
+        f.write(struct.pack("<I", len(reference_data)))
+        f.write(reference_data)
+
+        for id_version, sequence in records:
+            data = encode_record(reference, sequence)
+            index.append([id_version, f.tell(), len(data)])
+            f.write(data)
+
+        index_offset = f.tell()
+        f.write(json.dumps({"records": index}).encode())
+        f.write(_INDEX_FOOTER.pack(index_offset))
+
+    return len(index)
+
+
+class SequenceStore:
+    """
+    Reader of a store written by 'write_sequence_store'.
+
+    Records are read on access through the offset index, e.g.
+
+        with SequenceStore("sequences.mts") as store:
+            sequence = store["KF040496.1"]
+            edits = store.edits("KF040496.1")
+    """
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self._f = open(store_file, "rb")
+
+        if self._f.read(len(MAGIC)) != MAGIC:
+            self._f.close()
+            raise ValueError(f"{store_file} is not a sequence store.")
+
+        reference_size, = struct.unpack("<I", self._f.read(4))
+        reference_data = json.loads(self._f.read(reference_size))
+        self.reference_name = reference_data["name"]
+        self.reference = reference_data["sequence"]
+
+        self._f.seek(-_INDEX_FOOTER.size, 2)
+        footer_offset = self._f.tell()
+        index_offset, = _INDEX_FOOTER.unpack(self._f.read(_INDEX_FOOTER.size))
+        self._f.seek(index_offset)
+        records = json.loads(self._f.read(footer_offset - index_offset))["records"]
+        # accession -> (offset, size), in stored order
+        self.index = {id_version: (offset, size) for id_version, offset, size in records}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._f.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id_version):
+        return id_version in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def _read(self, id_version):
+        offset, size = self.index[id_version]
+        self._f.seek(offset)
+        return self._f.read(size)
+
+    def edits(self, id_version):
+        """
+        Differences of a sequence to the reference as list of (kind, position, length, bases),
+        positions are 0-based reference indices, see 'EDIT_NAMES' for the kinds.
+        """
+        return decode_record(self._read(id_version))
+
+    def __getitem__(self, id_version):
+        return apply_edits(self.reference, self.edits(id_version))
+
+    def items(self):
+        for id_version in self.index:
+            yield id_version, self[id_version]
+
+    def export_fst(self, fst_file):
+        """
+        Writes all sequences in stored order as a '#! ALL' .fst file.
+        """
+        with open(fst_file, "wb") as f:
+            f.write(FST_HEADER)
+            for id_version, sequence in self.items():
+                f.write(f"{id_version} ? 1 {sequence}\n".encode())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between .fst files and compact sequence stores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    encode_parser = subparsers.add_parser("encode", help="write a sequence store of a .fst file")
+    encode_parser.add_argument("fst_file")
+    encode_parser.add_argument("store_file")
+    encode_parser.add_argument("--reference", default=REFERENCE_FILE, help="reference fasta file (default: rCRS)")
+
+    export_parser = subparsers.add_parser("export", help="write a .fst file of a sequence store")
+    export_parser.add_argument("store_file")
+    export_parser.add_argument("fst_file")
+
+    args = parser.parse_args()
+
+    if args.command == "encode":
+        count = write_sequence_store(read_fst_records(args.fst_file), args.store_file,
+                                     read_reference_fasta(args.reference))
+        print(f"Stored {count} sequences in {args.store_file}.")
+    else:
+        with SequenceStore(args.store_file) as store:
+            store.export_fst(args.fst_file)
+        print(f"Exported {len(store)} sequences to {args.fst_file}.")
@@ -0,0 +1,232 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# derives the full hg signature of every haplogroup from the xml tree
+#
+# the 'HG' attribute of a node only lists the mutations on the branch to its parent.
+# the full signature (differences to the rCRS) of a node is the signature of its parent
+# with these applied, in a single top down pass over the tree:
+#   '73G'     - sets the allele of position 73, replacing a previous one (i.e. heteroplasmy 'Y' -> 'T')
+#   '315.1C'  - sets the allele of an insertion
+#   '16519T'  - allele equal to the reference base, the position reverts and leaves the signature
+#   '315.1-'  - deletion of an inserted base, the insertion leaves the signature
+#   '@7972', '7972G!', 'G7972'
+#             - explicit back mutations, the position leaves the signature
+#
+# signatures are stored as a tuple of position buckets. a child shares all buckets
+# not touched by its mutations with its parent, so only the changed buckets are copied per node.
+#
+# the derived signatures are compared against the .emp file (see 'parse_haplo_motifs')
+# with a report of every missing or extra mutation per haplogroup.
+#
+#################################
+
+import json
+
+import numpy as np
+
+from utils.mutations import VOCABULARY, parse_mutation
+from utils.tree_emitters import TreeEmitter, walk_tree
+
+
+# positions per signature bucket
+BUCKET_SIZE = 256
+
+# length of the rCRS, positions are 1-based
+REFERENCE_LENGTH = 16569
+
+NUM_BUCKETS = REFERENCE_LENGTH // BUCKET_SIZE + 1
+
+def parse_delta_token(token):
+    """
+    Parses a mutation of a node 'HG' attribute, see 'parse_mutation'.
+
+    Returns (key, allele, back_mutation), with key = (position, insertion index).
+    allele is upper case, None for back mutations given without one.
+    Raises a ValueError for tokens not in any of the supported notations.
+    """
+    mutation = parse_mutation(token)
+    return (mutation.position, mutation.insertion), mutation.allele, mutation.back_mutation
+
+
+# reads a single sequence fasta file, i.e. the rCRS (NC_012920.1)
+def read_reference_fasta(fasta_file):
+    with open(fasta_file, "r") as f:
+        sequence = "".join(line.strip() for line in f if not line.startswith(">"))
+    return sequence.upper()
+
+
+def reference_alleles(sequence):
+    """
+    dict of position (1-based) to reference base of a sequence.
+    """
+    return {position: base for position, base in enumerate(sequence, start=1)}
+
+
+# a node signature with the mutations of its 'HG' attribute applied
+# signature - tuple of NUM_BUCKETS buckets, each a sorted tuple of (key, mutation) pairs
+# untouched buckets are the very objects of the parent signature
+def apply_delta(signature, delta, reference):
+    changes = {}
+    for token in delta.split():
+        key, allele, back_mutation = parse_delta_token(token)
+        position, insertion = key
+
+        if back_mutation:
+            mutation = None
+        elif insertion:
+            # deletion of an inserted base removes the insertion
+            mutation = None if allele == "-" else token
+        else:
+            mutation = None if reference.get(position) == allele.upper() else token
+
+        changes.setdefault(position // BUCKET_SIZE, {})[key] = mutation
+
+    if not changes:
+        return signature
+
+    buckets = list(signature)
+    for bucket, bucket_changes in changes.items():
+        mutations = dict(buckets[bucket])
+        for key, mutation in bucket_changes.items():
+            if mutation is None:
+                mutations.pop(key, None)
+            else:
+                mutations[key] = mutation
+        buckets[bucket] = tuple(sorted(mutations.items()))
+    return tuple(buckets)
+
+
+def signature_string(signature):
+    return " ".join(mutation for bucket in signature for _, mutation in bucket)
+
+
+# derives the full hg signature of every node in a single walk
+# reference - dict of position to reference base, see 'reference_alleles'
+# results in a dict of haplogroup to signature string in preorder, like 'parse_haplo_motifs'
+class SignatureEmitter(TreeEmitter):
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.signatures = {}
+        # signatures of the nodes on the current path
+        self._stack = [tuple(() for _ in range(NUM_BUCKETS))]
+
+    def enter(self, tree, node):
+        signature = apply_delta(self._stack[-1], tree.get_hg(node) or "", self.reference)
+        self._stack.append(signature)
+
+        node_id = tree.get_id(node)
+        if node_id is not None:
+            self.signatures[node_id] = signature_string(signature)
+
+    def exit(self, tree, node):
+        self._stack.pop()
+
+    def result(self):
+        return self.signatures
+
+
+def derive_signatures(tree, root, reference):
+    return walk_tree(tree, root, [SignatureEmitter(reference)])[0]
+
+
+def diff_haplogroups(haplogroups, expected):
+    """
+    Compares the haplogroups of the tree against the ones of the .emp file, without their signatures.
+    Used without the rCRS, returns a report as 'diff_signatures' without any mismatches.
+    """
+    haplogroups = set(haplogroups)
+    return {
+        "missing_haplogroups": [haplogroup for haplogroup in expected if haplogroup not in haplogroups],
+        "extra_haplogroups": sorted(haplogroups.difference(expected)),
+        "mismatches": {},
+    }
+
+
+def diff_signatures(derived, expected):
+    """
+    Compares derived signatures against the ones of the .emp file.
+
+    Mutations are compared as interned ids (see 'utils/mutations.py'), so case insensitive,
+    as the .emp file and the tree do not always agree on the case of transversions and insertions.
+
+    Returns
+    -------
+    dict
+        'missing_haplogroups' - haplogroups of the .emp file not in the tree
+        'extra_haplogroups' - haplogroups of the tree not in the .emp file
+        'mismatches' - haplogroup to {'missing': [...], 'extra': [...]}, mutations of the
+                       .emp signature missing from the derived one and vice versa
+    """
+    mismatches = {}
+    for haplogroup, signature in derived.items():
+        if haplogroup not in expected:
+            continue
+        if signature == expected[haplogroup]:
+            continue
+        derived_ids = VOCABULARY.encode(signature)
+        expected_ids = VOCABULARY.encode(expected[haplogroup])
+        if not np.array_equal(derived_ids, expected_ids):
+            # listed as spelled in the signatures
+            missing = set(np.setdiff1d(expected_ids, derived_ids, assume_unique=True).tolist())
+            extra = set(np.setdiff1d(derived_ids, expected_ids, assume_unique=True).tolist())
+            mismatches[haplogroup] = {
+                "missing": [m for m in expected[haplogroup].split() if VOCABULARY.intern(m) in missing],
+                "extra": [m for m in signature.split() if VOCABULARY.intern(m) in extra],
+            }
+
+    return {
+        "missing_haplogroups": [haplogroup for haplogroup in expected if haplogroup not in derived],
+        "extra_haplogroups": [haplogroup for haplogroup in derived if haplogroup not in expected],
+        "mismatches": mismatches,
+    }
+
+
+def is_consistent(report):
+    return not (report["missing_haplogroups"] or report["extra_haplogroups"] or report["mismatches"])
+
+
+# readable summary of a 'diff_signatures' report, listing at most 'limit' entries per section
+def format_mismatch_report(report, limit=10):
+    lines = []
+    for section, label in (("missing_haplogroups", "in .emp file but not in tree"),
+                           ("extra_haplogroups", "in tree but not in .emp file")):
+        if report[section]:
+            shown = ", ".join(report[section][:limit])
+            more = f" and {len(report[section]) - limit} more" if len(report[section]) > limit else ""
+            lines.append(f"{len(report[section])} haplogroups {label}: {shown}{more}")
+
+    mismatches = report["mismatches"]
+    if mismatches:
+        lines.append(f"{len(mismatches)} haplogroups with different signatures:")
+        for haplogroup in list(mismatches)[:limit]:
+            diff = mismatches[haplogroup]
+            lines.append(f"  {haplogroup}: missing [{' '.join(diff['missing'])}], "
+                         f"extra [{' '.join(diff['extra'])}]")
+        if len(mismatches) > limit:
+            lines.append(f"  and {len(mismatches) - limit} more")
+
+    return "\n".join(lines)
+
+
+def save_signatures(signatures, report, reference_source, signature_file):
+    with open(signature_file, "w") as f:
+        json.dump({"reference": reference_source, "signatures": signatures, "report": report}, f, indent=4)
+
+
+def load_signatures(signature_file):
+    """
+    Returns (signatures, report) written by 'save_signatures'.
+    """
+    with open(signature_file, "r") as f:
+        data = json.load(f)
+    return data["signatures"], data["report"]
@@ -0,0 +1,89 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# typed binary storage of the intermediate tables
+#
+# tables passed between 'merge_reps_meta' and 'tree_dat_process' are stored with their dtypes,
+# so they are neither parsed nor type inferred again when read.
+# string columns with few distinct values (i.e. source, country, sequencing technology)
+# are stored as categoricals.
+#
+# with pyarrow installed tables are uncompressed feather files, otherwise pandas pickles.
+# only the final downloadable tables are written as csv.
+#
+#################################
+
+import pandas as pd
+
+# pyarrow is optional, without it tables are stored as pickles
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+
+TABLE_SUFFIX = ".feather" if feather is not None else ".pkl"
+
+# string columns with at most this ratio of distinct values to rows are stored as categoricals
+CATEGORICAL_RATIO = 0.5
+
+
+def table_file(name):
+    """
+    File name of a table in the available format, i.e. 'metadata_combined' -> 'metadata_combined.feather'.
+    """
+    return name + TABLE_SUFFIX
+
+
+def encode_categoricals(df, columns=None, max_ratio=CATEGORICAL_RATIO):
+    """
+    Converts 'columns' of 'df' to categoricals, by default all string columns
+    with at most 'max_ratio' distinct values per row.
+    """
+    if columns is None:
+        columns = [column for column in df.columns
+                   if (pd.api.types.is_string_dtype(df[column]) or df[column].dtype == object)
+                   and not isinstance(df[column].dtype, pd.CategoricalDtype)
+                   and len(df) and df[column].nunique() <= max_ratio * len(df)]
+    return df.astype({column: "category" for column in columns})
+
+
+def write_table(df, path, categorical=None):
+    """
+    Writes 'df' to 'path', without its index.
+    'categorical' columns are stored as categoricals, see 'encode_categoricals'.
+    Returns the table as stored, the same as 'read_table' would return.
+    """
+    df = encode_categoricals(df.reset_index(drop=True), categorical)
+    if feather is not None:
+        # uncompressed, so reads skip the decompression
+        feather.write_feather(df, path, compression="uncompressed")
+    else:
+        df.to_pickle(path)
+    return df
+
+
+def read_table(path, columns=None):
+    """
+    Reads a table written by 'write_table', optionally only the given 'columns'.
+    """
+    if feather is not None:
+        return feather.read_table(path, columns=columns).to_pandas()
+    df = pd.read_pickle(path)
+    return df[columns] if columns is not None else df
+
+
+def text_records(df):
+    """
+    Rows of 'df' as dicts of strings, empty strings for missing values,
+    as read from the csv file of the table with dtype=str and keep_default_na=False.
+    """
+    return df.astype(object).where(df.notna(), "").astype(str).to_dict("records")
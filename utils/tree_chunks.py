@@ -0,0 +1,126 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# lazily loadable chunks of the json tree, used by the collapsible tree
+#
+# the json tree (see 'JsonEmitter') is split into chunks of at most 'chunk_size' nodes.
+# a chunk holds the top levels of one or more subtrees: nodes are expanded level by level
+# as long as all of their children still fit. nodes that do not fit are stubs, they keep their own
+# attributes but instead of their children reference the chunk holding these:
+#   {"name": ..., "HG": ..., "chunk": 12, "child_count": 3, "descendant_count": 41}
+# in that chunk the stub is one of the subtree roots, with its children.
+# stubs of small sibling subtrees are grouped into one chunk. chunk 0 holds the root of the tree.
+#
+# nodes with a phylo superhaplo below them are always expanded in their chunk,
+# as the collapsible tree starts with these expanded. so the root chunk may be larger.
+#
+# the index maps every haplogroup to the chunk listing its children (leaves to the chunk they are in)
+# and holds the parent chunk of every chunk, so deep links load the chunks from the root down.
+#
+#################################
+
+from collections import deque
+
+
+CHUNK_SIZE = 500
+
+
+def _node_stats(json_tree):
+    """
+    Number of descendants and whether a phylo superhaplo is below, per node dict (by id).
+    """
+    descendants, phylo_below = {}, {}
+    order = []
+    stack = [json_tree]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(node.get("children", []))
+
+    # children before parents
+    for node in reversed(order):
+        children = node.get("children", [])
+        descendants[id(node)] = sum(descendants[id(child)] + 1 for child in children)
+        phylo_below[id(node)] = any(child.get("is_phylo_superhaplo") or phylo_below[id(child)]
+                                    for child in children)
+    return descendants, phylo_below
+
+
+def _copy_node(node):
+    return {key: value for key, value in node.items() if key != "children"}
+
+
+def _group_stubs(stubs, descendants, chunk_size):
+    """
+    Groups consecutive stubs whose subtrees fit into one chunk together.
+    """
+    groups = []
+    size = chunk_size
+    for node, copy in stubs:
+        subtree_size = descendants[id(node)] + 1
+        if size + subtree_size > chunk_size:
+            groups.append([])
+            size = 0
+        groups[-1].append((node, copy))
+        size += subtree_size
+    return groups
+
+
+def split_tree(json_tree, chunk_size=CHUNK_SIZE):
+    """
+    Splits a json tree into chunks, see module comment.
+    Returns the list of chunks (each a list of subtree roots, chunk 0 holds the root) and the index.
+    """
+    descendants, phylo_below = _node_stats(json_tree)
+
+    chunks = []
+    parents = []
+    haplogroups = {}
+    # (original subtree roots, parent chunk) of the chunks still to create, in chunk number order
+    todo = deque([([json_tree], -1)])
+
+    while todo:
+        roots, parent_chunk = todo.popleft()
+        number = len(chunks)
+        chunk_roots = [_copy_node(root) for root in roots]
+        chunks.append(chunk_roots)
+        parents.append(parent_chunk)
+
+        size = len(roots)
+        stubs = []
+        # level order, so a chunk covers the top levels of its subtrees
+        queue = deque(zip(roots, chunk_roots))
+        while queue:
+            node, copy = queue.popleft()
+            children = node.get("children", [])
+            haplogroups[node["name"]] = number
+
+            fits = size + len(children) <= chunk_size
+            if children and not fits and copy not in chunk_roots and not phylo_below[id(node)]:
+                stubs.append((node, copy))
+                continue
+
+            size += len(children)
+            copy["children"] = [_copy_node(child) for child in children]
+            queue.extend(zip(children, copy["children"]))
+
+        # stubs, their children are in chunks of their own
+        # small sibling subtrees share a chunk, so expanding them does not fetch a file each
+        for group in _group_stubs(stubs, descendants, chunk_size):
+            group_number = number + len(todo) + 1
+            for node, copy in group:
+                copy["chunk"] = group_number
+                copy["child_count"] = len(node["children"])
+                copy["descendant_count"] = descendants[id(node)]
+            todo.append(([node for node, _ in group], number))
+
+    index = {"chunk_size": chunk_size, "parents": parents, "haplogroups": haplogroups}
+    return chunks, index
@@ -0,0 +1,333 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# differences between two versions of the xml tree and the data files they affect
+#
+# nodes are matched on their 'Id'. of the remaining nodes, an old and a new node with the same
+# 'HG' below the same (matched) parent are taken as a renamed node. parents are matched first,
+# so renamed nodes below a renamed parent are found as well. all other nodes are added or removed.
+# matched nodes below a different parent are moved, and matched nodes with different 'HG' mutations
+# have changed HGs. every step is a single pass over one of the trees.
+#
+# the affected data files follow from the kind of changes (see 'DATA_FILES'):
+#   node shards   - the changed nodes, their subtrees (ancestors and signatures in the shards),
+#                   parents (child lists) and nodes with a different number of descendants
+#   mutation index - mutations in the full signature of exactly one of the old and new version of a haplogroup
+#
+# usage:
+#   python -m utils.tree_diff <old xml> [<new xml>] [-o changelog.json] [--news]
+#
+# the new xml defaults to the current input file. the changelog lists all changes and the
+# files of 'docs/data' to publish (and to delete), so a release only uploads these.
+#
+#################################
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from utils.compact_tree import NONE
+from utils.mutations import VOCABULARY
+from utils.node_shards import MANIFEST_NAME, shard_file
+from utils.path_defaults import XML_FILE, REFERENCE_FILE, DATA_DEST, NODE_SHARD_DIR
+from utils.signature_engine import (derive_signatures,
+                                    read_reference_fasta,
+                                    reference_alleles)
+from utils.xml_tree_parser import xml_tree_parsing
+
+
+# data files (relative to DATA_DEST) rewritten on changes of these kinds
+# 'tree' are all changes, 'ids' added, removed and renamed nodes, 'structure' these and moved nodes
+DATA_FILES = [
+    ("tree.json", "tree"),
+    ("tree_chunks/*.json", "tree"),
+    ("radialTree.json", "tree"),
+    ("views/*.json", "tree"),
+    ("hgmotifs.json", "tree"),
+    ("mitoLEAF_phm.xml", "tree"),
+    ("fullTree.nwk", "structure"),
+    ("pruned_radialTree.nwk", "structure"),
+    ("views/*.nwk", "structure"),
+    ("tree_index.json", "structure"),
+    (os.path.relpath(os.path.join(NODE_SHARD_DIR, MANIFEST_NAME), DATA_DEST), "ids"),
+]
+
+
+class TreeDiff:
+    """
+    Differences between an old and a new version of a tree, result of 'diff_trees'.
+    'matches' maps old to new nodes, the change lists hold nodes of the tree named by the comments.
+    """
+
+    def __init__(self, old_tree, new_tree, matches, added, removed, renamed, moved, hg_changed):
+        self.old_tree = old_tree
+        self.new_tree = new_tree
+        self.matches = matches
+        # new nodes
+        self.added = added
+        # old nodes
+        self.removed = removed
+        self.renamed = renamed
+        self.moved = moved
+        self.hg_changed = hg_changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.renamed or self.moved or self.hg_changed)
+
+    def kinds(self):
+        """
+        Kinds of changes of 'DATA_FILES' that occur.
+        """
+        kinds = set()
+        if self:
+            kinds.add("tree")
+        if self.added or self.removed or self.renamed:
+            kinds.add("ids")
+        if "ids" in kinds or self.moved:
+            kinds.add("structure")
+        return kinds
+
+    def _old_parent_id(self, node):
+        parent = self.old_tree.parent[node]
+        return None if parent == NONE else self.old_tree.get_id(parent)
+
+    def _new_parent_id(self, node):
+        parent = self.new_tree.parent[node]
+        return None if parent == NONE else self.new_tree.get_id(parent)
+
+    def changes(self):
+        """
+        Json serializable lists of all changes, nodes by their 'Id' in the version they are part of.
+        """
+        old, new = self.old_tree, self.new_tree
+
+        def hg_change(node):
+            old_hg, new_hg = old.get_hg(node).split(), new.get_hg(self.matches[node]).split()
+            return {"id": new.get_id(self.matches[node]),
+                    "added": [token for token in new_hg if token not in old_hg],
+                    "removed": [token for token in old_hg if token not in new_hg]}
+
+        return {
+            "added": [{"id": new.get_id(node), "parent": self._new_parent_id(node), "HG": new.get_hg(node)}
+                      for node in self.added],
+            "removed": [{"id": old.get_id(node), "parent": self._old_parent_id(node)} for node in self.removed],
+            "renamed": [{"old_id": old.get_id(node), "id": new.get_id(self.matches[node])} for node in self.renamed],
+            "moved": [{"id": new.get_id(self.matches[node]), "old_parent": self._old_parent_id(node),
+                       "parent": self._new_parent_id(self.matches[node])} for node in self.moved],
+            "hg_changed": [hg_change(node) for node in self.hg_changed],
+        }
+
+    def _subtrees(self, roots):
+        # new nodes in the subtrees of 'roots', a node is marked if it or its parent is
+        marked = set()
+        for node in self.new_tree.preorder():
+            if node in roots or self.new_tree.parent[node] in marked:
+                marked.add(node)
+        return marked
+
+    def _changed_counts(self):
+        # new nodes whose number of descendants differs from their old version
+        def descendant_counts(tree):
+            counts = [0] * len(tree)
+            for node in tree.postorder():
+                parent = tree.parent[node]
+                if parent != NONE:
+                    counts[parent] += counts[node] + 1
+            return counts
+
+        old_counts, new_counts = descendant_counts(self.old_tree), descendant_counts(self.new_tree)
+        return {new for old, new in self.matches.items() if old_counts[old] != new_counts[new]}
+
+    def changed_subtrees(self):
+        """
+        New nodes whose full signature, ancestors or name may have changed:
+        the subtrees of added, renamed, moved and changed HG nodes.
+        """
+        return self._subtrees(set(self.added) | {self.matches[node] for node in
+                                                 self.renamed + self.moved + self.hg_changed})
+
+    def affected_shards(self, old_signatures=None, new_signatures=None):
+        """
+        Names of the haplogroups whose node shard (see 'NodeShardEmitter') is rewritten,
+        and of the ones whose shard is deleted.
+        With the full signatures of both trees, descendants of changed HG nodes are only
+        included if their signature changed.
+        """
+        new = self.new_tree
+        structural = set(self.added) | {self.matches[node] for node in self.renamed + self.moved}
+        affected = self._subtrees(structural) | self._changed_counts()
+
+        hg_changed = {self.matches[node] for node in self.hg_changed}
+        if old_signatures is None or new_signatures is None:
+            affected |= self._subtrees(hg_changed)
+        else:
+            # names are the same outside of the subtrees of renamed nodes
+            affected |= hg_changed | {node for node in self._subtrees(hg_changed)
+                                      if old_signatures.get(new.get_id(node)) != new_signatures.get(new.get_id(node))}
+
+        # child lists with names and HGs
+        for node in self.renamed + self.hg_changed:
+            parent = new.parent[self.matches[node]]
+            if parent != NONE:
+                affected.add(parent)
+
+        deleted = [self.old_tree.get_id(node) for node in self.removed + self.renamed]
+        return sorted(new.get_id(node) for node in affected), sorted(deleted)
+
+    def affected_mutations(self, old_signatures, new_signatures):
+        """
+        Mutations of the mutation index (see 'MutationIndex') whose haplogroup lists change.
+        Signatures are dicts of haplogroup to full signature of the old and new tree, see 'derive_signatures'.
+        """
+        names = {self.new_tree.get_id(node) for node in self.changed_subtrees()}
+        # names of the old versions, renamed ones differ
+        names |= {self.old_tree.get_id(node) for node in self.removed + self.renamed}
+
+        # mutation ids in exactly one of the two signatures of a haplogroup
+        changed = set()
+        for name in names:
+            changed.update(np.setxor1d(VOCABULARY.encode(old_signatures.get(name, "")),
+                                       VOCABULARY.encode(new_signatures.get(name, "")),
+                                       assume_unique=True).tolist())
+        return VOCABULARY.keys(changed)
+
+    def publish_files(self, affected_shards, deleted_shards, affected_mutations=()):
+        """
+        Data files (relative to DATA_DEST, globs for groups of files) to publish and to delete for this change.
+        """
+        kinds = self.kinds()
+        files = [path for path, kind in DATA_FILES if kind in kinds]
+        if affected_mutations:
+            files.append("mutation_index.json")
+
+        shard_dir = os.path.relpath(NODE_SHARD_DIR, DATA_DEST)
+        files += [os.path.join(shard_dir, shard_file(name)) for name in affected_shards]
+        deleted = [os.path.join(shard_dir, shard_file(name)) for name in deleted_shards]
+        return files, deleted
+
+
+def diff_trees(old_tree, new_tree):
+    """
+    Matches the nodes of two versions of a tree (CompactTree) and finds their differences, see module comment.
+    Returns a TreeDiff.
+    """
+    old_root, new_root = old_tree.getroot(), new_tree.getroot()
+
+    # old node -> new node
+    matches = {}
+    for node in old_tree.preorder(old_root):
+        match = new_tree.find(old_tree.get_id(node))
+        if match is not None:
+            matches[node] = match
+    matched = set(matches.values())
+
+    # unmatched new nodes by parent and HG, in reverse order so they are popped in document order
+    candidates = {}
+    for node in reversed(list(new_tree.preorder(new_root))):
+        if node not in matched:
+            candidates.setdefault((new_tree.parent[node], new_tree.get_hg(node)), []).append(node)
+
+    renamed, removed = [], []
+    # parents first, so children of renamed nodes find their parent matched
+    for node in old_tree.preorder(old_root):
+        if node in matches:
+            continue
+        parent = old_tree.parent[node]
+        new_parent = NONE if parent == NONE else matches.get(parent)
+        options = candidates.get((new_parent, old_tree.get_hg(node))) if new_parent is not None else None
+        if options:
+            matches[node] = options.pop()
+            matched.add(matches[node])
+            renamed.append(node)
+        else:
+            removed.append(node)
+
+    added = [node for node in new_tree.preorder(new_root) if node not in matched]
+
+    moved, hg_changed = [], []
+    for node in old_tree.preorder(old_root):
+        match = matches.get(node)
+        if match is None:
+            continue
+        parent = old_tree.parent[node]
+        if (NONE if parent == NONE else matches.get(parent)) != new_tree.parent[match]:
+            moved.append(node)
+        if set(old_tree.get_hg(node).split()) != set(new_tree.get_hg(match).split()):
+            hg_changed.append(node)
+
+    return TreeDiff(old_tree, new_tree, matches, added, removed, renamed, moved, hg_changed)
+
+
+# 'Tree News' lines for 'textfiles/news.md' from the changes of a changelog
+def format_news(changes):
+    lines = [f"- added {change['id']} ({change['HG']}) below {change['parent']}." for change in changes["added"]]
+    lines += [f"- removed {change['id']}." for change in changes["removed"]]
+    lines += [f"- renamed {change['old_id']} to {change['id']}." for change in changes["renamed"]]
+    lines += [f"- moved {change['id']} from {change['old_parent']} to {change['parent']}." for change in changes["moved"]]
+    for change in changes["hg_changed"]:
+        parts = ([f"added {' '.join(change['added'])}"] if change["added"] else []) + \
+                ([f"removed {' '.join(change['removed'])}"] if change["removed"] else [])
+        lines.append(f"- {' and '.join(parts)} in {change['id']}.")
+    return "\n".join(lines)
+
+
+# reference bases to derive full signatures with, as the 'signatures' stage, from the rCRS fasta file
+# without it reversions stay in the signatures, so affected shards and mutations are over reported, never missed
+def load_reference():
+    if os.path.isfile(REFERENCE_FILE):
+        return reference_alleles(read_reference_fasta(REFERENCE_FILE))
+    print(f"No rCRS (NC_012920.1) fasta file at {REFERENCE_FILE}, "
+          f"affected node shards and mutations include reversions.")
+    return {}
+
+
+# changelog of two xml files: all changes, affected node shards and mutations and the data files to publish
+def tree_changelog(old_xml, new_xml):
+    old_tree, old_root = xml_tree_parsing(old_xml)
+    new_tree, new_root = xml_tree_parsing(new_xml)
+    diff = diff_trees(old_tree, new_tree)
+
+    reference = load_reference()
+    old_signatures = derive_signatures(old_tree, old_root, reference)
+    new_signatures = derive_signatures(new_tree, new_root, reference)
+    mutations = diff.affected_mutations(old_signatures, new_signatures)
+    shards, deleted_shards = diff.affected_shards(old_signatures, new_signatures)
+    publish, delete = diff.publish_files(shards, deleted_shards, mutations)
+
+    return {
+        "old": old_xml,
+        "new": new_xml,
+        "changes": diff.changes(),
+        "affected": {"node_shards": shards, "deleted_node_shards": deleted_shards, "mutations": mutations},
+        "publish": publish,
+        "delete": delete,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two versions of the xml tree.")
+    parser.add_argument("old", help="xml file of the previous version")
+    parser.add_argument("new", nargs="?", default=XML_FILE, help="xml file of the new version")
+    parser.add_argument("-o", "--output", default="changelog.json", help="output json file")
+    parser.add_argument("--news", action="store_true", help="print the changes as lines for textfiles/news.md")
+    args = parser.parse_args()
+
+    changelog = tree_changelog(args.old, args.new)
+    with open(args.output, "w") as f:
+        json.dump(changelog, f, indent=2)
+
+    print(", ".join(f"{len(nodes)} {kind}" for kind, nodes in changelog["changes"].items()) + ".")
+    print(f"{len(changelog['publish'])} data files to publish, {len(changelog['delete'])} to delete, "
+          f"changelog written to {args.output}.")
+    if args.news:
+        print(format_news(changelog["changes"]))
@@ -0,0 +1,140 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# single pass tree traversal with pluggable output writers
+#
+# every output format is an emitter that is notified when the walk enters
+# and leaves a node. 'walk_tree' drives any number of emitters with
+# one depth first walk, so adding an export format does not add another pass.
+#
+# to add a format, subclass TreeEmitter and implement 'enter' and/or 'exit' and 'result'.
+#
+#################################
+
+
+class TreeEmitter:
+    """
+    Base class for emitters used with 'walk_tree'.
+
+    'enter' is called in preorder (parents before children),
+    'exit' in postorder (children before parents).
+    Siblings are always visited in document order.
+    """
+
+    def enter(self, tree, node):
+        pass
+
+    def exit(self, tree, node):
+        pass
+
+    def result(self):
+        raise NotImplementedError
+
+
+def walk_tree(tree, root, emitters):
+    """
+    Walks the subtree of 'root' once and feeds every node to all 'emitters'.
+    Returns the list of emitter results in the order of 'emitters'.
+    """
+    for node, entering in tree.walk(root):
+        if entering:
+            for emitter in emitters:
+                emitter.enter(tree, node)
+        else:
+            for emitter in emitters:
+                emitter.exit(tree, node)
+
+    return [emitter.result() for emitter in emitters]
+
+
+# creates the nested json dict used by the webapp
+# color_dict - dictionary of motif to color
+# superhaplo_id - list of designated superhaplogroups
+# phylo_superhaplo_id - second list of superhaplos (used in radial tree atm)
+# profiles - dictionary of motif to list of accession numbers
+class JsonEmitter(TreeEmitter):
+
+    def __init__(self, color_dict=None, superhaplo_id=None, phylo_superhaplo_id=None, profiles=None):
+        self.color_dict = color_dict
+        self.superhaplo_set = set(superhaplo_id) if superhaplo_id is not None else None
+        self.phylo_superhaplo_set = set(phylo_superhaplo_id) if phylo_superhaplo_id is not None else None
+        self.profiles = profiles
+
+        # (node dict, color) of the nodes on the current path
+        self._stack = []
+        self._root_dict = None
+
+    def enter(self, tree, node):
+        node_id = tree.get_id(node)
+        is_root = not self._stack
+        inherited_color = None if is_root else self._stack[-1][1]
+
+        node_color = self.color_dict.get(node_id, inherited_color) if self.color_dict else inherited_color
+        is_superhaplo = self.superhaplo_set is not None and (node_id in self.superhaplo_set or is_root)
+        is_phylo_superhaplo = self.phylo_superhaplo_set is not None and node_id in self.phylo_superhaplo_set
+
+        node_dict = {
+            "name": node_id,
+            "HG": tree.get_hg(node)
+        }
+
+        if self.color_dict:
+            node_dict["colorcode"] = node_color
+
+        if is_superhaplo:
+            node_dict["is_superhaplo"] = True
+
+        if is_phylo_superhaplo:
+            node_dict["is_phylo_superhaplo"] = True
+
+        if self.profiles and self.profiles[node_id]:
+            node_dict["profiles"] = sorted(self.profiles[node_id])
+
+        node_dict["children"] = []
+
+        if is_root:
+            self._root_dict = node_dict
+        else:
+            self._stack[-1][0]["children"].append(node_dict)
+        self._stack.append((node_dict, node_color))
+
+    def exit(self, tree, node):
+        self._stack.pop()
+
+    def result(self):
+        return self._root_dict
+
+
+# creates a newick string, labels are the node ids
+class NewickEmitter(TreeEmitter):
+
+    def __init__(self):
+        # newick strings of the finished children of each node on the current path
+        self._stack = [[]]
+
+    def enter(self, tree, node):
+        self._stack.append([])
+
+    def exit(self, tree, node):
+        children_newick = self._stack.pop()
+
+        label = tree.get_id(node)
+        if label is None:
+            label = 'N/A'
+
+        if children_newick:
+            # string in Newick format: (child1,child2,...,childN)label
+            label = f'({",".join(children_newick)}){label}'
+        self._stack[-1].append(label)
+
+    def result(self):
+        return self._stack[0][0] + ';'
+
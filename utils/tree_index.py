@@ -0,0 +1,182 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# ancestor / descendant interval index of the tree
+#
+# nodes are numbered in preorder (the entry number of an euler tour), and every node
+# also gets the number of the last node of its subtree (its exit number) and its depth.
+# so the subtree of a node is the contiguous range [entry, exit] of preorder numbers:
+#   a is b or an ancestor of b <=>  entry(a) <= entry(b) <= exit(a)
+#   descendants of a           =   nodes entry(a) + 1 ... exit(a)
+#   size of the subtree of a   =   exit(a) - entry(a) + 1
+# lowest common ancestors are found by binary lifting (jump tables of the 2^k-th ancestors),
+# in O(log depth) per pair, and vectorized with numpy for many pairs at once.
+#
+# written as 'tree_index.json' with the names, parents, depths and exit numbers in preorder,
+# the entry number of a node is its position in these lists.
+#
+#################################
+
+import json
+
+import numpy as np
+
+
+class TreeIndex:
+    """
+    Interval index of a tree, see module comment. Queries take and return haplogroup names.
+    """
+
+    def __init__(self, names, parent, depth, exit):
+        self.names = list(names)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.depth = np.asarray(depth, dtype=np.int32)
+        self.exit = np.asarray(exit, dtype=np.int32)
+
+        # first node wins for duplicated names
+        self._entry = {}
+        for entry, name in enumerate(self.names):
+            self._entry.setdefault(name, entry)
+
+        # jump tables, _up[k][node] is the 2^k-th ancestor of node, the root is its own ancestor
+        up = np.where(self.parent < 0, np.arange(len(self.names), dtype=np.int32), self.parent)
+        self._up = [up]
+        max_depth = int(self.depth.max()) if len(self.depth) else 0
+        while (1 << len(self._up)) <= max_depth:
+            self._up.append(self._up[-1][self._up[-1]])
+
+    @classmethod
+    def from_tree(cls, tree, root):
+        """
+        Builds the index of a CompactTree (see 'compact_tree.py') in a single walk.
+        """
+        names, parent, depth, exit = [], [], [], []
+        # preorder numbers of the nodes on the current path
+        path = []
+
+        for node, entering in tree.walk(root):
+            if entering:
+                entry = len(names)
+                names.append(tree.get_id(node))
+                parent.append(path[-1] if path else -1)
+                depth.append(len(path))
+                exit.append(entry)
+                path.append(entry)
+            else:
+                exit[path.pop()] = len(names) - 1
+
+        return cls(names, parent, depth, exit)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._entry
+
+    def entry(self, name):
+        try:
+            return self._entry[name]
+        except KeyError:
+            raise KeyError(f"Haplogroup '{name}' is not in the tree.") from None
+
+    def _entries(self, names):
+        return np.fromiter((self.entry(name) for name in names), dtype=np.int32, count=len(names))
+
+    def is_ancestor(self, ancestor, node):
+        """
+        True if 'ancestor' is a proper ancestor of 'node'.
+        """
+        a, b = self.entry(ancestor), self.entry(node)
+        return a < b <= self.exit[a]
+
+    def ancestors(self, name):
+        """
+        Ancestors of a node, root first.
+        """
+        ancestors = []
+        node = self.parent[self.entry(name)]
+        while node >= 0:
+            ancestors.append(self.names[node])
+            node = self.parent[node]
+        return ancestors[::-1]
+
+    def descendants(self, name):
+        """
+        All descendants of a node in preorder.
+        """
+        entry = self.entry(name)
+        return self.names[entry + 1:self.exit[entry] + 1]
+
+    def subtree_size(self, name):
+        """
+        Number of nodes in the subtree of a node, including the node itself.
+        """
+        entry = self.entry(name)
+        return int(self.exit[entry]) - entry + 1
+
+    def _lca(self, a, b):
+        # vectorized binary lifting on arrays of preorder numbers
+        a, b = a.copy(), b.copy()
+        # lift the deeper node of every pair to the depth of the other one
+        swap = self.depth[a] < self.depth[b]
+        a[swap], b[swap] = b[swap], a[swap]
+        diff = self.depth[a] - self.depth[b]
+        for k, up in enumerate(self._up):
+            jump = (diff >> k) & 1 == 1
+            a[jump] = up[a[jump]]
+
+        # pairs lifted onto the same node already found their ancestor
+        done = a == b
+        for up in reversed(self._up):
+            move = ~done & (up[a] != up[b])
+            a[move], b[move] = up[a[move]], up[b[move]]
+        return np.where(done, a, self._up[0][a])
+
+    def lca(self, a, b):
+        """
+        Lowest common ancestor of two nodes.
+        """
+        return self.batch_lca([a], [b])[0]
+
+    def batch_lca(self, a_names, b_names):
+        """
+        Lowest common ancestors of the pairs (a_names[i], b_names[i]).
+        """
+        if len(a_names) != len(b_names):
+            raise ValueError("Both lists of haplogroups need the same length.")
+        return [self.names[entry] for entry in self._lca(self._entries(a_names), self._entries(b_names))]
+
+    def batch_distance(self, a_names, b_names):
+        """
+        Number of branches between the pairs (a_names[i], b_names[i]), as numpy array.
+        """
+        a, b = self._entries(a_names), self._entries(b_names)
+        return self.depth[a] + self.depth[b] - 2 * self.depth[self._lca(a, b)]
+
+    def distance(self, a, b):
+        return int(self.batch_distance([a], [b])[0])
+
+    def to_json(self):
+        return {
+            "names": self.names,
+            "parent": self.parent.tolist(),
+            "depth": self.depth.tolist(),
+            "exit": self.exit.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["names"], data["parent"], data["depth"], data["exit"])
+
+
+def load_tree_index(index_file):
+    with open(index_file, "r") as f:
+        return TreeIndex.from_json(json.load(f))
@@ -0,0 +1,147 @@
+# This file is part of the mitoLEAF (formerly mitoTree) project and authored by Noah Hurmer.
+#
+# Copyright 2024, Noah Hurmer & mitoLEAF.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+
+#################################
+#
+# pruned views of a tree, any number of them at once and without copying the tree
+#
+# a view marks some nodes (i.e. superhaplos, nodes up to a depth, nodes with profiles)
+# and keeps these, all of their ancestors and the root. collapsing views also drop kept
+# nodes that are not marked and have a single kept child, the child takes their place
+# (as 'create_bare_tree' with remove_add).
+#
+# 'prune_views' finds the nodes of all views in one bottom-up pass, with one bit per view:
+# a node is kept in the views of its own marks or the marks of any child,
+# and collapsed in the views where exactly one of its children is kept.
+# 'walk_views' then walks the original tree once, skipping subtrees not kept in any view,
+# and feeds every node to the emitters (see 'tree_emitters.py') of all views it is part of.
+# the parent of a node in a view is its closest ancestor in the view,
+# so the same emitters as for the full tree create the json and newick files of the views.
+#
+#################################
+
+
+class TreeView:
+    """
+    Pruned view of a tree, see module comment.
+    'mark(tree, node, depth)' tells whether a node is marked.
+    """
+
+    def __init__(self, name, mark, collapse=True):
+        self.name = name
+        self.mark = mark
+        self.collapse = collapse
+
+
+# views of common node selections
+
+def id_view(name, ids, collapse=True):
+    """
+    View of the nodes with an id in 'ids', i.e. the superhaplos.
+    """
+    id_set = set(ids)
+    return TreeView(name, lambda tree, node, depth: tree.get_id(node) in id_set, collapse)
+
+
+def depth_view(name, max_depth):
+    """
+    View of all nodes up to 'max_depth' (the root has depth 0).
+    """
+    return TreeView(name, lambda tree, node, depth: depth <= max_depth, collapse=False)
+
+
+def profile_view(name, profiles, min_profiles, collapse=True):
+    """
+    View of the nodes with at least 'min_profiles' profiles.
+    'profiles' is a dictionary of node id to list of accessions.
+    """
+    return TreeView(name, lambda tree, node, depth: len(profiles.get(tree.get_id(node), ())) >= min_profiles,
+                    collapse)
+
+
+class ViewPruning:
+    """
+    Nodes of several views of a tree, result of 'prune_views'.
+    'keep[node]' and 'emit[node]' are bit masks of the views (bit i for views[i]) the node is kept in
+    and part of, which is kept and not collapsed.
+    """
+
+    def __init__(self, views, keep, emit):
+        self.views = views
+        self.keep = keep
+        self.emit = emit
+
+    def view_size(self, index):
+        bit = 1 << index
+        return sum(1 for mask in self.emit.values() if mask & bit)
+
+
+def prune_views(tree, root, views):
+    """
+    Finds the nodes of all 'views' of the subtree of 'root' in one walk.
+    Returns a ViewPruning.
+    """
+    all_views = (1 << len(views)) - 1
+    collapsing = sum(1 << index for index, view in enumerate(views) if view.collapse)
+
+    keep, emit = {}, {}
+    # per node on the current path: [node, own marks, views kept by any child, views kept by several children]
+    path = []
+
+    for node, entering in tree.walk(root):
+        if entering:
+            depth = len(path)
+            marks = sum(1 << index for index, view in enumerate(views) if view.mark(tree, node, depth))
+            path.append([node, marks, 0, 0])
+            continue
+
+        _, marks, once, several = path.pop()
+        node_keep = all_views if not path else marks | once
+        keep[node] = node_keep
+        # collapsed where not marked and exactly one child is kept
+        emit[node] = node_keep & ~(collapsing & ~marks & once & ~several)
+
+        if path and node_keep:
+            parent = path[-1]
+            parent[3] |= parent[2] & node_keep
+            parent[2] |= node_keep
+
+    return ViewPruning(views, keep, emit)
+
+
+def walk_views(tree, root, pruning, view_emitters):
+    """
+    Walks the subtree of 'root' once and feeds every node to the emitters of all views it is part of.
+    'view_emitters' is a list with a list of emitters for every view of 'pruning'.
+    Returns the emitter results per view, as 'walk_tree' does for a single tree.
+    """
+    # emitters of every combination of views
+    emitters_of = {}
+
+    def emitters(mask):
+        if mask not in emitters_of:
+            emitters_of[mask] = [emitter for index, view in enumerate(view_emitters) if mask >> index & 1
+                                 for emitter in view]
+        return emitters_of[mask]
+
+    keep = pruning.keep
+    stack = [(root, True)]
+    while stack:
+        node, entering = stack.pop()
+        if entering:
+            for emitter in emitters(pruning.emit[node]):
+                emitter.enter(tree, node)
+            stack.append((node, False))
+            # pushed last to first, so children are visited in order
+            stack.extend((child, True) for child in reversed(list(tree.children(node))) if keep[child])
+        else:
+            for emitter in emitters(pruning.emit[node]):
+                emitter.exit(tree, node)
+
+    return [[emitter.result() for emitter in view] for view in view_emitters]